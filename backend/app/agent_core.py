@@ -1,85 +1,85 @@
 import os
-import re
+import asyncio
 import json
 from functools import partial
-from app import gemini_handler, filesystem_tools, session_manager, browser_tools, terminal_tools, memory_manager
+from app import gemini_handler, prompt_templates, plan_parser, plan_dependencies, filesystem_tools, workspace_tree, workspace_search, session_manager, browser_tools, terminal_tools, memory_manager
 from app.websocket_manager import ConnectionManager
 
-async def generate_plan(user_prompt: str) -> str:
+# Maximum number of independent plan steps executed at the same time
+MAX_PARALLEL_STEPS = int(os.getenv("AGENT_MAX_PARALLEL_STEPS", "4"))
+
+PROMPT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'prompt.md'))
+# The agent's constitution, loaded once and reloaded only when prompt.md changes on disk
+CONSTITUTION = prompt_templates.PromptTemplate(PROMPT_PATH, separator="\n\n## User Request\n")
+
+def _build_prompt(user_prompt: str) -> prompt_templates.RenderedPrompt:
+    """Combines the agent's constitution with the user's prompt."""
+    try:
+        return CONSTITUTION.render(user_prompt)
+    except FileNotFoundError:
+        # Handle case where the crucial prompt.md file is missing
+        raise FileNotFoundError(f"Critical error: prompt.md not found at {PROMPT_PATH}")
+
+
+async def generate_plan(user_prompt: str, use_cache: bool = True) -> str:
     """
     Generates a plan by combining the agent's constitution with the user's prompt
     and calling the Gemini API.
     """
     try:
-        # Construct path to the prompt file relative to this file's location for robustness
-        prompt_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'prompt.md'))
-        with open(prompt_path, 'r', encoding='utf-8') as f:
-            constitution = f.read()
-        
-        full_prompt = f"{constitution}\n\n## User Request\n{user_prompt}"
+        full_prompt = _build_prompt(user_prompt)
         
         # Call the Gemini handler to get the plan
-        plan = gemini_handler.call_gemini(full_prompt)
+        plan = await gemini_handler.call_gemini(full_prompt, use_cache=use_cache)
         return plan
     except FileNotFoundError:
-        # Handle case where the crucial prompt.md file is missing
-        raise FileNotFoundError(f"Critical error: prompt.md not found at {prompt_path}")
+        raise
     except Exception as e:
         # Catch-all for other potential errors during plan generation
         raise Exception(f"Failed to generate plan: {e}")
 
 
-def parse_plan(plan_text: str) -> list:
+async def stream_plan(user_prompt: str, use_cache: bool = True):
     """
-    (REFINED in Phase 5) Parses the raw markdown plan from the LLM into a structured list of commands.
-    This version robustly handles code fences with language specifiers (e.g., ```python).
+    Streaming counterpart of generate_plan: yields the plan text chunk by chunk as the
+    model produces it.
     """
-    commands = []
-    lines = plan_text.strip().split('\n')
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        if not line.startswith("- [ ]"):
-            i += 1
-            continue
-            
-        # Regex to capture TOOL_NAME and its arguments
-        match = re.match(r"- \[ \] (\w+):?\s*(.*)", line)
-        if not match:
-            i += 1
-            continue
-        
-        tool, args = match.groups()
-        
-        if tool == "ADD_CONTENT":
-            path = args.strip()
-            content_lines = []
-            i += 1
-            # Proactively handles code fences with or without language specifiers
-            if i < len(lines) and lines[i].strip().startswith("```"):
-                i += 1 # Move past the opening fence
-                # Read lines until the closing fence is found
-                while i < len(lines) and lines[i].strip() != "```":
-                    content_lines.append(lines[i])
-                    i += 1
-                i += 1 # Move past the closing fence
-            commands.append({"tool": tool, "path": path, "content": "\n".join(content_lines)})
-        else:
-            commands.append({"tool": tool, "args": args.strip()})
-            i += 1
-            
-    return commands
-
-
-async def execute_plan(commands: list, session_id: str, client_id: str, manager: ConnectionManager):
+    full_prompt = _build_prompt(user_prompt)
+    try:
+        async for chunk in gemini_handler.stream_gemini(full_prompt, use_cache=use_cache):
+            yield chunk
+    except Exception as e:
+        raise Exception(f"Failed to generate plan: {e}")
+
+
+def parse_plan(plan_text: str) -> list:
     """
-    Executes a parsed list of commands for a specific session, sending real-time updates.
+    Parses the raw markdown plan from the LLM into a structured list of commands.
+    See plan_parser.PlanParser, which also parses plans incrementally as they stream in.
     """
+    return plan_parser.parse_plan(plan_text)
+
+
+async def _iterate_commands(commands):
+    """Yields commands from either a plain list or an async stream of commands."""
+    if hasattr(commands, "__aiter__"):
+        async for command in commands:
+            yield command
+    else:
+        for command in commands:
+            yield command
+
+
+# Steps that observe or replace workspace files; buffered writes are flushed before they run
+FLUSH_BEFORE = {"READ_FILE_CONTENT", "LIST_DIRECTORY_CONTENTS", "SEARCH_FILES", "DELETE_FILE", "DELETE_FOLDER", "EXECUTE_COMMAND", "TAKE_SCREENSHOT"}
+
+def _build_tool_map(session_id: str, write_buffer: filesystem_tools.WriteBuffer, on_output=None) -> dict:
+    """Maps every tool name in a plan to its implementation, bound to the session."""
     # Use functools.partial to pre-fill the session_id for all filesystem tool functions
-    tool_map = {
-        "CREATE_FILE": partial(filesystem_tools.create_file, session_id=session_id),
-        "CREATE_FOLDER": partial(filesystem_tools.create_folder, session_id=session_id),
-        "ADD_CONTENT": partial(filesystem_tools.add_content, session_id=session_id),
+    return {
+        "CREATE_FILE": write_buffer.create_file,
+        "CREATE_FOLDER": write_buffer.create_folder,
+        "ADD_CONTENT": write_buffer.add_content,
         "DELETE_FILE": partial(filesystem_tools.delete_file, session_id=session_id),
         "DELETE_FOLDER": partial(filesystem_tools.delete_folder, session_id=session_id),
         "NAVIGATE_TO_URL": partial(browser_tools.navigate_to_url, session_id=session_id),
@@ -87,105 +87,278 @@ async def execute_plan(commands: list, session_id: str, client_id: str, manager:
         "EXTRACT_CONTENT": partial(browser_tools.extract_content, session_id=session_id),
         "INTERACT_WITH_ELEMENT": partial(browser_tools.interact_with_element, session_id=session_id),
         "TAKE_SCREENSHOT": partial(browser_tools.take_screenshot, session_id=session_id),
-        "EXECUTE_COMMAND": partial(terminal_tools.execute_command, session_id=session_id),
+        "EXECUTE_COMMAND": partial(terminal_tools.execute_command, session_id=session_id, on_output=on_output),
         "SAVE_KNOWLEDGE": partial(memory_manager.save_knowledge, session_id=session_id),
         "RETRIEVE_KNOWLEDGE": partial(memory_manager.retrieve_knowledge, session_id=session_id),
         "UPDATE_PERSONA": partial(memory_manager.update_persona, session_id=session_id),
         "LIST_DIRECTORY_CONTENTS": partial(filesystem_tools.list_directory_contents, session_id=session_id),
         "READ_FILE_CONTENT": partial(filesystem_tools.read_file_content, session_id=session_id),
+        "SEARCH_FILES": partial(workspace_search.search_files, session_id=session_id),
     }
 
-    for command in commands:
-        tool_name = command["tool"]
-        current_task_message = f"{tool_name}: {command.get('path') or command.get('args')}"
-        
-        # Notify frontend that a task is starting
-        await manager.send_personal_message({"type": "task_start", "data": current_task_message}, client_id)
-
-        if tool_name in tool_map:
-            try:
-                func = tool_map[tool_name]
-                if tool_name == "ADD_CONTENT":
-                    result = await func(path=command["path"], content=command["content"])
-                elif tool_name == "CREATE_FILE" or tool_name == "CREATE_FOLDER" or tool_name == "DELETE_FILE" or tool_name == "DELETE_FOLDER":
-                    result = await func(command["args"])
-                elif tool_name == "EXECUTE_COMMAND":
-                    result = await func(command=command["args"])
-                elif tool_name == "NAVIGATE_TO_URL":
-                    result = await func(url=command["args"])
-                elif tool_name == "WEB_SEARCH":
-                    result = await func(query=command["args"])
-                elif tool_name == "EXTRACT_CONTENT":
-                    args_parts = command["args"].split(maxsplit=1)
-                    url = args_parts[0]
-                    format_arg = args_parts[1] if len(args_parts) > 1 else "text"
-                    result = await func(url=url, format=format_arg)
-                elif tool_name == "INTERACT_WITH_ELEMENT":
-                    args_parts = command["args"].split(maxsplit=3)
-                    url = args_parts[0]
-                    selector = args_parts[1]
-                    action = args_parts[2]
-                    value = args_parts[3] if len(args_parts) > 3 else None
-                    result = await func(url=url, selector=selector, action=action, value=value)
-                elif tool_name == "TAKE_SCREENSHOT":
-                    args_parts = command["args"].split(maxsplit=1)
-                    url = args_parts[0]
-                    path = args_parts[1] if len(args_parts) > 1 else "screenshot.png"
-                    result = await func(url=url, path=path)
-                elif tool_name == "SAVE_KNOWLEDGE":
-                    args_parts = command["args"].split(maxsplit=1)
-                    key = args_parts[0]
-                    value = args_parts[1]
-                    result = await func(key=key, value=value)
-                elif tool_name == "RETRIEVE_KNOWLEDGE":
-                    args_parts = command["args"].split(maxsplit=1)
-                    key = args_parts[0]
-                    default = args_parts[1] if len(args_parts) > 1 else None
-                    result = await func(key=key, default=default)
-                elif tool_name == "UPDATE_PERSONA":
-                    persona_data = json.loads(command["args"])
-                    result = await func(persona_data=persona_data)
-                elif tool_name == "LIST_DIRECTORY_CONTENTS":
-                    result = await func(path=command["args"])
-                elif tool_name == "READ_FILE_CONTENT":
-                    result = await func(path=command["args"])
-                
+
+async def _run_tool(func, tool_name: str, command: dict):
+    """Calls a tool with the arguments parsed from its plan step."""
+    if tool_name == "ADD_CONTENT":
+        result = await func(path=command["path"], content=command["content"])
+    elif tool_name == "CREATE_FILE" or tool_name == "CREATE_FOLDER" or tool_name == "DELETE_FILE" or tool_name == "DELETE_FOLDER":
+        result = await func(command["args"])
+    elif tool_name == "EXECUTE_COMMAND":
+        result = await func(command=command["args"])
+    elif tool_name == "NAVIGATE_TO_URL":
+        result = await func(url=command["args"])
+    elif tool_name == "WEB_SEARCH":
+        result = await func(query=command["args"])
+    elif tool_name == "EXTRACT_CONTENT":
+        args_parts = command["args"].split(maxsplit=1)
+        url = args_parts[0]
+        format_arg = args_parts[1] if len(args_parts) > 1 else "text"
+        result = await func(url=url, format=format_arg)
+    elif tool_name == "INTERACT_WITH_ELEMENT":
+        args_parts = command["args"].split(maxsplit=3)
+        url = args_parts[0]
+        selector = args_parts[1]
+        action = args_parts[2]
+        value = args_parts[3] if len(args_parts) > 3 else None
+        result = await func(url=url, selector=selector, action=action, value=value)
+    elif tool_name == "TAKE_SCREENSHOT":
+        args_parts = command["args"].split(maxsplit=1)
+        url = args_parts[0]
+        path = args_parts[1] if len(args_parts) > 1 else "screenshot.png"
+        result = await func(url=url, path=path)
+    elif tool_name == "SAVE_KNOWLEDGE":
+        args_parts = command["args"].split(maxsplit=1)
+        key = args_parts[0]
+        value = args_parts[1]
+        result = await func(key=key, value=value)
+    elif tool_name == "RETRIEVE_KNOWLEDGE":
+        args_parts = command["args"].split(maxsplit=1)
+        key = args_parts[0]
+        default = args_parts[1] if len(args_parts) > 1 else None
+        result = await func(key=key, default=default)
+    elif tool_name == "UPDATE_PERSONA":
+        persona_data = json.loads(command["args"])
+        result = await func(persona_data=persona_data)
+    elif tool_name == "LIST_DIRECTORY_CONTENTS":
+        result = await func(path=command["args"])
+    elif tool_name == "READ_FILE_CONTENT":
+        result = await func(path=command["args"])
+    elif tool_name == "SEARCH_FILES":
+        # Optional leading flags: --regex, --case-sensitive, --glob=PATTERN; the rest is the query
+        options = {"regex": False, "case_sensitive": False, "glob": None}
+        args_parts = command["args"].split(" ")
+        while args_parts and args_parts[0].startswith("--"):
+            flag = args_parts.pop(0)
+            if flag == "--regex":
+                options["regex"] = True
+            elif flag == "--case-sensitive":
+                options["case_sensitive"] = True
+            elif flag.startswith("--glob="):
+                options["glob"] = flag[len("--glob="):]
+            else:
+                raise ValueError(f"Unknown SEARCH_FILES option: {flag}")
+        result = await func(query=" ".join(args_parts), **options)
+    return result
+
+
+async def execute_plan(commands: list, session_id: str, client_id: str, manager: ConnectionManager, max_parallel: int = MAX_PARALLEL_STEPS):
+    """
+    Executes a parsed list of commands for a specific session, sending real-time updates.
+    `commands` may also be an async iterable, in which case each command runs as soon as it arrives.
+
+    File creation and appends go through a per-plan write buffer (see filesystem_tools.WriteBuffer)
+    that is flushed before steps which read the workspace and once the plan is done.
+
+    Steps that cannot affect each other (see plan_dependencies) run concurrently, at most
+    `max_parallel` at a time. Each step's "task_start" is sent when it actually starts, while
+    results ("task_complete", "warning", "finish") are always reported in plan order. On the first
+    failing step nothing new is started; steps already running are allowed to finish and are
+    reported, and the "error" is sent last.
+    """
+    async def send_command_output(stream: str, text: str):
+        # Command output is forwarded live, as the command produces it
+        await manager.send_session_message({"type": "command_output", "stream": stream, "data": text}, session_id, client_id)
+
+    write_buffer = filesystem_tools.WriteBuffer(session_id)
+    tool_map = _build_tool_map(session_id, write_buffer, on_output=send_command_output)
+    graph = plan_dependencies.DependencyGraph()
+    slots = asyncio.Semaphore(max(1, max_parallel))
+    failed = asyncio.Event()
+    scheduled = asyncio.Queue() # (task message, step task) in plan order; None once dispatching ends
+
+    async def run_step(command: dict, current_task_message: str, dependencies: list):
+        if dependencies:
+            await asyncio.wait(dependencies)
+        async with slots:
+            if failed.is_set():
+                return None # Skipped: an earlier step failed
+
+            # Notify frontend that a task is starting
+            await manager.send_session_message({"type": "task_start", "data": current_task_message}, session_id, client_id)
+
+            tool_name = command["tool"]
+            if tool_name in tool_map:
+                try:
+                    if tool_name in FLUSH_BEFORE:
+                        await write_buffer.flush()
+                    try:
+                        result = await _run_tool(tool_map[tool_name], tool_name, command)
+                    finally:
+                        if tool_name in ("EXECUTE_COMMAND", "TAKE_SCREENSHOT"):
+                            # Don't wait for the workspace watcher to notice what the command or screenshot changed
+                            workspace_tree.invalidate(session_id)
+                    return ("task_complete", result)
+                except Exception as e:
+                    failed.set()
+                    return ("error", f"Error executing '{current_task_message}': {e}")
+            elif tool_name == "FINISH":
+                # Everything the plan wrote must be on disk before the user is told it is done
+                try:
+                    await write_buffer.flush()
+                except Exception as e:
+                    failed.set()
+                    return ("error", f"Error executing '{current_task_message}': {e}")
+                return ("finish", command["args"])
+            else:
+                # Handle unknown tools gracefully
+                return ("warning", f"Unknown tool '{tool_name}' found in plan. Skipping.")
+
+    async def dispatch():
+        try:
+            async for command in _iterate_commands(commands):
+                if failed.is_set():
+                    break # Stop execution on error
+                current_task_message = f"{command['tool']}: {command.get('path') or command.get('args')}"
+                step = asyncio.get_running_loop().create_future()
+                dependencies = graph.add(step, plan_dependencies.command_access(command))
+                task = asyncio.create_task(run_step(command, current_task_message, dependencies))
+                task.add_done_callback(lambda t, step=step: step.set_result(None))
+                scheduled.put_nowait((current_task_message, task))
+        finally:
+            scheduled.put_nowait(None)
+
+    dispatcher = asyncio.create_task(dispatch())
+    error_message = None
+    try:
+        while True:
+            entry = await scheduled.get()
+            if entry is None:
+                break
+            current_task_message, task = entry
+            outcome = await task
+            if outcome is None:
+                continue
+            kind, payload = outcome
+
+            if kind == "error":
+                if error_message is None:
+                    error_message = payload
+                    # Don't wait for the rest of the plan (e.g. a stream still being generated)
+                    dispatcher.cancel()
+            elif kind == "task_complete":
                 # Notify frontend that the task is complete
-                await manager.send_personal_message({"type": "task_complete", "data": current_task_message, "result": result}, client_id)
+                await manager.send_session_message({"type": "task_complete", "data": current_task_message, "result": payload}, session_id, client_id)
+            elif kind == "finish":
+                session_manager.append_to_history(session_id, {"type": "agent", "text": payload})
+                await manager.send_session_message({"type": "finish", "data": payload}, session_id, client_id)
+            elif kind == "warning":
+                await manager.send_session_message({"type": "warning", "data": payload}, session_id, client_id)
 
+        # Writes of the steps that completed must land even if a later step failed
+        try:
+            await write_buffer.flush()
+        except Exception as e:
+            if error_message is None:
+                error_message = f"Error writing workspace files: {e}"
+
+        if error_message is not None:
+            await manager.send_session_message({"type": "error", "data": error_message}, session_id, client_id)
+    finally:
+        if not dispatcher.done():
+            dispatcher.cancel()
+    try:
+        await dispatcher
+    except asyncio.CancelledError:
+        pass
 
 
+async def run_streaming_plan(user_prompt: str, session_id: str, client_id: str, manager: ConnectionManager, use_cache: bool = True):
+    """
+    Streams the plan from the LLM and executes each step as soon as it has been fully
+    generated, so execution overlaps with the generation of the remaining steps.
+    """
+    parser = plan_parser.PlanParser()
+    queue = asyncio.Queue()
+    plan_parts = []
+
+    async def produce():
+        # FINISH is held back until the whole plan has arrived so it is always reported last
+        deferred = []
 
+        def dispatch(commands):
+            for command in commands:
+                if command["tool"] == "FINISH":
+                    deferred.append(command)
+                else:
+                    queue.put_nowait(command)
 
-            except Exception as e:
-                error_message = f"Error executing '{current_task_message}': {e}"
-                await manager.send_personal_message({"type": "error", "data": error_message}, client_id)
-                break # Stop execution on error
-        elif tool_name == "FINISH":
-            final_message = command["args"]
-            session_manager.append_to_history(session_id, {"type": "agent", "text": final_message})
-            await manager.send_personal_message({"type": "finish", "data": final_message}, client_id)
-        else:
-            # Handle unknown tools gracefully
-            unknown_tool_message = f"Unknown tool '{tool_name}' found in plan. Skipping."
-            await manager.send_personal_message({"type": "warning", "data": unknown_tool_message}, client_id)
+        try:
+            async for chunk in stream_plan(user_prompt, use_cache=use_cache):
+                plan_parts.append(chunk)
+                await manager.send_session_message({"type": "plan_chunk", "data": chunk}, session_id, client_id)
+                dispatch(parser.feed(chunk))
+            dispatch(parser.close())
 
+            # Log the complete plan and send it to the frontend
+            plan_text = "".join(plan_parts)
+            session_manager.append_to_history(session_id, {"type": "agent_plan_text", "text": plan_text})
+            await manager.send_session_message({"type": "plan", "data": plan_text}, session_id, client_id)
+            for command in deferred:
+                queue.put_nowait(command)
+        finally:
+            queue.put_nowait(None)
 
-async def run_agent_task(user_prompt: str, session_id: str, client_id: str, manager: ConnectionManager):
+    async def commands():
+        while True:
+            command = await queue.get()
+            if command is None:
+                return
+            yield command
+
+    producer = asyncio.create_task(produce())
+    try:
+        await execute_plan(commands(), session_id, client_id, manager)
+    finally:
+        # Execution stopped early (error) -- there is no point in generating the rest of the plan
+        if not producer.done():
+            producer.cancel()
+    try:
+        await producer
+    except asyncio.CancelledError:
+        pass
+
+
+async def run_agent_task(user_prompt: str, session_id: str, client_id: str, manager: ConnectionManager, stream: bool = False, use_cache: bool = True):
     """
     The main orchestrator for an agent task. It generates, logs, and executes a plan.
+    With `stream` enabled, steps are executed while the plan is still being generated;
+    `use_cache=False` forces a fresh plan instead of a cached LLM response.
     """
     try:
         # Log user prompt and notify frontend
         session_manager.append_to_history(session_id, {"type": "user", "text": user_prompt})
-        await manager.send_personal_message({"type": "status", "data": "Generating plan..."}, client_id)
+        await manager.send_session_message({"type": "status", "data": "Generating plan..."}, session_id, client_id)
+
+        if stream:
+            await run_streaming_plan(user_prompt, session_id, client_id, manager, use_cache=use_cache)
+            return
         
         # Generate the plan from the LLM
-        plan_text = await generate_plan(user_prompt)
+        plan_text = await generate_plan(user_prompt, use_cache=use_cache)
         
         # Log the raw plan and send it to the frontend
         session_manager.append_to_history(session_id, {"type": "agent_plan_text", "text": plan_text})
-        await manager.send_personal_message({"type": "plan", "data": plan_text}, client_id)
+        await manager.send_session_message({"type": "plan", "data": plan_text}, session_id, client_id)
         
         # Parse and execute the plan
         commands = parse_plan(plan_text)
@@ -195,4 +368,7 @@ async def run_agent_task(user_prompt: str, session_id: str, client_id: str, mana
         error_message = f"An error occurred in the agent core: {e}"
         # Log any errors and notify the frontend
         session_manager.append_to_history(session_id, {"type": "error", "text": error_message})
-        await manager.send_personal_message({"type": "error", "data": error_message}, client_id)
+        await manager.send_session_message({"type": "error", "data": error_message}, session_id, client_id)
+    finally:
+        # The task is over: write out its history and release the session's writer
+        await session_manager.close_history(session_id)
@@ -1,120 +1,632 @@
 
+import os
+import time
 import asyncio
-from playwright.async_api import async_playwright, Page, expect
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from playwright.async_api import async_playwright, Error as PlaywrightError
+from app import web_fetch
+from app.html_markdown import html_to_markdown
+from app.web_search import search_url, parse_result_links, build_digest, WEB_SEARCH_RESULTS, WEB_SEARCH_PAGE_TIMEOUT
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Most browser contexts leased to sessions at once; the least recently used idle one is evicted
+BROWSER_MAX_CONTEXTS = int(os.getenv("BROWSER_MAX_CONTEXTS", "8"))
+# Contexts kept ready (with a blank page) for sessions that have none yet
+BROWSER_WARM_CONTEXTS = int(os.getenv("BROWSER_WARM_CONTEXTS", "2"))
+# Most pages open at once across all contexts
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", "16"))
+# Leased contexts unused for this long are closed
+BROWSER_IDLE_TIMEOUT = float(os.getenv("BROWSER_IDLE_TIMEOUT", "600"))
+# Default timeout of page operations, in milliseconds
+BROWSER_TIMEOUT_MS = int(os.getenv("BROWSER_TIMEOUT_MS", "30000"))
+
+DEFAULT_SESSION = "default"
+
+
+class BrowserCrashed(Exception):
+    """The browser or the page crashed during an operation; a retry gets a fresh context."""
+
+
+class LeasedContext:
+    """An isolated browser context (cookies, storage) with its main page, leased to one session."""
+    def __init__(self, context, page):
+        self.context = context
+        self.page = page
+        self.session_id = None
+        self.lock = asyncio.Lock() # one operation on the main page at a time
+        self.last_used = time.monotonic()
+        self.extra_pages = 0 # tabs opened with BrowserPool.tab()
+        self.interacted_hosts = set() # hosts whose pages were clicked or filled in, e.g. to log in
+        self.closed = False
+        self.crashed = False
+
+    @property
+    def idle(self) -> bool:
+        return not self.lock.locked() and self.extra_pages == 0
+
+
+class BrowserPool:
+    """
+    One long-lived Chromium process whose isolated contexts are leased to sessions.
+
+    A few contexts are kept pre-warmed, so a session's first browser step neither launches the
+    browser nor creates a context. A session keeps its context, and so its page, cookies and
+    storage, between steps. At most `max_contexts` are leased and at most `max_pages` pages
+    are open: beyond that, the least recently used idle context is closed. If the browser
+    crashes it is relaunched on next use; a crashed page or context is replaced.
+    """
+    def __init__(self, max_contexts: int = BROWSER_MAX_CONTEXTS, warm_contexts: int = BROWSER_WARM_CONTEXTS, max_pages: int = BROWSER_MAX_PAGES, idle_timeout: float = BROWSER_IDLE_TIMEOUT):
+        self.max_contexts = max_contexts
+        self.warm_contexts = warm_contexts
+        self.max_pages = max_pages
+        self.idle_timeout = idle_timeout
+        self._playwright = None
+        self._browser = None
+        self._start_lock = None
+        self._assign_lock = None
+        self._page_freed = None
+        self._leased = OrderedDict() # session id -> LeasedContext, least recently used first
+        self._pending_urls = {} # session id -> URL navigated to over HTTP, where its page has not gone yet
+        self._warm = []
+        self._open_pages = 0
+        self._warming = None
+        self._reaper = None
+        self._closing = False
+        self.launches = 0
+        self.crashes = 0
+        self.evictions = 0
+
+    # --- BROWSER ---
+
+    async def start(self):
+        """Launches the browser if it is not running and starts pre-warming contexts."""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+            self._assign_lock = asyncio.Lock()
+            self._page_freed = asyncio.Event()
+        async with self._start_lock:
+            if self._browser is None or not self._browser.is_connected():
+                logger.info("Launching Playwright browser...")
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                browser = await self._playwright.chromium.launch(headless=True)
+                browser.on("disconnected", self._on_disconnected)
+                self._browser = browser
+                self._closing = False
+                self.launches += 1
+                logger.info("Playwright browser launched.")
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+        self._schedule_warming()
+
+    def _on_disconnected(self, browser):
+        if browser is not self._browser:
+            return
+        if not self._closing:
+            self.crashes += 1
+            logger.error("Playwright browser disconnected; it will be relaunched on next use.")
+        # Every context died with the browser, and with them what the sessions rendered in them
+        for leased in list(self._leased.values()) + self._warm:
+            leased.closed = True
+            if leased.session_id is not None:
+                web_fetch.extraction_cache.discard_session(leased.session_id)
+        self._leased.clear()
+        self._warm = []
+        self._open_pages = 0
+        self._browser = None
+        if self._page_freed is not None:
+            self._page_freed.set()
+
+    async def close(self):
+        for task in (self._warming, self._reaper):
+            if task is not None:
+                task.cancel()
+        if self._start_lock is None:
+            return # Never started
+        # Wait for a launch in progress, whose half-started driver could not be stopped otherwise
+        async with self._start_lock:
+            if self._browser is not None:
+                logger.info("Closing Playwright browser...")
+                self._closing = True
+                await self._browser.close()
+                self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+                logger.info("Playwright browser closed.")
+
+    # --- CONTEXTS AND PAGES ---
+
+    async def _acquire_page_slot(self):
+        while self._open_pages >= self.max_pages:
+            if not self._evict_one():
+                self._page_freed.clear()
+                await self._page_freed.wait()
+        self._open_pages += 1
+
+    def _release_page_slots(self, count: int):
+        self._open_pages = max(0, self._open_pages - count)
+        self._page_freed.set()
+
+    def _evict_one(self) -> bool:
+        """Closes a warm context, or else the least recently used idle leased one."""
+        if self._warm:
+            self._discard(self._warm[0])
+            return True
+        victim = next((leased for leased in self._leased.values() if leased.idle), None)
+        if victim is None:
+            return False
+        logger.info(f"[{victim.session_id}] Evicting idle browser context.")
+        self.evictions += 1
+        self._discard(victim)
+        return True
+
+    def _discard(self, leased: LeasedContext):
+        """Forgets a context, frees its page slots and closes it in the background."""
+        if leased.closed:
+            return
+        leased.closed = True
+        if leased in self._warm:
+            self._warm.remove(leased)
+        if leased.session_id is not None:
+            if self._leased.get(leased.session_id) is leased:
+                del self._leased[leased.session_id]
+            # Pages rendered with this context's cookies are not served to its successor
+            web_fetch.extraction_cache.discard_session(leased.session_id)
+        self._release_page_slots(1 + leased.extra_pages)
+        asyncio.create_task(self._close_quietly(leased.context))
+
+    async def _close_quietly(self, target):
+        try:
+            await target.close()
+        except Exception:
+            pass # Already gone with a crashed browser
+
+    async def _new_context(self) -> LeasedContext:
+        await self._acquire_page_slot()
+        try:
+            context = await self._browser.new_context()
+            page = await context.new_page()
+        except Exception:
+            self._release_page_slots(1)
+            raise
+        context.set_default_timeout(BROWSER_TIMEOUT_MS)
+        leased = LeasedContext(context, page)
+        page.on("crash", lambda _: setattr(leased, "crashed", True))
+        return leased
+
+    def _schedule_warming(self):
+        if self._warming is None or self._warming.done():
+            self._warming = asyncio.create_task(self._warm_up())
+
+    async def _warm_up(self):
+        try:
+            while (len(self._warm) < self.warm_contexts
+                   and len(self._leased) + len(self._warm) < self.max_contexts
+                   and self._open_pages < self.max_pages
+                   and self._browser is not None):
+                self._warm.append(await self._new_context())
+        except Exception as e:
+            logger.error(f"Failed to pre-warm a browser context: {e}")
+
+    async def _get(self, session_id: str) -> LeasedContext:
+        await self.start()
+        async with self._assign_lock:
+            leased = self._leased.get(session_id)
+            if leased is not None and not leased.closed and not leased.crashed:
+                self._leased.move_to_end(session_id)
+                return leased
+            if leased is not None:
+                self._discard(leased)
+            if len(self._leased) >= self.max_contexts:
+                victim = next((other for other in self._leased.values() if other.idle), None)
+                if victim is not None:
+                    self.evictions += 1
+                    self._discard(victim)
+            leased = self._warm.pop(0) if self._warm else await self._new_context()
+            leased.session_id = session_id
+            self._leased[session_id] = leased
+        self._schedule_warming()
+        return leased
+
+    @asynccontextmanager
+    async def lease(self, session_id: str):
+        """Holds the session's main page for one operation. Raises BrowserCrashed on a crash."""
+        leased = await self._get(session_id)
+        async with leased.lock:
+            leased.last_used = time.monotonic()
+            try:
+                if leased.page.is_closed():
+                    leased.page = await leased.context.new_page()
+                yield leased.page
+            except PlaywrightError as e:
+                if leased.crashed or leased.closed or self._browser is None or not self._browser.is_connected():
+                    self._discard(leased)
+                    raise BrowserCrashed(str(e)) from e
+                raise
+            finally:
+                leased.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def tab(self, session_id: str):
+        """Opens an extra page in the session's context, counted against the page cap."""
+        leased = await self._get(session_id)
+        # Counted before waiting for a slot, so that making room never evicts this very context
+        leased.extra_pages += 1
+        try:
+            await self._acquire_page_slot()
+        except BaseException:
+            leased.extra_pages -= 1
+            if leased.closed:
+                self._open_pages += 1 # _discard freed the slot this tab never got
+            raise
+        page = None
+        try:
+            page = await leased.context.new_page()
+            yield page
+        finally:
+            if page is not None:
+                await self._close_quietly(page)
+            leased.extra_pages -= 1
+            if not leased.closed:
+                self._release_page_slots(1)
+            leased.last_used = time.monotonic()
+
+    def current_url(self, session_id: str):
+        """The URL the session's page is on, or None if it has no page."""
+        leased = self._leased.get(session_id)
+        if leased is None or leased.closed or leased.page.is_closed():
+            return None
+        return leased.page.url
+
+    def set_pending_url(self, session_id: str, url: str):
+        """Records that the session navigated to `url` without its browser page going there."""
+        self._pending_urls[session_id] = url
+
+    def pending_url(self, session_id: str):
+        return self._pending_urls.get(session_id)
+
+    def clear_pending_url(self, session_id: str):
+        self._pending_urls.pop(session_id, None)
+
+    def interacted(self, session_id: str, url: str) -> bool:
+        """Whether the session's context has interacted with pages of the host of `url`."""
+        leased = self._leased.get(session_id)
+        if leased is None or leased.closed:
+            return False
+        return web_fetch._host(url) in leased.interacted_hosts
+
+    def record_interaction(self, session_id: str, url: str):
+        """
+        Notes that the session interacted with a page, which may have changed what its cookies
+        show (a login, say): its cached renderings are dropped, and pages of that host are no
+        longer served from the shared cookie-less copy.
+        """
+        leased = self._leased.get(session_id)
+        if leased is not None and not leased.closed:
+            leased.interacted_hosts.add(web_fetch._host(url))
+        web_fetch.extraction_cache.discard_session(session_id)
+
+    async def release(self, session_id: str):
+        """Closes a session's context."""
+        self._pending_urls.pop(session_id, None)
+        leased = self._leased.get(session_id)
+        if leased is not None:
+            self._discard(leased)
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(max(1.0, min(60.0, self.idle_timeout / 2)))
+            now = time.monotonic()
+            for leased in list(self._leased.values()):
+                if leased.idle and now - leased.last_used > self.idle_timeout:
+                    logger.info(f"[{leased.session_id}] Closing browser context idle for {now - leased.last_used:.0f}s.")
+                    self._discard(leased)
+            self._schedule_warming()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._browser is not None,
+            "launches": self.launches,
+            "crashes": self.crashes,
+            "evictions": self.evictions,
+            "leased": len(self._leased),
+            "warm": len(self._warm),
+            "open_pages": self._open_pages,
+            "max_pages": self.max_pages,
+        }
+
+
+browser_pool = BrowserPool()
+
+async def _on_page(session_id: str, action, url: str = None):
+    """
+    Runs `action(page)` on the session's page, retrying once on a fresh context after a crash.
+    `url` is the page the action goes to; without one it acts on the page the session is on,
+    which the browser first goes to if navigate_to_url only fetched it over HTTP.
+    """
+    session_id = session_id or DEFAULT_SESSION
+    async def run(page):
+        if url is None:
+            await _goto_if_needed(page, browser_pool.pending_url(session_id))
+        browser_pool.clear_pending_url(session_id)
+        return await action(page)
+    try:
+        async with browser_pool.lease(session_id) as page:
+            return await run(page)
+    except BrowserCrashed as e:
+        logger.warning(f"[{session_id}] Browser crashed ({e}); retrying on a fresh context.")
+        async with browser_pool.lease(session_id) as page:
+            return await run(page)
+
+async def _goto_if_needed(page, url: str):
+    if url and page.url != url:
+        await page.goto(url, wait_until="domcontentloaded")
+
+def _browser_reason(url: str, session_id: str):
+    """Why `url` must be rendered in the session's browser rather than fetched without cookies, or None."""
+    if browser_pool.interacted(session_id, url):
+        return "session interacted with the site"
+    return web_fetch.browser_reason(url)
+
+
+# --- SESSION-AWARE TOOLS ---
+# The functions the agent's plan steps call, each on the page of the session's leased context.
+
+async def navigate_to_url(url: str, session_id: str = None) -> str:
+    """
+    Navigates to the specified URL. A static page is only fetched over HTTP (and its content
+    cached for EXTRACT_CONTENT); the browser goes there when a later step acts on the page.
+    """
+    started = time.monotonic()
+    session_id = session_id or DEFAULT_SESSION
+    reason = _browser_reason(url, session_id)
+    if reason is None:
+        contents, reason = await web_fetch.fetch_extractions(url)
+        if contents is not None:
+            browser_pool.set_pending_url(session_id, url)
+            web_fetch.record("navigate", url, "http", started=started)
+            logger.info(f"Fetched {url} over HTTP")
+            return f"Successfully navigated to {url}"
+    async def go(page):
+        await page.goto(url, wait_until="domcontentloaded")
+        return f"Successfully navigated to {url}"
+    try:
+        logger.info(f"Navigating to {url} in the browser ({reason})")
+        result = await _on_page(session_id, go, url)
+        web_fetch.record("navigate", url, "browser", reason, started)
+        return result
+    except Exception as e:
+        logger.error(f"Error navigating to {url}: {e}")
+        return f"Error navigating to {url}: {e}"
+
+async def _extract_from_page(page, format: str) -> str:
+    if format == "html":
+        return await page.content()
+    if format == "markdown":
+        return html_to_markdown(await page.content(), base_url=page.url)
+    return await page.evaluate("document.body.innerText")
+
+async def extract_content(url: str, format: str = "text", session_id: str = None) -> str:
+    """
+    Extracts the content of a page as "text", "html" or "markdown" (main content only).
+    Extractions are cached per URL, and static pages are fetched over HTTP without the browser.
+    The page the session is on is always read live, as it may have been interacted with, and
+    what the session's browser rendered is only cached for that session.
+    """
+    started = time.monotonic()
+    format = format.lower() if format.lower() in web_fetch.FORMATS else "text"
+    session_id = session_id or DEFAULT_SESSION
+    if browser_pool.current_url(session_id) == url:
+        reason = "live page"
+    else:
+        shared = not browser_pool.interacted(session_id, url)
+        cached = await web_fetch.extraction_cache.get(url, format, session_id, shared=shared)
+        if cached is not None:
+            web_fetch.record("extract", url, "cache", started=started)
+            logger.info(f"Serving cached {format} content of {url}")
+            return cached
+        reason = _browser_reason(url, session_id)
+        if reason is None:
+            contents, reason = await web_fetch.fetch_extractions(url, (format,))
+            if contents is not None:
+                web_fetch.record("extract", url, "http", started=started)
+                logger.info(f"Extracted {format} content of {url} over HTTP")
+                return contents[format]
+    async def extract(page):
+        response = None
+        if page.url != url:
+            response = await page.goto(url, wait_until="domcontentloaded")
+        content = await _extract_from_page(page, format)
+        if response is not None and response.ok:
+            web_fetch.extraction_cache.put(url, format, content, await response.all_headers(), session_id)
+        return content
+    try:
+        logger.info(f"Extracting {format} content from {url} in the browser ({reason})")
+        content = await _on_page(session_id, extract, url)
+        web_fetch.confirm_javascript(url, reason, content)
+        web_fetch.record("extract", url, "browser", reason, started)
+        return content
+    except Exception as e:
+        logger.error(f"Error extracting content from {url}: {e}")
+        return f"Error extracting content from {url}: {e}"
+
+async def interact_with_element(url: str, selector: str, action: str, value: str = None, session_id: str = None) -> str:
+    """Performs `action` (click, fill, type, press, hover, check, select) on an element of the page at `url`."""
+    async def interact(page):
+        await _goto_if_needed(page, url)
+        # Whatever comes of it, the site may show this session something else afterwards (after a login, say)
+        browser_pool.record_interaction(session_id, page.url)
+        if action == "click":
+            await page.click(selector)
+        elif action == "fill":
+            await page.fill(selector, value or "")
+        elif action == "type":
+            await page.type(selector, value or "")
+        elif action == "press":
+            await page.press(selector, value or "Enter")
+        elif action == "hover":
+            await page.hover(selector)
+        elif action == "check":
+            await page.check(selector)
+        elif action == "select":
+            await page.select_option(selector, value)
+        else:
+            return f"Error: Unknown action '{action}' for element {selector}"
+        browser_pool.record_interaction(session_id, page.url) # where the action led
+        return f"Performed '{action}' on element {selector}"
+    session_id = session_id or DEFAULT_SESSION
+    try:
+        logger.info(f"Interacting with element {selector}: {action}")
+        return await _on_page(session_id, interact, url)
+    except Exception as e:
+        logger.error(f"Error interacting with element {selector}: {e}")
+        return f"Error interacting with element {selector}: {e}"
+
+async def take_screenshot(url: str, path: str = "screenshot.png", session_id: str = None) -> str:
+    """Takes a screenshot of the page at `url` and saves it to `path` in the session's workspace."""
+    # Imported here, as filesystem_tools is only needed for this tool
+    from app import filesystem_tools
+    async def shoot(page):
+        await _goto_if_needed(page, url)
+        target = filesystem_tools._get_safe_path(path, session_id) if session_id else path
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        await page.screenshot(path=target, full_page=True)
+        return f"Screenshot saved to {path}"
+    try:
+        logger.info(f"Taking screenshot of {url} to {path}")
+        return await _on_page(session_id, shoot, url)
+    except Exception as e:
+        logger.error(f"Error taking screenshot: {e}")
+        return f"Error taking screenshot: {e}"
+
+async def _read_search_result(url: str, session_id: str) -> str:
+    """Markdown of one search result: cached, fetched over HTTP, or rendered in a new tab of the session's context."""
+    started = time.monotonic()
+    shared = not browser_pool.interacted(session_id, url)
+    cached = await web_fetch.extraction_cache.get(url, "markdown", session_id, shared=shared)
+    if cached is not None:
+        web_fetch.record("search_result", url, "cache", started=started)
+        return cached
+    reason = _browser_reason(url, session_id)
+    if reason is None:
+        contents, reason = await web_fetch.fetch_extractions(url, ("markdown",))
+        if contents is not None:
+            web_fetch.record("search_result", url, "http", started=started)
+            return contents["markdown"]
+    async with browser_pool.tab(session_id) as page:
+        response = await page.goto(url, wait_until="domcontentloaded")
+        content = html_to_markdown(await page.content(), base_url=page.url)
+        if response is not None and response.ok:
+            web_fetch.extraction_cache.put(url, "markdown", content, await response.all_headers(), session_id)
+    web_fetch.confirm_javascript(url, reason, content)
+    web_fetch.record("search_result", url, "browser", reason, started)
+    return content
+
+async def _read_search_results(results: list, session_id: str):
+    """Reads the result pages concurrently, each within WEB_SEARCH_PAGE_TIMEOUT, into result["content"] or result["error"]."""
+    async def read(result):
+        try:
+            result["content"] = await asyncio.wait_for(_read_search_result(result["url"], session_id), WEB_SEARCH_PAGE_TIMEOUT)
+        except asyncio.TimeoutError:
+            result["error"] = f"timed out after {WEB_SEARCH_PAGE_TIMEOUT:g}s"
+        except Exception as e:
+            result["error"] = str(e).splitlines()[0] if str(e) else e.__class__.__name__
+    await asyncio.gather(*(read(result) for result in results))
+
+async def web_search(query: str, session_id: str = None) -> str:
+    """
+    Searches the web, reads the top WEB_SEARCH_RESULTS results concurrently (over HTTP, or in
+    tabs of the session's context) and returns one ranked, deduplicated digest of them.
+    """
+    session_id = session_id or DEFAULT_SESSION
+    results_url = search_url(query)
+    try:
+        logger.info(f"Performing web search for '{query}' at {results_url}")
+        reason = web_fetch.browser_reason(results_url)
+        contents = None
+        if reason is None:
+            contents, reason = await web_fetch.fetch_extractions(results_url, ("html",))
+        if contents is not None:
+            html = contents["html"]
+            browser_pool.set_pending_url(session_id, results_url)
+        else:
+            async def render(page):
+                await page.goto(results_url, wait_until="domcontentloaded")
+                return await page.content()
+            html = await _on_page(session_id, render, results_url)
+        results = parse_result_links(html, results_url, WEB_SEARCH_RESULTS)
+        if not results:
+            return f"No results found for '{query}'."
+        await _read_search_results(results, session_id)
+        return build_digest(query, results)
+    except Exception as e:
+        logger.error(f"Error performing web search for '{query}': {e}")
+        return f"Error performing web search for '{query}': {e}"
+
+
 class BrowserTools:
-    def __init__(self):
-        self.browser = None
-        self.page = None
+    """The browser tools bound to one session, on a context leased from the shared pool."""
+    def __init__(self, session_id: str = DEFAULT_SESSION):
+        self.session_id = session_id
 
     async def initialize(self):
-        if self.browser is None:
-            logger.info("Initializing Playwright browser...")
-            self.playwright = await async_playwright().start()
-            self.browser = await self.playwright.chromium.launch(headless=True)
-            self.page = await self.browser.new_page()
-            logger.info("Playwright browser initialized.")
+        await browser_pool.start()
 
     async def close(self):
-        if self.browser:
-            logger.info("Closing Playwright browser...")
-            await self.browser.close()
-            await self.playwright.stop()
-            self.browser = None
-            self.page = None
-            logger.info("Playwright browser closed.")
+        await browser_pool.release(self.session_id)
 
     async def navigate_to_url(self, url: str) -> str:
         """Navigates the browser to the specified URL."""
-        await self.initialize()
-        try:
-            logger.info(f"Navigating to {url}")
-            await self.page.goto(url)
-            return f"Successfully navigated to {url}"
-        except Exception as e:
-            logger.error(f"Error navigating to {url}: {e}")
-            return f"Error navigating to {url}: {e}"
+        return await navigate_to_url(url, session_id=self.session_id)
 
     async def get_page_content(self) -> str:
         """Returns the full HTML content of the current page."""
-        await self.initialize()
-        return await self.page.content()
+        return await _on_page(self.session_id, lambda page: page.content())
 
     async def extract_text(self) -> str:
         """Extracts all visible text content from the current page."""
-        await self.initialize()
-        return await self.page.evaluate("document.body.innerText")
+        return await _on_page(self.session_id, lambda page: page.evaluate("document.body.innerText"))
 
     async def extract_markdown(self) -> str:
         """Extracts the main content of the current page and converts it to Markdown."""
-        await self.initialize()
-        # This is a placeholder. A real implementation would use a library like `html2text`
-        # or a more sophisticated parsing approach to convert HTML to Markdown.
-        # For now, we'll just return the innerText as a simplified representation.
-        logger.warning("Markdown extraction is a simplified implementation (innerText).")
-        return await self.page.evaluate("document.body.innerText")
+        return await _on_page(self.session_id, lambda page: _extract_from_page(page, "markdown"))
 
     async def click_element(self, selector: str) -> str:
         """Clicks an element identified by a CSS selector."""
-        await self.initialize()
-        try:
-            logger.info(f"Clicking element with selector: {selector}")
-            await self.page.click(selector)
-            return f"Clicked element: {selector}"
-        except Exception as e:
-            logger.error(f"Error clicking element {selector}: {e}")
-            return f"Error clicking element {selector}: {e}"
+        return await interact_with_element(None, selector, "click", session_id=self.session_id)
 
     async def fill_form_field(self, selector: str, value: str) -> str:
         """Fills a form field identified by a CSS selector with the given value."""
-        await self.initialize()
-        try:
-            logger.info(f"Filling field {selector} with value: {value}")
-            await self.page.fill(selector, value)
-            return f"Filled field {selector} with value: {value}"
-        except Exception as e:
-            logger.error(f"Error filling field {selector}: {e}")
-            return f"Error filling field {selector}: {e}"
+        return await interact_with_element(None, selector, "fill", value, session_id=self.session_id)
 
     async def take_screenshot(self, path: str = "screenshot.png") -> str:
         """Takes a screenshot of the current page and saves it to the specified path."""
-        await self.initialize()
-        try:
-            logger.info(f"Taking screenshot to {path}")
-            await self.page.screenshot(path=path)
+        async def shoot(page):
+            await page.screenshot(path=path, full_page=True)
             return f"Screenshot saved to {path}"
-        except Exception as e:
-            logger.error(f"Error taking screenshot: {e}")
-            return f"Error taking screenshot: {e}"
+        return await _on_page(self.session_id, shoot)
 
     async def web_search(self, query: str) -> str:
-        """Performs a web search using a search engine (e.g., Google) and returns the results page URL."""
-        await self.initialize()
-        try:
-            search_url = f"https://www.google.com/search?q={query}"
-            logger.info(f"Performing web search for '{query}' at {search_url}")
-            await self.page.goto(search_url)
-            return f"Navigated to search results for '{query}'. Use get_page_content or extract_text to view results."
-        except Exception as e:
-            logger.error(f"Error performing web search for '{query}': {e}")
-            return f"Error performing web search for '{query}': {e}"
+        """Performs a web search and returns a digest of the top results."""
+        return await web_search(query, session_id=self.session_id)
 
 # Example usage (for testing purposes)
 async def main():
     browser_tools = BrowserTools()
     try:
         print(await browser_tools.navigate_to_url("https://www.example.com"))
-        print(await browser_tools.extract_text()[:200]) # Print first 200 chars
+        print((await browser_tools.extract_text())[:200]) # Print first 200 chars
         print(await browser_tools.take_screenshot("example.png"))
         print(await browser_tools.web_search("playwright python"))
         print(await browser_tools.take_screenshot("playwright_search.png"))
     finally:
         await browser_tools.close()
+        await browser_pool.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
-
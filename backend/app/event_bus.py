@@ -0,0 +1,94 @@
+import os
+import uuid
+from collections import OrderedDict, deque
+
+# Recent events kept per session for clients that reconnect
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+# Sessions whose recent events are kept; the least recently active ones without subscribers go first
+EVENT_BUS_SESSIONS = int(os.getenv("EVENT_BUS_SESSIONS", "256"))
+
+
+class SessionEvents:
+    """The recent events of one session and the clients subscribed to it."""
+    def __init__(self, buffer_size: int):
+        self.buffer = deque(maxlen=buffer_size) # events, each carrying its "seq"
+        self.last_seq = 0
+        self.subscribers = set()
+
+
+class EventBus:
+    """
+    Per-session publish/subscribe with replay.
+
+    Every event published to a session gets the next sequence number of that session and is
+    kept in a bounded ring buffer. A client that reconnects subscribes with the last sequence
+    number it saw and is replayed everything newer. If those events are no longer buffered, or
+    the server restarted since (the `epoch` differs), it is told to resync from the history
+    instead.
+    """
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE, max_sessions: int = EVENT_BUS_SESSIONS):
+        self.buffer_size = buffer_size
+        self.max_sessions = max_sessions
+        self.epoch = uuid.uuid4().hex[:12] # sequence numbers are only meaningful within one epoch
+        self._sessions = OrderedDict() # session id -> SessionEvents, least recently active first
+
+    def _get(self, session_id: str) -> SessionEvents:
+        events = self._sessions.get(session_id)
+        if events is None:
+            events = self._sessions[session_id] = SessionEvents(self.buffer_size)
+            self._evict()
+        else:
+            self._sessions.move_to_end(session_id)
+        return events
+
+    def _evict(self):
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        for session_id in [session_id for session_id, events in self._sessions.items() if not events.subscribers][:excess]:
+            del self._sessions[session_id]
+
+    def publish(self, session_id: str, message: dict) -> dict:
+        """Records an event of a session and returns it with its sequence number added."""
+        events = self._get(session_id)
+        events.last_seq += 1
+        event = {**message, "session_id": session_id, "seq": events.last_seq}
+        events.buffer.append(event)
+        return event
+
+    def subscribe(self, session_id: str, subscriber, last_seq: int = None, epoch: str = None) -> tuple:
+        """
+        Subscribes to a session. Returns the events to replay (those after `last_seq`) and
+        whether the subscriber must resync from the history because events were missed.
+        """
+        events = self._get(session_id)
+        events.subscribers.add(subscriber)
+        if last_seq is None:
+            return [], False
+        if (epoch is not None and epoch != self.epoch) or last_seq > events.last_seq:
+            return [], True
+        oldest = events.buffer[0]["seq"] if events.buffer else events.last_seq + 1
+        if last_seq < oldest - 1:
+            return [], True
+        return [event for event in events.buffer if event["seq"] > last_seq], False
+
+    def unsubscribe(self, session_id: str, subscriber):
+        events = self._sessions.get(session_id)
+        if events is not None:
+            events.subscribers.discard(subscriber)
+
+    def subscribers(self, session_id: str) -> set:
+        events = self._sessions.get(session_id)
+        return events.subscribers if events is not None else set()
+
+    def last_seq(self, session_id: str) -> int:
+        events = self._sessions.get(session_id)
+        return events.last_seq if events is not None else 0
+
+    def stats(self) -> dict:
+        return {
+            "epoch": self.epoch,
+            "sessions": len(self._sessions),
+            "buffered_events": sum(len(events.buffer) for events in self._sessions.values()),
+            "subscriptions": sum(len(events.subscribers) for events in self._sessions.values()),
+        }
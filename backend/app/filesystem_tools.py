@@ -1,5 +1,13 @@
 import os
+import mmap
+import codecs
 import shutil
+import asyncio
+import mimetypes
+import threading
+from collections import OrderedDict
+from app.io_pool import workspace_pool
+from app import workspace_tree
 
 # The base directory where all session folders are stored.
 SESSIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'sessions'))
@@ -13,50 +21,128 @@ def _get_safe_path(path: str, session_id: str) -> str:
 
     requested_path = os.path.normpath(os.path.join(session_workspace, path))
     
-    if not requested_path.startswith(session_workspace):
+    if requested_path != session_workspace and not requested_path.startswith(session_workspace + os.sep):
         raise PermissionError(f"Attempted to access file outside of the session workspace: {path}")
     
     return requested_path
 
-def create_file(path: str, content: str = "", session_id: str = None):
+def _create_file(path: str, content: str = "", session_id: str = None):
     safe_path = _get_safe_path(path, session_id)
     os.makedirs(os.path.dirname(safe_path), exist_ok=True)
     with open(safe_path, 'w', encoding='utf-8') as f:
         f.write(content)
+    workspace_tree.invalidate(session_id)
     print(f"[{session_id}] File created: {path}")
 
 # --- UPDATE ALL OTHER FUNCTIONS TO ACCEPT session_id ---
 
-def create_folder(path: str, session_id: str = None):
+def _create_folder(path: str, session_id: str = None):
     safe_path = _get_safe_path(path, session_id)
     os.makedirs(safe_path, exist_ok=True)
+    workspace_tree.invalidate(session_id)
     print(f"[{session_id}] Folder created: {path}")
 
-def add_content(path: str, content: str, session_id: str = None):
+def _add_content(path: str, content: str, session_id: str = None):
     safe_path = _get_safe_path(path, session_id)
     if not os.path.exists(safe_path):
         raise FileNotFoundError(f"File not found, cannot add content: {path}")
     with open(safe_path, 'a', encoding='utf-8') as f:
         f.write(content)
+    workspace_tree.invalidate(session_id)
     print(f"[{session_id}] Content added to: {path}")
 
-def delete_file(path: str, session_id: str = None):
+def _delete_file(path: str, session_id: str = None):
     safe_path = _get_safe_path(path, session_id)
     if not os.path.isfile(safe_path):
         raise FileNotFoundError(f"File not found, cannot delete: {path}")
     os.remove(safe_path)
+    workspace_tree.invalidate(session_id)
     print(f"[{session_id}] File deleted: {path}")
 
-def delete_folder(path: str, session_id: str = None):
+def _delete_folder(path: str, session_id: str = None):
     safe_path = _get_safe_path(path, session_id)
     if not os.path.isdir(safe_path):
         raise FileNotFoundError(f"Folder not found, cannot delete: {path}")
     shutil.rmtree(safe_path)
+    workspace_tree.invalidate(session_id)
     print(f"[{session_id}] Folder deleted: {path}")
 
 
 
-def list_directory_contents(path: str, session_id: str) -> dict:
+class WriteBuffer:
+    """
+    Per-plan write-behind buffer for the filesystem steps of a plan.
+
+    Runs such as CREATE_FOLDER -> CREATE_FILE -> ADD_CONTENT -> ADD_CONTENT are collected in
+    memory and written out by flush() with one makedirs per directory tree and one open/write
+    per file. Paths are still validated when each step is buffered, so bad paths fail at the
+    step that uses them. The executor flushes before any step that reads or deletes workspace
+    files or runs a command, and once more at the end of the plan.
+    """
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self._folders = set()
+        self._files = {} # safe path -> {"mode": "w" or "a", "parts": [...], "path": original path}
+        self._flushing = set() # paths being written by the flush in progress
+        self._flush_lock = asyncio.Lock()
+
+    def __bool__(self):
+        return bool(self._folders or self._files)
+
+    async def create_folder(self, path: str, session_id: str = None):
+        safe_path = _get_safe_path(path, self.session_id)
+        self._folders.add(safe_path)
+        print(f"[{self.session_id}] Folder created (buffered): {path}")
+
+    async def create_file(self, path: str, content: str = "", session_id: str = None):
+        safe_path = _get_safe_path(path, self.session_id)
+        self._folders.add(os.path.dirname(safe_path))
+        # Creating a file truncates it, so anything buffered for it before is superseded
+        self._files[safe_path] = {"mode": "w", "parts": [content] if content else [], "path": path}
+        print(f"[{self.session_id}] File created (buffered): {path}")
+
+    async def add_content(self, path: str, content: str, session_id: str = None):
+        safe_path = _get_safe_path(path, self.session_id)
+        entry = self._files.get(safe_path)
+        if entry is None:
+            if safe_path not in self._flushing and not os.path.exists(safe_path):
+                raise FileNotFoundError(f"File not found, cannot add content: {path}")
+            entry = self._files[safe_path] = {"mode": "a", "parts": [], "path": path}
+        entry["parts"].append(content)
+        print(f"[{self.session_id}] Content added to (buffered): {path}")
+
+    async def flush(self):
+        """Writes out everything buffered so far on the workspace I/O pool."""
+        # Flushes are serialized so a step that waits on one never sees a half-written workspace
+        async with self._flush_lock:
+            if not self:
+                return
+            folders, files = self._folders, self._files
+            self._folders, self._files = set(), {}
+            self._flushing = set(files)
+            try:
+                await workspace_pool.submit(self.session_id, self._write, folders, files)
+            finally:
+                self._flushing = set()
+
+    def _write(self, folders: set, files: dict):
+        # Only the deepest directories need a makedirs call; it creates their parents too
+        leaves = []
+        for folder in sorted(folders, key=len, reverse=True):
+            if not any(leaf == folder or leaf.startswith(folder + os.sep) for leaf in leaves):
+                leaves.append(folder)
+        for folder in leaves:
+            os.makedirs(folder, exist_ok=True)
+
+        for safe_path, entry in files.items():
+            with open(safe_path, entry["mode"], encoding='utf-8') as f:
+                f.write("".join(entry["parts"]))
+        workspace_tree.invalidate(self.session_id)
+        print(f"[{self.session_id}] Flushed {len(files)} file(s) and {len(leaves)} folder tree(s).")
+
+
+
+def _list_directory_contents(path: str, session_id: str) -> dict:
     """
     Lists the contents of a directory within the session's workspace.
     Returns a list of dictionaries, each representing a file or folder.
@@ -80,15 +166,19 @@ def list_directory_contents(path: str, session_id: str) -> dict:
 
 
 
-def read_file_content(path: str, session_id: str) -> dict:
+def _read_file_content(path: str, session_id: str) -> dict:
     """
     Reads the content of a file within the session's workspace.
+    Files larger than FILE_CONTENT_MAX_BYTES are returned one page of lines at a time.
     """
-    session_workspace = os.path.join(SESSIONS_DIR, session_id, 'workspace')
-    full_path = os.path.join(session_workspace, path)
+    full_path = _get_safe_path(path, session_id)
 
     if not os.path.isfile(full_path):
         return {"status": "error", "message": f"File not found: {path}"}
+    if os.path.getsize(full_path) > FILE_CONTENT_MAX_BYTES:
+        return _read_file_lines(path, session_id)
+    if _is_binary(full_path):
+        return {"status": "error", "binary": True, "message": f"File is binary and cannot be shown as text: {path}"}
 
     try:
         with open(full_path, 'r', encoding='utf-8') as f:
@@ -97,3 +187,141 @@ def read_file_content(path: str, session_id: str) -> dict:
     except Exception as e:
         return {"status": "error", "message": f"Failed to read file {path}: {e}"}
 
+
+# --- FILE CONTENT ---
+# Largest file returned whole by read_file_content; bigger files are paged by lines
+FILE_CONTENT_MAX_BYTES = int(os.getenv("FILE_CONTENT_MAX_BYTES", str(1024 * 1024)))
+# Lines per page when no end line is requested
+FILE_CONTENT_PAGE_LINES = int(os.getenv("FILE_CONTENT_PAGE_LINES", "2000"))
+BINARY_SNIFF_BYTES = 8192
+
+# Byte offsets of every LINE_CHECKPOINT_EVERY-th line of recently paged files, so that later
+# pages of a large file start scanning near where they begin rather than at the top
+LINE_CHECKPOINT_EVERY = 1024
+MAX_CHECKPOINTED_FILES = 64
+_line_checkpoints = OrderedDict() # full path -> ((mtime_ns, size), [offset of line 0, of line 1024, ...])
+_line_checkpoints_lock = threading.Lock()
+
+def _is_binary(full_path: str) -> bool:
+    """Sniffs the start of a file: NUL bytes or invalid UTF-8 mean binary."""
+    with open(full_path, 'rb') as f:
+        sample = f.read(BINARY_SNIFF_BYTES)
+    if b"\0" in sample:
+        return True
+    try:
+        # Not final, so a multi-byte character cut off at the end of the sample is fine
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+def _stat_file(path: str, session_id: str) -> dict:
+    """Resolves a workspace file for streaming and describes it: size, mtime, media type, binary or not."""
+    safe_path = _get_safe_path(path, session_id)
+    if not os.path.isfile(safe_path):
+        raise FileNotFoundError(f"File not found: {path}")
+    stat = os.stat(safe_path)
+    binary = _is_binary(safe_path)
+    media_type = mimetypes.guess_type(safe_path)[0]
+    if media_type is None:
+        media_type = "application/octet-stream" if binary else "text/plain"
+    if not binary and media_type.startswith("text/"):
+        media_type += "; charset=utf-8"
+    return {"full_path": safe_path, "stat": stat, "binary": binary, "media_type": media_type}
+
+def _seek_line(mm: mmap.mmap, key: str, signature: tuple, target: int):
+    """Returns the byte offset where 0-based line `target` starts, or None past the end of the file."""
+    with _line_checkpoints_lock:
+        cached = _line_checkpoints.get(key)
+        checkpoints = list(cached[1]) if cached and cached[0] == signature else [0]
+
+    index = min(target // LINE_CHECKPOINT_EVERY, len(checkpoints) - 1)
+    line, offset = index * LINE_CHECKPOINT_EVERY, checkpoints[index]
+    size = len(mm)
+    while line < target and offset < size:
+        newline = mm.find(b"\n", offset)
+        offset = size if newline < 0 else newline + 1
+        line += 1
+        if line % LINE_CHECKPOINT_EVERY == 0 and line // LINE_CHECKPOINT_EVERY == len(checkpoints):
+            checkpoints.append(offset)
+
+    with _line_checkpoints_lock:
+        _line_checkpoints[key] = (signature, checkpoints)
+        _line_checkpoints.move_to_end(key)
+        while len(_line_checkpoints) > MAX_CHECKPOINTED_FILES:
+            _line_checkpoints.popitem(last=False)
+    return offset if line == target and offset < size else None
+
+def _read_file_lines(path: str, session_id: str, start_line: int = 1, end_line: int = None) -> dict:
+    """
+    Reads lines `start_line` to `end_line` (1-based, inclusive) of a text file through a memory
+    map, without loading the rest of the file. Pages keep their line endings, so consecutive
+    pages join up exactly.
+    """
+    full_path = _get_safe_path(path, session_id)
+
+    if not os.path.isfile(full_path):
+        return {"status": "error", "message": f"File not found: {path}"}
+    if _is_binary(full_path):
+        return {"status": "error", "binary": True, "message": f"File is binary and cannot be shown as text: {path}"}
+    if end_line is None:
+        end_line = start_line + FILE_CONTENT_PAGE_LINES - 1
+
+    stat = os.stat(full_path)
+    page = {"status": "success", "content": "", "start_line": start_line, "end_line": start_line - 1, "has_more": False, "size": stat.st_size}
+    if stat.st_size == 0 or end_line < start_line:
+        return page
+
+    with open(full_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = _seek_line(mm, full_path, (stat.st_mtime_ns, stat.st_size), start_line - 1)
+        if offset is None:
+            return page
+        end, count = offset, 0
+        while count <= end_line - start_line and end < len(mm):
+            newline = mm.find(b"\n", end)
+            end = len(mm) if newline < 0 else newline + 1
+            count += 1
+        page["content"] = mm[offset:end].decode('utf-8', errors='replace')
+        page["end_line"] = start_line + count - 1
+        page["has_more"] = end < len(mm)
+    return page
+
+
+# --- ASYNC API ---
+# The blocking implementations above run on the bounded workspace I/O pool, keyed by session,
+# so large reads and rmtree calls never stall the event loop.
+
+async def create_file(path: str, content: str = "", session_id: str = None):
+    return await workspace_pool.submit(session_id, _create_file, path, content, session_id)
+
+async def create_folder(path: str, session_id: str = None):
+    return await workspace_pool.submit(session_id, _create_folder, path, session_id)
+
+async def add_content(path: str, content: str, session_id: str = None):
+    return await workspace_pool.submit(session_id, _add_content, path, content, session_id)
+
+async def delete_file(path: str, session_id: str = None):
+    return await workspace_pool.submit(session_id, _delete_file, path, session_id)
+
+async def delete_folder(path: str, session_id: str = None):
+    return await workspace_pool.submit(session_id, _delete_folder, path, session_id)
+
+async def list_directory_contents(path: str, session_id: str) -> dict:
+    return await workspace_pool.submit(session_id, _list_directory_contents, path, session_id)
+
+async def read_file_content(path: str, session_id: str) -> dict:
+    return await workspace_pool.submit(session_id, _read_file_content, path, session_id)
+
+async def read_file_lines(path: str, session_id: str, start_line: int = 1, end_line: int = None) -> dict:
+    return await workspace_pool.submit(session_id, _read_file_lines, path, session_id, start_line, end_line)
+
+async def stat_file(path: str, session_id: str) -> dict:
+    return await workspace_pool.submit(session_id, _stat_file, path, session_id)
+
+async def get_workspace_tree(path: str, session_id: str, depth: int = None) -> dict:
+    """Returns the workspace tree under `path`, with sizes and mtimes, from the per-session cache."""
+    return await workspace_tree.get_tree(session_id, path, depth)
+
+def get_io_stats() -> dict:
+    """Returns queue depth and latency metrics of the workspace I/O pool."""
+    return workspace_pool.stats()
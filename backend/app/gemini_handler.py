@@ -1,7 +1,11 @@
 import os
-import requests
+import time
+import asyncio
+import httpx
 import json
 from dotenv import load_dotenv
+from app import llm_cache, prompt_templates, model_router
+from app.io_pool import workspace_pool
 
 # Load environment variables from a .env file located in the 'backend' directory
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -13,48 +17,328 @@ GEMINI_MODELS = [
 ]
 BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
 
-def call_gemini(prompt: str):
+# --- TRANSPORT SETTINGS ---
+# Total time allowed for a single model call (for streams: the longest gap between two chunks)
+REQUEST_TIMEOUT = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "120"))
+CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "10"))
+# Upper bound on in-flight Gemini calls per worker process; further callers wait their turn
+MAX_CONCURRENT_REQUESTS = int(os.getenv("GEMINI_MAX_CONCURRENT_REQUESTS", "32"))
+# Idle keep-alive connections kept open to the API host
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GEMINI_MAX_KEEPALIVE_CONNECTIONS", "16"))
+
+# --- RESPONSE CACHE SETTINGS ---
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+CACHE_MAX_DISK_BYTES = int(os.getenv("LLM_CACHE_MAX_DISK_BYTES", str(256 * 1024 * 1024)))
+# I/O pool key of the cache's database work, which is held to the pool's per-key limit
+CACHE_IO_KEY = "llm-cache"
+
+# --- MODEL ROUTING SETTINGS ---
+# Consecutive failures (429s included) after which a model is skipped for the cooldown period
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+LATENCY_WINDOW = int(os.getenv("GEMINI_LATENCY_WINDOW", "100"))
+# Race a slow request against the next model once it exceeds its model's p95 latency
+HEDGE_REQUESTS = os.getenv("GEMINI_HEDGE_REQUESTS", "false").lower() == "true"
+
+router = model_router.ModelRouter(
+    GEMINI_MODELS,
+    window=LATENCY_WINDOW,
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    cooldown=BREAKER_COOLDOWN,
+    # A probe that outlives the longest call has been abandoned
+    probe_timeout=REQUEST_TIMEOUT,
+)
+
+_client = None
+_semaphore = None
+_cache = None
+
+def _get_client() -> httpx.AsyncClient:
+    """Returns the shared, connection-pooled HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers={'Content-Type': 'application/json'},
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENT_REQUESTS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=60,
+            ),
+        )
+    return _client
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _semaphore
+
+async def close_client():
+    """Closes the shared HTTP client and its pooled connections (called on shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _get_cache():
+    """Returns the shared response cache, or None when caching is disabled."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = llm_cache.ResponseCache(
+            os.path.join(llm_cache.CACHE_DIR, 'responses.db'),
+            max_memory_entries=CACHE_MEMORY_ENTRIES,
+            max_disk_bytes=CACHE_MAX_DISK_BYTES,
+            ttl=CACHE_TTL,
+        )
+    return _cache
+
+async def get_cache_stats() -> dict:
+    """Returns hit/miss counters and sizes of the response cache."""
+    cache = _get_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await workspace_pool.submit(CACHE_IO_KEY, cache.stats)}
+
+def _cache_identity(prompt, version: str) -> tuple:
     """
-    Calls the Gemini API with a given prompt, featuring graceful fallback to other models.
+    Returns the (text, version) pair a prompt is cached under. For a rendered template only the
+    per-request text is hashed, the template's version standing in for its static prefix.
     """
+    if isinstance(prompt, prompt_templates.RenderedPrompt):
+        return prompt.text, prompt.version
+    return prompt, version
+
+def get_router_stats() -> dict:
+    """Returns per-model latency, error rate and circuit breaker state."""
+    return {"hedging": HEDGE_REQUESTS, "models": router.stats()}
+
+async def _cached_response(prompt, version: str, use_cache: bool):
+    """Looks the prompt up in the cache under every model, most preferred first."""
+    cache = _get_cache() if use_cache else None
+    if cache is None:
+        return None
+    text, version = _cache_identity(prompt, version)
+    keys = [llm_cache.make_key(model, version, text) for model in GEMINI_MODELS]
+    return await workspace_pool.submit(CACHE_IO_KEY, cache.get, *keys)
+
+async def _store_response(prompt, version: str, model: str, response_text: str):
+    # Stored even when the lookup was bypassed, so a forced refresh replaces the stale entry
+    cache = _get_cache()
+    if cache is not None:
+        text, version = _cache_identity(prompt, version)
+        await workspace_pool.submit(CACHE_IO_KEY, cache.set, llm_cache.make_key(model, version, text), model, response_text)
+
+def _request_body(prompt) -> bytes:
+    """Serializes a prompt (plain string or rendered template) into a Gemini request body."""
+    if isinstance(prompt, prompt_templates.RenderedPrompt):
+        return prompt.request_body()
+    return json.dumps({"contents": [{"parts": [{"text": prompt}]}]}).encode('utf-8')
+
+def _get_api_key() -> str:
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    return api_key
+
+# Raised by a response body that is not JSON, or not shaped like a Gemini response
+MALFORMED_RESPONSE_ERRORS = (ValueError, KeyError, IndexError, TypeError, AttributeError)
+
+def _extract_text(result: dict):
+    """Returns the text of the first candidate in a Gemini response, or None if there is none."""
+    if "candidates" in result and result["candidates"]:
+        parts = result['candidates'][0].get('content', {}).get('parts', [])
+        if parts:
+            return parts[0].get('text', '')
+    return None
+
+def _retry_after(response: httpx.Response):
+    """Parses a Retry-After header given in seconds, if present."""
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+async def _try_model(client, model: str, api_key: str, body: bytes, request_timeout):
+    """
+    Makes a single generateContent call to `model`, recording its outcome with the router.
+    Returns the response text, or None if the model failed or returned no content.
+    """
+    if not router.try_claim(model):
+        print(f"Skipping {model}: another request is probing its circuit.")
+        return None
+    url = f"{BASE_URL}/{model}:generateContent?key={api_key}"
+    print(f"Attempting to use model: {model}...")
+    started = time.monotonic()
+
+    try:
+        async with _get_semaphore():
+            response = await client.post(url, content=body, timeout=request_timeout)
+
+        # Raise an exception for bad status codes (4xx or 5xx)
+        response.raise_for_status()
+
+        # Safely extract content. If response is valid but content is blocked, try next model.
+        text = _extract_text(response.json())
+        router.record_success(model, time.monotonic() - started)
+        if text is not None:
+            print(f"Successfully received response from {model}.")
+            return text
+        print(f"Warning: Model {model} returned a valid response but no content (possibly due to safety filters). Trying next model.")
 
-    headers = {'Content-Type': 'application/json'}
-    data = {"contents": [{"parts": [{"text": prompt}]}]}
+    except httpx.HTTPStatusError as e:
+        # Specifically check for rate limiting to decide if we should try the next model
+        if e.response.status_code == 429:
+            print(f"Rate limit hit for {model}. Trying next model...")
+            router.record_failure(model, rate_limited=True, retry_after=_retry_after(e.response))
+        else:
+            print(f"HTTP Error with {model}: {e}. Trying next model...")
+            router.record_failure(model)
+    except httpx.RequestError as e:
+        print(f"Request failed for {model}: {e}. Trying next model...")
+        router.record_failure(model)
+    except MALFORMED_RESPONSE_ERRORS as e:
+        print(f"Malformed response from {model}: {e!r}. Trying next model...")
+        router.record_failure(model)
+    return None
+
+async def _first_response(tasks: dict):
+    """
+    Waits for the first of several racing model calls to return text and cancels the rest.
+    `tasks` maps each task to its model; returns (model, text), or (None, None) if all failed.
+    """
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                text = task.result()
+                if text is not None:
+                    return tasks[task], text
+        return None, None
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def call_gemini(prompt, timeout: float = None, use_cache: bool = True, version: str = ""):
+    """
+    Calls the Gemini API with a given prompt (a string or a RenderedPrompt), featuring graceful
+    fallback to other models in the order chosen by the model router.
+    `timeout` overrides the default per-request timeout for this call. Responses are cached under
+    `version`; `use_cache=False` skips the lookup and refreshes the cached entry instead.
+    With hedging enabled, a request that outlives its model's p95 latency is raced against the
+    next model and the first answer wins.
+    """
+    cached = await _cached_response(prompt, version, use_cache)
+    if cached is not None:
+        print("Serving Gemini response from cache.")
+        return cached
+
+    api_key = _get_api_key()
+    client = _get_client()
+    body = _request_body(prompt)
+    request_timeout = timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+
+    candidates = router.candidates()
+    i = 0
+    while i < len(candidates):
+        model = candidates[i]
+        hedge_model = candidates[i + 1] if HEDGE_REQUESTS and i + 1 < len(candidates) else None
+        delay = router.hedge_delay(model) if hedge_model else None
+
+        primary = asyncio.create_task(_try_model(client, model, api_key, body, request_timeout))
+        tasks = {primary: model}
+        if delay is not None:
+            await asyncio.wait({primary}, timeout=delay)
+            if not primary.done():
+                print(f"{model} has not answered within its p95 ({delay:.2f}s). Hedging with {hedge_model}...")
+                tasks[asyncio.create_task(_try_model(client, hedge_model, api_key, body, request_timeout))] = hedge_model
+        answered_by, text = await _first_response(tasks)
+        i += len(tasks)
+
+        if text is not None:
+            await _store_response(prompt, version, answered_by, text)
+            return text
+
+    # If the loop completes without returning, all models have failed.
+    raise Exception("All Gemini models failed to provide a response.")
+
+
+async def stream_gemini(prompt, timeout: float = None, use_cache: bool = True, version: str = ""):
+    """
+    Async generator yielding the text of a Gemini response as it is generated.
+    Falls back to the next model only if the current one fails before producing any text;
+    once text has been yielded a failure is raised, since the partial output cannot be retracted.
+    A cached response is yielded as a single chunk; completed streams are added to the cache.
+    """
+    cached = await _cached_response(prompt, version, use_cache)
+    if cached is not None:
+        print("Serving Gemini response from cache.")
+        yield cached
+        return
+
+    api_key = _get_api_key()
+    client = _get_client()
+    body = _request_body(prompt)
+    request_timeout = timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+
+    for model in router.candidates():
+        if not router.try_claim(model):
+            print(f"Skipping {model}: another request is probing its circuit.")
+            continue
+        url = f"{BASE_URL}/{model}:streamGenerateContent?alt=sse&key={api_key}"
+        print(f"Attempting to stream from model: {model}...")
+        yielded = False
+        parts = []
 
-    for model in GEMINI_MODELS:
-        url = f"{BASE_URL}/{model}:generateContent?key={api_key}"
-        print(f"Attempting to use model: {model}...")
-        
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(data), timeout=120)
-            
-            # Raise an exception for bad status codes (4xx or 5xx)
-            response.raise_for_status()
-
-            result = response.json()
-            
-            # Safely extract content. If response is valid but content is blocked, try next model.
-            if "candidates" in result and result["candidates"]:
-                print(f"Successfully received response from {model}.")
-                return result['candidates'][0]['content']['parts'][0]['text']
-            else:
-                print(f"Warning: Model {model} returned a valid response but no content (possibly due to safety filters). Trying next model.")
-                continue
+            async with _get_semaphore():
+                async with client.stream("POST", url, content=body, timeout=request_timeout) as response:
+                    response.raise_for_status()
+                    # The SSE stream carries one JSON response object per "data:" line
+                    async for line in response.aiter_lines():
+                        if not line or not line.startswith("data:"):
+                            continue
+                        text = _extract_text(json.loads(line[len("data:"):]))
+                        if text:
+                            yielded = True
+                            parts.append(text)
+                            yield text
 
-        except requests.exceptions.HTTPError as e:
-            # Specifically check for rate limiting to decide if we should try the next model
+            # The whole stream arrived intact. Only the outcome is recorded: stream durations are
+            # not comparable to plain calls
+            router.record_success(model)
+            if yielded:
+                print(f"Successfully streamed response from {model}.")
+                await _store_response(prompt, version, model, "".join(parts))
+                return
+            print(f"Warning: Model {model} streamed no content (possibly due to safety filters). Trying next model.")
+
+        except (GeneratorExit, asyncio.CancelledError):
+            # The caller stopped reading; a model that was streaming text was working
+            if yielded:
+                router.record_success(model)
+            raise
+        except httpx.HTTPStatusError as e:
             if e.response.status_code == 429:
                 print(f"Rate limit hit for {model}. Trying next model...")
-                continue
+                router.record_failure(model, rate_limited=True, retry_after=_retry_after(e.response))
             else:
                 print(f"HTTP Error with {model}: {e}. Trying next model...")
-                continue
-        except requests.exceptions.RequestException as e:
+                router.record_failure(model)
+        except httpx.RequestError as e:
+            router.record_failure(model)
+            if yielded:
+                raise Exception(f"Stream from {model} was interrupted: {e}")
             print(f"Request failed for {model}: {e}. Trying next model...")
-            continue
+        except MALFORMED_RESPONSE_ERRORS as e:
+            router.record_failure(model)
+            if yielded:
+                raise Exception(f"Stream from {model} sent a malformed chunk: {e!r}")
+            print(f"Malformed stream from {model}: {e!r}. Trying next model...")
 
-    # If the loop completes without returning, all models have failed.
     raise Exception("All Gemini models failed to provide a response.")
@@ -0,0 +1,371 @@
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+# Elements whose content is never shown as text
+INVISIBLE_TAGS = {"head", "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object"}
+# Elements that are never content
+SKIP_TAGS = INVISIBLE_TAGS | {"nav", "aside", "form", "button", "select", "textarea", "dialog", "menu"}
+# Page chrome, skipped unless it is part of the main content (e.g. an article's own header)
+LAYOUT_TAGS = {"header", "footer"}
+# Elements without an end tag
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+# Words of the class/id names of navigation, ads, cookie banners and other boilerplate
+BOILERPLATE_PATTERN = re.compile(
+    r"nav|navbar|navigation|menu|sidebar|breadcrumbs?|cookies?|consent|banner|ads?|advert\w*|sponsor\w*|"
+    r"promo\w*|share|sharing|social|related|comments?|newsletter|subscribe|popup|modal|skip",
+    re.IGNORECASE,
+)
+# Other words a boilerplate name may be made of, as in "site-nav" or "sidebar-left"
+BOILERPLATE_MODIFIERS = {
+    "site", "main", "top", "bottom", "left", "right", "primary", "secondary", "global", "page", "post", "article",
+    "bar", "link", "links", "list", "wrapper", "container", "area", "section", "box", "widget", "block",
+    "button", "buttons", "posts", "slot", "unit", "to", "content",
+}
+BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search", "dialog", "alert"}
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "figure", "figcaption", "dl", "dt", "dd", "address", "details", "summary"}
+MAIN_TAGS = {"main", "article"}
+# The <main>/<article> content replaces the whole page only if it holds at least this much text
+MIN_MAIN_CHARS = 200
+
+_INDENT = "\x00" # survives the line stripping of _normalize, becomes a space
+
+
+def _normalize(text: str) -> str:
+    """Strips each line (outside code fences), and collapses runs of blank lines."""
+    lines = []
+    in_fence = False
+    for line in text.split("\n"):
+        if line.startswith("```"):
+            if in_fence:
+                while lines and not lines[-1]:
+                    lines.pop()
+            in_fence = not in_fence
+            lines.append(line)
+            continue
+        if in_fence:
+            lines.append(line.rstrip())
+            continue
+        line = re.sub(r"[ \t\r\f\v]+", " ", line).strip(" ").replace(_INDENT, " ")
+        if line in ("-", ">") or (line and line[-1] == "." and line[:-1].strip().isdigit()):
+            continue # empty list item or quote line
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines).strip("\n")
+
+
+def _is_boilerplate_name(name: str) -> bool:
+    """Whether a whole class/id token names boilerplate: "cookie-banner" does, "has-sidebar" does not."""
+    words = [word for word in re.split(r"[_-]+", name.lower()) if word]
+    return any(BOILERPLATE_PATTERN.fullmatch(word) for word in words) and all(
+        word in BOILERPLATE_MODIFIERS or BOILERPLATE_PATTERN.fullmatch(word) for word in words
+    )
+
+
+class MarkdownConverter(HTMLParser):
+    """
+    Streaming HTML to Markdown converter: feed() it the page in chunks, then close() it and
+    read `markdown`.
+
+    Scripts, styles, navigation, forms, asides and elements whose class, id or role mark them
+    as boilerplate (menus, ads, cookie banners, share buttons...) are dropped, unless they wrap
+    <main> or <article> content: the events of such an element are held until its end tag, then
+    replayed if it turned out to hold the main content. If the page has <main> or <article>
+    content, only that is kept. Headings, paragraphs, lists, links, code, quotes and tables are
+    converted; other markup is reduced to its text. With `filter_boilerplate` off, only
+    invisible elements are dropped.
+    """
+    def __init__(self, base_url: str = None, filter_boilerplate: bool = True):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.filter_boilerplate = filter_boilerplate
+        self.markdown = None
+        self._buffers = [[]] # nested for links, quotes and table cells, which are rewritten when closed
+        self._held = None # events of the boilerplate element being read: ("start" | "end" | "data", ...)
+        self._held_tag = None
+        self._held_depth = 0
+        self._held_main = False # whether it wraps <main>/<article> content, and so is kept after all
+        self._held_hidden = False # invisible elements are dropped even then
+        self._main_tag = None # the <main>/<article> (or role="main") element being read
+        self._main_depth = 0
+        self._main_start = None
+        self._main_spans = []
+        self._pre_depth = 0
+        self._lists = [] # [tag, items so far]
+        self._links = [] # href of each open link
+        self._tables = [] # rows of each open table, each row a list of cells
+        self._in_cell = False
+
+    # --- PARSER EVENTS ---
+
+    def handle_starttag(self, tag, attrs):
+        if self._held is not None:
+            self._held.append(("start", tag, attrs))
+            if tag == self._held_tag:
+                self._held_depth += 1
+            if tag in MAIN_TAGS or dict(attrs).get("role") == "main":
+                self._held_main = True
+            return
+        if self._is_boilerplate(tag, dict(attrs)):
+            if tag not in VOID_TAGS:
+                self._held = [("start", tag, attrs)]
+                self._held_tag = tag
+                self._held_depth = 1
+                self._held_main = False
+                self._held_hidden = self._is_hidden(tag, dict(attrs))
+            return
+        self._open(tag, dict(attrs))
+
+    def _open(self, tag: str, attrs: dict):
+        if self._main_tag is None and (tag in MAIN_TAGS or attrs.get("role") == "main") and tag not in VOID_TAGS:
+            self._main_tag = tag
+            if len(self._buffers) == 1:
+                self._main_start = len(self._buffers[0])
+        if tag == self._main_tag:
+            self._main_depth += 1
+        if re.fullmatch(r"h[1-6]", tag):
+            self._write("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag in BLOCK_TAGS:
+            self._write("\n\n" if tag == "p" else "\n")
+        elif tag == "br":
+            self._write("\n")
+        elif tag == "hr":
+            self._write("\n\n---\n\n")
+        elif tag in ("ul", "ol"):
+            if not self._lists:
+                self._write("\n")
+            self._lists.append([tag, 0])
+        elif tag == "li":
+            depth = max(1, len(self._lists))
+            marker = "- "
+            if self._lists:
+                self._lists[-1][1] += 1
+                if self._lists[-1][0] == "ol":
+                    marker = f"{self._lists[-1][1]}. "
+            self._write("\n" + _INDENT * (2 * (depth - 1)) + marker)
+        elif tag == "a":
+            self._links.append(attrs.get("href"))
+            self._buffers.append([])
+        elif tag == "img":
+            alt = (attrs.get("alt") or "").strip()
+            if alt and attrs.get("src"):
+                self._write(f"![{alt}]({self._absolute(attrs['src'])})")
+        elif tag == "pre":
+            self._pre_depth += 1
+            if self._pre_depth == 1:
+                self._write("\n\n```\n")
+        elif tag == "code" and not self._pre_depth:
+            self._write("`")
+        elif tag == "blockquote":
+            self._buffers.append([])
+        elif tag == "table":
+            self._tables.append([])
+        elif tag == "tr" and self._tables:
+            self._tables[-1].append([])
+        elif tag in ("td", "th") and self._tables:
+            if not self._tables[-1]:
+                self._tables[-1].append([])
+            self._buffers.append([])
+            self._in_cell = True
+
+    def handle_endtag(self, tag):
+        if self._held is not None:
+            self._held.append(("end", tag))
+            if tag == self._held_tag:
+                self._held_depth -= 1
+                if self._held_depth == 0:
+                    self._release()
+            return
+        if re.fullmatch(r"h[1-6]", tag) or tag == "p":
+            self._write("\n\n")
+        elif tag in BLOCK_TAGS:
+            self._write("\n")
+        elif tag in ("ul", "ol"):
+            if self._lists:
+                self._lists.pop()
+            if not self._lists:
+                self._write("\n")
+        elif tag == "a" and self._links:
+            href = self._links.pop()
+            text = " ".join(self._pop_buffer().split())
+            if text and href and not href.startswith(("#", "javascript:", "mailto:")):
+                self._write(f"[{text}]({self._absolute(href)})")
+            else:
+                self._write(text)
+        elif tag == "pre" and self._pre_depth:
+            self._pre_depth -= 1
+            if self._pre_depth == 0:
+                self._write("\n```\n\n")
+        elif tag == "code" and not self._pre_depth:
+            self._write("`")
+        elif tag == "blockquote" and len(self._buffers) > 1:
+            quoted = _normalize(self._pop_buffer())
+            if quoted:
+                self._write("\n\n" + "\n".join("> " + line for line in quoted.split("\n")) + "\n\n")
+        elif tag in ("td", "th") and self._in_cell and self._tables:
+            cell = " ".join(self._pop_buffer().split()).replace("|", "\\|")
+            self._tables[-1][-1].append(cell)
+            self._in_cell = False
+        elif tag == "table" and self._tables:
+            self._write_table(self._tables.pop())
+        if tag == self._main_tag:
+            self._main_depth -= 1
+            if self._main_depth == 0:
+                self._main_tag = None
+                if self._main_start is not None and len(self._buffers) == 1:
+                    self._main_spans.append((self._main_start, len(self._buffers[0])))
+                self._main_start = None
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        if self._held is not None:
+            self._held.append(("data", data))
+            return
+        if self._pre_depth:
+            self._write(data)
+        else:
+            self._write(re.sub(r"\s+", " ", data))
+
+    def close(self):
+        super().close()
+        if self._held is not None: # unclosed boilerplate element
+            self._release()
+        while len(self._buffers) > 1: # unclosed links, quotes or cells
+            text = self._pop_buffer()
+            self._write(text)
+        parts = self._buffers[0]
+        full = _normalize("".join(parts))
+        main = _normalize("\n\n".join("".join(parts[start:end]) for start, end in self._main_spans))
+        self.markdown = main if len(main) >= MIN_MAIN_CHARS else full
+        return self.markdown
+
+    # --- HELPERS ---
+
+    def _release(self):
+        """Ends the held boilerplate element: dropped, or replayed if it wraps the main content."""
+        events, wraps_main = self._held, self._held_main
+        self._held = None
+        if not wraps_main or self._held_hidden:
+            return
+        # The element itself is kept; boilerplate nested in it is held and judged again
+        _, tag, attrs = events[0]
+        self._open(tag, dict(attrs))
+        for event in events[1:]:
+            if event[0] == "start":
+                self.handle_starttag(event[1], event[2])
+            elif event[0] == "end":
+                self.handle_endtag(event[1])
+            else:
+                self.handle_data(event[1])
+
+    def _is_hidden(self, tag: str, attrs: dict) -> bool:
+        if tag in INVISIBLE_TAGS:
+            return True
+        if "hidden" in attrs or attrs.get("aria-hidden") == "true":
+            return True
+        style = (attrs.get("style") or "").replace(" ", "").lower()
+        return "display:none" in style or "visibility:hidden" in style
+
+    def _is_boilerplate(self, tag: str, attrs: dict) -> bool:
+        if self._is_hidden(tag, attrs):
+            return True
+        if not self.filter_boilerplate:
+            return False
+        if tag in SKIP_TAGS:
+            return True
+        if tag in LAYOUT_TAGS and self._main_tag is None:
+            return True
+        if attrs.get("role") in BOILERPLATE_ROLES:
+            return True
+        if tag in ("html", "body") or tag in MAIN_TAGS:
+            return False
+        names = f"{attrs.get('class') or ''} {attrs.get('id') or ''}".split()
+        return any(_is_boilerplate_name(name) for name in names)
+
+    def _write(self, text: str):
+        self._buffers[-1].append(text)
+
+    def _pop_buffer(self) -> str:
+        return "".join(self._buffers.pop())
+
+    def _absolute(self, url: str) -> str:
+        return urljoin(self.base_url, url) if self.base_url else url
+
+    def _write_table(self, rows: list):
+        rows = [row for row in rows if any(cell for cell in row)]
+        if not rows:
+            return
+        width = max(len(row) for row in rows)
+        lines = []
+        for index, row in enumerate(rows):
+            lines.append("| " + " | ".join(row + [""] * (width - len(row))) + " |")
+            if index == 0:
+                lines.append("|" + " --- |" * width)
+        self._write("\n\n" + "\n".join(lines) + "\n\n")
+
+
+def html_to_markdown(html: str, base_url: str = None) -> str:
+    """
+    Converts an HTML page to Markdown, keeping only its main content. If the boilerplate filter
+    leaves nothing, the page is converted again without it.
+    """
+    converter = MarkdownConverter(base_url)
+    converter.feed(html)
+    markdown = converter.close()
+    if markdown:
+        return markdown
+    converter = MarkdownConverter(base_url, filter_boilerplate=False)
+    converter.feed(html)
+    return converter.close()
+
+
+class TextExtractor(HTMLParser):
+    """All visible text of a page, one line per block, like the browser's innerText."""
+    INVISIBLE_TAGS = INVISIBLE_TAGS
+    LINE_TAGS = BLOCK_TAGS | {"br", "li", "tr", "ul", "ol", "table", "pre", "blockquote", "h1", "h2", "h3", "h4", "h5", "h6", "header", "footer", "nav", "aside", "form"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts = []
+        self._skip_tag = None
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+        elif tag in self.INVISIBLE_TAGS:
+            self._skip_tag = tag
+            self._skip_depth = 1
+        elif tag in self.LINE_TAGS:
+            self._parts.append("\n")
+        elif tag in ("td", "th"):
+            self._parts.append("\t")
+
+    def handle_endtag(self, tag):
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self._skip_tag = None
+        elif tag in self.LINE_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if self._skip_tag is None:
+            self._parts.append(re.sub(r"\s+", " ", data))
+
+    def close(self):
+        super().close()
+        return _normalize("".join(self._parts))
+
+
+def html_to_text(html: str) -> str:
+    """Returns all visible text of an HTML page."""
+    extractor = TextExtractor()
+    extractor.feed(html)
+    return extractor.close()
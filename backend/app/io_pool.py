@@ -0,0 +1,101 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _percentile(sorted_values: list, fraction: float):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+class IOPool:
+    """
+    A dedicated, size-limited thread pool for blocking disk I/O, so that it never runs on the
+    event loop. Each key (a session id) may only have `per_key_limit` jobs in the pool at once,
+    so one session's heavy I/O cannot occupy every worker. Queue depth, utilisation and
+    wait/run latencies are tracked for inspection.
+    """
+    def __init__(self, name: str, max_workers: int = 4, per_key_limit: int = 2, window: int = 500):
+        self.name = name
+        self.max_workers = max_workers
+        self.per_key_limit = per_key_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._key_slots = defaultdict(lambda: asyncio.Semaphore(self.per_key_limit))
+        self._key_users = defaultdict(int)
+        self._wait_times = deque(maxlen=window)
+        self._run_times = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._pending = 0 # submitted and not finished yet
+        self._running = 0 # currently executing on a worker thread
+        self._completed = 0
+        self._failed = 0
+
+    async def submit(self, key, func, *args, **kwargs):
+        """Runs `func(*args, **kwargs)` on the pool on behalf of `key` and returns its result."""
+        submitted = time.monotonic()
+        started = None
+        self._pending += 1
+        self._key_users[key] += 1
+
+        def job():
+            nonlocal started
+            started = time.monotonic()
+            with self._lock:
+                self._running += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        try:
+            async with self._key_slots[key]:
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, job)
+            self._completed += 1
+            return result
+        except BaseException:
+            self._failed += 1
+            raise
+        finally:
+            self._pending -= 1
+            if started is not None:
+                self._wait_times.append(started - submitted)
+                self._run_times.append(time.monotonic() - started)
+            self._key_users[key] -= 1
+            if self._key_users[key] == 0:
+                del self._key_users[key]
+                del self._key_slots[key]
+
+    def stats(self) -> dict:
+        """Returns queue depth, utilisation and wait/run latency percentiles (in milliseconds)."""
+        waits = sorted(self._wait_times)
+        runs = sorted(self._run_times)
+        as_ms = lambda value: value * 1000 if value is not None else None
+        return {
+            "name": self.name,
+            "max_workers": self.max_workers,
+            "per_key_limit": self.per_key_limit,
+            "queued": max(0, self._pending - self._running), # waiting for a per-key slot or a worker
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "wait_p50_ms": as_ms(_percentile(waits, 0.5)),
+            "wait_p95_ms": as_ms(_percentile(waits, 0.95)),
+            "run_p50_ms": as_ms(_percentile(runs, 0.5)),
+            "run_p95_ms": as_ms(_percentile(runs, 0.95)),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+# Shared pool for blocking work on session workspaces and files
+workspace_pool = IOPool(
+    "workspace-io",
+    max_workers=int(os.getenv("WORKSPACE_IO_WORKERS", "4")),
+    per_key_limit=int(os.getenv("WORKSPACE_IO_PER_SESSION", "2")),
+)
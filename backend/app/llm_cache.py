@@ -0,0 +1,155 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Base directory for the on-disk tier of the response cache
+CACHE_DIR = os.path.abspath(os.getenv("LLM_CACHE_DIR", os.path.join(os.path.dirname(__file__), '..', 'cache')))
+
+
+def make_key(model: str, version: str, prompt: str) -> str:
+    """Hashes the model, the prompt version (e.g. the constitution hash) and the prompt into a cache key."""
+    digest = hashlib.sha256()
+    for part in (model, version or "", prompt):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses: a small in-memory LRU in front of an SQLite store on disk.
+    Entries expire after `ttl` seconds; the memory tier is bounded by entry count and the
+    disk tier by total payload size, least recently used entries being evicted first.
+
+    The methods block on the database (created on first use), so async callers run them on the
+    workspace I/O pool.
+    """
+    def __init__(self, path: str, max_memory_entries: int = 256, max_disk_bytes: int = 256 * 1024 * 1024, ttl: float = 24 * 3600):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict() # key -> (created_at, text)
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._init_database()
+            self._initialized = True
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _init_database(self):
+        with sqlite3.connect(self.path, timeout=5) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+
+    def _remember(self, key: str, created_at: float, text: str):
+        """Inserts an entry into the memory tier, evicting the least recently used ones."""
+        self._memory[key] = (created_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, *keys: str):
+        """
+        Returns the cached text for the first of `keys` that holds a live entry, or None.
+        A lookup over several keys counts as a single hit or miss.
+        """
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                text = self._get_live(key, now)
+                if text is not None:
+                    return text
+            self._stats["misses"] += 1
+            return None
+
+    def _get_live(self, key: str, now: float):
+        entry = self._memory.get(key)
+        if entry is not None:
+            if now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return entry[1]
+            del self._memory[key]
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT text, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+
+        self._stats["disk_hits"] += 1
+        self._remember(key, row[1], row[0])
+        return row[0]
+
+    def set(self, key: str, model: str, text: str):
+        """Stores a response in both tiers and trims the disk tier back under its size budget."""
+        now = time.time()
+        size = len(text.encode('utf-8'))
+        with self._lock:
+            self._remember(key, now, text)
+            self._stats["stores"] += 1
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, text, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, text, size, now, now)
+                )
+                self._evict_disk(conn, now)
+
+    def _evict_disk(self, conn, now: float):
+        removed = conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_disk_bytes:
+            # Walk entries from least to most recently used until enough space has been freed
+            stale_keys = []
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+                if total <= self.max_disk_bytes:
+                    break
+                stale_keys.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+            removed += len(stale_keys)
+        self._stats["evictions"] += max(removed, 0)
+
+    def clear(self):
+        """Drops every cached response from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            with self._connect() as conn:
+                conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters along with the current size of each tier."""
+        with self._lock:
+            with self._connect() as conn:
+                disk_entries, disk_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            return {
+                **self._stats,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_bytes,
+            }
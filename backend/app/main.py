@@ -1,6 +1,8 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks, Request, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+import os
 import json
+import asyncio
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
@@ -9,6 +11,14 @@ from .websocket_manager import ConnectionManager
 from . import agent_core
 from . import session_manager
 from . import filesystem_tools # <-- NEW IMPORT
+from . import gemini_handler
+from . import workspace_tree
+from . import workspace_search
+from . import terminal_tools
+from . import browser_tools
+from . import web_fetch
+from . import memory_manager
+from .io_pool import workspace_pool
 
 # This is the main FastAPI application instance
 app = FastAPI(
@@ -23,11 +33,41 @@ origins = [
 ]
 app.add_middleware(
     CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Content-Binary", "Content-Range", "Accept-Ranges"],
 )
 
+# Largest page of sessions served by GET /sessions
+MAX_SESSIONS_PAGE_SIZE = 500
+
 # Single, shared instance of the ConnectionManager
 manager = ConnectionManager()
 
+@app.on_event("startup")
+async def startup():
+    # Launch the browser and pre-warm contexts in the background, so startup does not wait on it
+    async def warm_browser():
+        try:
+            await browser_tools.browser_pool.start()
+        except Exception as e:
+            print(f"Browser pre-warm failed, it will be retried on first use: {e}")
+    asyncio.create_task(warm_browser())
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Write out queued history messages before the process exits
+    await session_manager.close_all_history()
+    # Stop watching session workspaces for changes
+    await workspace_tree.tree_cache.close()
+    # Kill the persistent session shells and whatever they still run
+    await terminal_tools.shell_pool.close_all()
+    # Close the sessions' memory databases
+    await memory_manager.close_all()
+    # Close the browser shared by the sessions' contexts
+    await browser_tools.browser_pool.close()
+    await web_fetch.close_client()
+    # Release the pooled connections held by the Gemini client
+    await gemini_handler.close_client()
+
 # --- HEALTH CHECK ENDPOINT ---
 @app.get("/health", tags=["Health Check"])
 async def read_root():
@@ -36,35 +76,80 @@ async def read_root():
 # --- SESSION MANAGEMENT ENDPOINTS ---
 
 @app.get("/sessions", tags=["Sessions"])
-async def get_sessions():
-    """Returns a list of all available sessions."""
-    return session_manager.get_all_sessions()
+async def get_sessions(response: Response, limit: int = None, cursor: str = None):
+    """
+    Returns the available sessions, newest first. With `limit`, a single page is returned and
+    the cursor for the next page, if any, is sent in the X-Next-Cursor header.
+    """
+    if limit is not None and not 1 <= limit <= MAX_SESSIONS_PAGE_SIZE:
+        raise HTTPException(status_code=422, detail=f"'limit' must be between 1 and {MAX_SESSIONS_PAGE_SIZE}.")
+    try:
+        sessions, next_cursor = await workspace_pool.submit(session_manager.CATALOG_IO_KEY, session_manager.list_sessions, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return sessions
 
 @app.post("/sessions", tags=["Sessions"])
 async def create_session():
     """Creates a new, empty session and returns its details."""
-    new_session = session_manager.create_new_session()
+    new_session = await workspace_pool.submit(session_manager.CATALOG_IO_KEY, session_manager.create_new_session)
     return new_session
 
 @app.get("/sessions/{session_id}", tags=["Sessions"])
-async def get_session(session_id: str):
-    """Returns the complete message history for a given session."""
-    history = session_manager.get_session_history(session_id)
+async def get_session(session_id: str, response: Response, limit: int = None, before: int = None):
+    """
+    Returns the message history for a given session, oldest first. With `limit`, only the last
+    `limit` messages (before message number `before`, if given) are returned, and the `before`
+    value for the preceding page is sent in the X-Next-Cursor header.
+    """
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=422, detail="'limit' must be at least 1.")
+    if before is not None and before < 0:
+        raise HTTPException(status_code=422, detail="'before' must not be negative.")
+    # Make sure messages still queued by the background writer are included
+    await session_manager.flush_history(session_id)
+    history, next_before = await workspace_pool.submit(session_id, session_manager.get_history_page, session_id, limit=limit, before=before)
+    if next_before is not None:
+        response.headers["X-Next-Cursor"] = str(next_before)
     return history
 
 # --- AGENT AND WEBSOCKET ENDPOINTS ---
 
 @app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
+async def websocket_endpoint(websocket: WebSocket, client_id: str, session_id: str = None, last_seq: int = None, epoch: str = None):
+    """
+    Agent events are pushed over this socket. Passing `session_id` (or sending
+    {"type": "subscribe", "session_id": ...}) subscribes to every event of that session;
+    with the `last_seq` and `epoch` of the last event seen, missed events are replayed.
+    """
     await manager.connect(websocket, client_id)
+    if session_id:
+        manager.subscribe(client_id, session_id, last_seq, epoch)
     try:
         while True:
-            await websocket.receive_text()
+            text = await websocket.receive_text()
+            try:
+                data = json.loads(text)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(data, dict) or not data.get("session_id"):
+                continue
+            if data.get("type") == "subscribe":
+                manager.subscribe(client_id, data["session_id"], data.get("last_seq"), data.get("epoch"))
+            elif data.get("type") == "unsubscribe":
+                manager.unsubscribe(client_id, data["session_id"])
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        manager.disconnect(client_id, websocket)
     finally:
         if client_id in manager.active_connections:
-            manager.disconnect(client_id)
+            manager.disconnect(client_id, websocket)
+
+@app.get("/ws/stats", tags=["Agent"])
+async def get_websocket_stats():
+    """Returns outbound queue depth, drops and send latencies of each connected client, and event bus totals."""
+    return manager.stats()
 
 
 @app.post("/agent/run", tags=["Agent"])
@@ -81,6 +166,8 @@ async def run_agent(request: Request, background_tasks: BackgroundTasks):
     user_prompt = data.get("user_prompt")
     session_id = data.get("session_id") # <-- NOW EXPECTS session_id
     client_id = data.get("client_id") # We still need this for the WebSocket
+    stream = bool(data.get("stream", False)) # Execute steps while the plan is still streaming in
+    use_cache = bool(data.get("use_cache", True)) # False forces a fresh plan from the LLM
 
     if not all([user_prompt, session_id, client_id]):
         raise HTTPException(status_code=422, detail="Missing required fields: 'user_prompt', 'session_id', and 'client_id'.")
@@ -91,28 +178,137 @@ async def run_agent(request: Request, background_tasks: BackgroundTasks):
         user_prompt=user_prompt,
         session_id=session_id, # <-- PASSING SESSION_ID
         client_id=client_id,
-        manager=manager
+        manager=manager,
+        stream=stream,
+        use_cache=use_cache
     )
     return {"status": "success", "message": "Agent task has been started for the specified session."}
 
 
-# --- STATIC FILES ---
-app.mount("/assets", StaticFiles(directory="static/assets"), name="assets")
+# --- LLM ENDPOINTS ---
+
+@app.get("/llm/cache", tags=["LLM"])
+async def get_llm_cache_stats():
+    """Returns hit/miss counters and sizes of the LLM response cache."""
+    return await gemini_handler.get_cache_stats()
+
+@app.get("/llm/router", tags=["LLM"])
+async def get_llm_router_stats():
+    """Returns per-model latency percentiles, error rates and circuit breaker states."""
+    return gemini_handler.get_router_stats()
 
-@app.get("/{catchall:path}")
-async def serve_static(catchall: str):
-    return FileResponse("static/index.html")
 
+# --- FILESYSTEM ENDPOINTS ---
+# Declared before the static catchall route, which would otherwise shadow them
 
 @app.get("/sessions/{session_id}/files", tags=["Filesystem"])
 async def get_session_files(session_id: str, path: str = "."):
     """Returns a list of files and folders within a session's workspace."""
-    return filesystem_tools.list_directory_contents(path=path, session_id=session_id)
-
+    return await filesystem_tools.list_directory_contents(path=path, session_id=session_id)
 
+@app.get("/sessions/{session_id}/tree", tags=["Filesystem"])
+async def get_session_tree(session_id: str, path: str = ".", depth: int = None):
+    """
+    Returns the whole file tree under `path` in a session's workspace, with sizes and
+    modification times. With `depth`, only that many levels are returned.
+    """
+    if depth is not None and depth < 1:
+        raise HTTPException(status_code=422, detail="'depth' must be at least 1.")
+    return await filesystem_tools.get_workspace_tree(path=path, session_id=session_id, depth=depth)
 
 @app.get("/sessions/{session_id}/file_content", tags=["Filesystem"])
-async def get_file_content(session_id: str, path: str):
-    """Returns the content of a file within a session's workspace."""
-    return filesystem_tools.read_file_content(path=path, session_id=session_id)
+async def get_file_content(session_id: str, path: str, start_line: int = None, end_line: int = None):
+    """
+    Returns the content of a file within a session's workspace. With `start_line` and/or
+    `end_line` (1-based, inclusive), only that page of lines is returned; large files are
+    always paged.
+    """
+    if (start_line is not None and start_line < 1) or (end_line is not None and end_line < 1):
+        raise HTTPException(status_code=422, detail="Line numbers start at 1.")
+    try:
+        if start_line is None and end_line is None:
+            return await filesystem_tools.read_file_content(path=path, session_id=session_id)
+        return await filesystem_tools.read_file_lines(path=path, session_id=session_id, start_line=start_line or 1, end_line=end_line)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+@app.get("/sessions/{session_id}/file", tags=["Filesystem"])
+async def get_file(session_id: str, path: str):
+    """
+    Streams a raw file from a session's workspace. HTTP Range requests are honoured, and the
+    X-Content-Binary header says whether the file looks binary.
+    """
+    try:
+        info = await filesystem_tools.stat_file(path=path, session_id=session_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    return FileResponse(
+        info["full_path"], media_type=info["media_type"], stat_result=info["stat"],
+        headers={"X-Content-Binary": "true" if info["binary"] else "false"},
+        filename=os.path.basename(info["full_path"]), content_disposition_type="inline",
+    )
+
+@app.get("/sessions/{session_id}/search", tags=["Filesystem"])
+async def search_session_files(session_id: str, q: str, regex: bool = False, case_sensitive: bool = False, glob: str = None, limit: int = workspace_search.SEARCH_MAX_RESULTS):
+    """
+    Full-text search over a session's workspace. `q` is a literal string, or a regular
+    expression with `regex=true`; `glob` limits the search to matching paths.
+    """
+    if not q:
+        raise HTTPException(status_code=422, detail="'q' must not be empty.")
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=422, detail="'limit' must be between 1 and 1000.")
+    return await workspace_search.search_files(q, session_id, regex=regex, case_sensitive=case_sensitive, glob=glob, max_results=limit)
+
+@app.get("/io/stats", tags=["Filesystem"])
+async def get_io_stats():
+    """Returns queue depth and latency metrics of the workspace I/O pool."""
+    return filesystem_tools.get_io_stats()
+
+@app.get("/io/tree_cache", tags=["Filesystem"])
+async def get_tree_cache_stats():
+    """Returns hit/miss counters of the workspace tree cache."""
+    return workspace_tree.tree_cache.stats()
+
+@app.get("/io/shells", tags=["Filesystem"])
+async def get_shell_stats():
+    """Returns the number of live and busy persistent session shells."""
+    return terminal_tools.shell_pool.stats()
+
+@app.get("/io/memory", tags=["Filesystem"])
+async def get_memory_stats():
+    """Returns how many sessions' memory stores are open and how many entries they cache."""
+    return memory_manager.get_memory_stats()
+
+@app.get("/io/search_index", tags=["Filesystem"])
+async def get_search_index_stats():
+    """Returns the size of the workspace search indexes held in memory."""
+    return workspace_search.get_search_stats()
+
+@app.get("/browser/stats", tags=["Browser"])
+async def get_browser_stats():
+    """Returns leased and warm browser contexts, open pages and crash counts of the browser pool."""
+    return browser_tools.browser_pool.stats()
+
+@app.get("/browser/cache", tags=["Browser"])
+async def get_extraction_cache_stats():
+    """Returns hit, revalidation and eviction counters of the page extraction cache."""
+    return web_fetch.extraction_cache.stats()
+
+@app.get("/browser/fetch", tags=["Browser"])
+async def get_fetch_stats():
+    """Returns how many page requests the cache, plain HTTP and the browser served, and why the browser was needed."""
+    return web_fetch.fetch_stats()
+
+
+# --- STATIC FILES ---
+app.mount("/assets", StaticFiles(directory="static/assets"), name="assets")
+
+@app.get("/{catchall:path}")
+async def serve_static(catchall: str):
+    return FileResponse("static/index.html")
 
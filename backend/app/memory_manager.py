@@ -1,69 +1,231 @@
-_# MyAssistant/backend/app/memory_manager.py
+# MyAssistant/backend/app/memory_manager.py
 
 import json
 import os
+import time
 import asyncio
+import sqlite3
+import threading
 import logging
+from collections import OrderedDict
+from app.io_pool import workspace_pool
+from app.session_manager import SESSIONS_DIR
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class MemoryManager:
-    def __init__(self, session_id: str, memory_dir: str = "sessions"):
+# Sessions whose memory stays open and cached; the least recently used are closed first
+MEMORY_CACHE_SESSIONS = int(os.getenv("MEMORY_CACHE_SESSIONS", "64"))
+
+TABLES = ("knowledge", "persona")
+
+
+class MemoryStore:
+    """
+    The persistent memory (knowledge and persona) of one session, in an SQLite database in WAL
+    mode with one row per key, so that saving a key costs the same however much is stored.
+
+    Both tables are read into memory when the store is opened and every write goes through to
+    the database before updating them, so reads never touch the disk. Writes run on the
+    workspace I/O pool, serialized by a lock; other processes are held off by SQLite's own
+    locking. The knowledge.json and persona.json files of older sessions are imported once.
+    """
+    def __init__(self, session_id: str, memory_dir: str = SESSIONS_DIR):
         self.session_id = session_id
         self.memory_dir = os.path.join(memory_dir, session_id)
-        os.makedirs(self.memory_dir, exist_ok=True)
+        self.path = os.path.join(self.memory_dir, "memory.db")
         self.knowledge_file = os.path.join(self.memory_dir, "knowledge.json")
         self.persona_file = os.path.join(self.memory_dir, "persona.json")
+        self.cache = None # table -> {key: value}, once loaded
+        self._conn = None
+        self._lock = threading.Lock() # guards the connection, and the cache against racing writes
+        self._loading = asyncio.Lock()
+        self.users = 0 # tool calls in progress, during which the store is not evicted
 
-    async def _read_json_file(self, file_path: str, default_value: dict) -> dict:
-        if not os.path.exists(file_path):
-            return default_value
+    # --- DATABASE (run on the I/O pool) ---
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.memory_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for table in TABLES:
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS memory_meta (key TEXT PRIMARY KEY, value TEXT)")
+            try:
+                self._migrate_json()
+            except Exception:
+                self._conn.close()
+                self._conn = None # retried on next use
+                raise
+        return self._conn
+
+    def _migrate_json(self):
+        """One-time import of knowledge.json and persona.json; the files themselves are left untouched."""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            async with asyncio.Lock(): # Ensure atomic file operations
-                with open(file_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-        except json.JSONDecodeError as e:
-            logger.error(f"Error decoding JSON from {file_path}: {e}")
-            return default_value
-        except Exception as e:
-            logger.error(f"Error reading {file_path}: {e}")
-            return default_value
-
-    async def _write_json_file(self, file_path: str, data: dict):
+            if conn.execute("SELECT 1 FROM memory_meta WHERE key = 'json_migrated'").fetchone():
+                conn.rollback()
+                return
+            imported = 0
+            for table, file_path in (("knowledge", self.knowledge_file), ("persona", self.persona_file)):
+                data = self._read_json_file(file_path)
+                now = time.time()
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO {table} (key, value, updated_at) VALUES (?, ?, ?)",
+                    [(key, json.dumps(value), now) for key, value in data.items()]
+                )
+                imported += len(data)
+            conn.execute("INSERT INTO memory_meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+            conn.commit()
+            if imported:
+                logger.info(f"[{self.session_id}] Migrated {imported} memory entries from JSON into {self.path}")
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _read_json_file(self, file_path: str) -> dict:
+        if not os.path.exists(file_path):
+            return {}
         try:
-            async with asyncio.Lock(): # Ensure atomic file operations
-                with open(file_path, "w", encoding="utf-8") as f:
-                    json.dump(data, f, indent=4)
-        except Exception as e:
-            logger.error(f"Error writing to {file_path}: {e}")
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error reading {file_path}, not migrating it: {e}")
+            return {}
+
+    def _load(self):
+        with self._lock:
+            conn = self._connection()
+            self.cache = {
+                table: {key: json.loads(value) for key, value in conn.execute(f"SELECT key, value FROM {table}")}
+                for table in TABLES
+            }
+
+    def _upsert(self, table: str, items: dict):
+        """Writes `items` into a table in one transaction, then into the cache."""
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    f"INSERT INTO {table} (key, value, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                    [(key, json.dumps(value), now) for key, value in items.items()]
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            self.cache[table].update(items)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # --- ASYNC API ---
+
+    async def load(self):
+        if self.cache is None:
+            async with self._loading:
+                if self.cache is None:
+                    await workspace_pool.submit(self.session_id, self._load)
 
     async def save_knowledge(self, key: str, value: any):
         """Saves a piece of knowledge to the session's persistent memory."""
-        knowledge = await self._read_json_file(self.knowledge_file, {})
-        knowledge[key] = value
-        await self._write_json_file(self.knowledge_file, knowledge)
+        await self.load()
+        await workspace_pool.submit(self.session_id, self._upsert, "knowledge", {key: value})
         logger.info(f"Knowledge saved: {key}")
 
     async def retrieve_knowledge(self, key: str, default: any = None) -> any:
         """Retrieves a piece of knowledge from the session's persistent memory."""
-        knowledge = await self._read_json_file(self.knowledge_file, {})
-        return knowledge.get(key, default)
+        await self.load()
+        return self.cache["knowledge"].get(key, default)
 
     async def update_persona(self, persona_data: dict):
         """Updates the AI's persona with new attributes or preferences."""
-        persona = await self._read_json_file(self.persona_file, {})
-        persona.update(persona_data)
-        await self._write_json_file(self.persona_file, persona)
+        await self.load()
+        await workspace_pool.submit(self.session_id, self._upsert, "persona", dict(persona_data))
         logger.info("Persona updated.")
 
     async def get_persona(self) -> dict:
         """Retrieves the current persona data."""
-        return await self._read_json_file(self.persona_file, {})
+        await self.load()
+        return dict(self.cache["persona"])
 
     async def get_all_knowledge(self) -> dict:
         """Retrieves all stored knowledge for the session."""
-        return await self._read_json_file(self.knowledge_file, {})
+        await self.load()
+        return dict(self.cache["knowledge"])
+
+
+class MemoryManager(MemoryStore):
+    """Kept for existing callers: a session's memory store."""
+
+
+_stores = OrderedDict() # session id -> MemoryStore, least recently used first
+
+def get_store(session_id: str) -> MemoryStore:
+    """Returns the open memory store of a session, closing the least recently used ones beyond MEMORY_CACHE_SESSIONS."""
+    store = _stores.get(session_id)
+    if store is not None:
+        _stores.move_to_end(session_id)
+        return store
+    store = _stores[session_id] = MemoryStore(session_id)
+    # A store in use stays, so that a session never has two stores with diverging caches
+    idle = [other for other in _stores.values() if other.users == 0 and other is not store]
+    for evicted in idle[:max(0, len(_stores) - MEMORY_CACHE_SESSIONS)]:
+        del _stores[evicted.session_id]
+        asyncio.ensure_future(workspace_pool.submit(evicted.session_id, evicted.close))
+    return store
+
+async def _with_store(session_id: str, operation):
+    store = get_store(session_id)
+    store.users += 1
+    try:
+        return await operation(store)
+    finally:
+        store.users -= 1
+
+async def close_all():
+    """Closes the memory databases of all sessions (called on shutdown)."""
+    while _stores:
+        _, store = _stores.popitem(last=False)
+        await workspace_pool.submit(store.session_id, store.close)
+
+def get_memory_stats() -> dict:
+    return {
+        "open_sessions": len(_stores),
+        "max_sessions": MEMORY_CACHE_SESSIONS,
+        "cached_entries": sum(len(entries) for store in _stores.values() if store.cache for entries in store.cache.values()),
+    }
+
+
+# --- SESSION-AWARE TOOLS ---
+
+async def save_knowledge(key: str, value: any, session_id: str) -> str:
+    await _with_store(session_id, lambda store: store.save_knowledge(key, value))
+    return f"Knowledge saved: {key}"
+
+async def retrieve_knowledge(key: str, default: any = None, session_id: str = None) -> any:
+    return await _with_store(session_id, lambda store: store.retrieve_knowledge(key, default))
+
+async def update_persona(persona_data: dict, session_id: str) -> str:
+    await _with_store(session_id, lambda store: store.update_persona(persona_data))
+    return f"Persona updated: {', '.join(persona_data)}"
+
+async def get_persona(session_id: str) -> dict:
+    return await _with_store(session_id, lambda store: store.get_persona())
+
+async def get_all_knowledge(session_id: str) -> dict:
+    return await _with_store(session_id, lambda store: store.get_all_knowledge())
+
 
 # Example usage (for testing purposes)
 async def main():
@@ -73,9 +235,9 @@ async def main():
     # Test saving and retrieving knowledge
     await memory_manager.save_knowledge("project_name", "Ethco AI")
     await memory_manager.save_knowledge("user_preference_theme", "dark")
-    print(f"Project Name: {await memory_manager.retrieve_knowledge("project_name")}")
-    print(f"User Theme: {await memory_manager.retrieve_knowledge("user_preference_theme")}")
-    print(f"Non-existent key: {await memory_manager.retrieve_knowledge("non_existent", "default_value")}")
+    print(f"Project Name: {await memory_manager.retrieve_knowledge('project_name')}")
+    print(f"User Theme: {await memory_manager.retrieve_knowledge('user_preference_theme')}")
+    print(f"Non-existent key: {await memory_manager.retrieve_knowledge('non_existent', 'default_value')}")
 
     # Test updating and getting persona
     await memory_manager.update_persona({"name": "Manus", "role": "AI Assistant"})
@@ -84,6 +246,7 @@ async def main():
 
     # Test getting all knowledge
     print(f"All Knowledge: {await memory_manager.get_all_knowledge()}")
+    memory_manager.close()
 
     # Clean up test files
     # import shutil
@@ -91,4 +254,3 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-_
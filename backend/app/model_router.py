@@ -0,0 +1,156 @@
+import time
+from collections import deque
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _percentile(sorted_values: list, fraction: float):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ModelStats:
+    """Rolling latency and outcome window for a single model, plus its circuit breaker state."""
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window) # seconds, successful calls only
+        self.outcomes = deque(maxlen=window) # True for success, False for failure
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.probe_started = None # when the one request let through while half open was handed out
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+class ModelRouter:
+    """
+    Orders models for each request by preference, skipping those whose circuit breaker is open.
+
+    A model's breaker opens after `failure_threshold` consecutive failures (429s included) and
+    stays open for `cooldown` seconds, or for the server's Retry-After when one is given. After
+    that a single request is let through ("half open"): success closes the breaker, failure
+    re-opens it. The probe is claimed with `try_claim` when the request is actually sent; until its
+    outcome is recorded, or `probe_timeout` seconds pass without one, other requests skip the model.
+    Rolling p50/p95 latencies are kept per model so callers can hedge slow requests.
+    """
+    def __init__(self, models: list, window: int = 100, failure_threshold: int = 3, cooldown: float = 30.0, max_error_rate: float = 0.5, min_samples: int = 10, probe_timeout: float = 120.0):
+        self.models = list(models)
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self._stats = {model: ModelStats(window) for model in self.models}
+
+    def _get(self, model: str) -> ModelStats:
+        if model not in self._stats:
+            self._stats[model] = ModelStats(self.window)
+        return self._stats[model]
+
+    def _available(self, stats: ModelStats, now: float, claim_probe: bool = False) -> bool:
+        if stats.state == OPEN and now >= stats.open_until:
+            stats.state = HALF_OPEN
+            stats.probe_started = None
+        if stats.state == HALF_OPEN:
+            if stats.probe_started is not None and now - stats.probe_started < self.probe_timeout:
+                return False # the probe is in flight
+            if claim_probe:
+                stats.probe_started = now
+        return stats.state != OPEN
+
+    def candidates(self) -> list:
+        """
+        Returns the models to try, in order. Models with an open breaker are left out and models
+        with a high recent error rate are tried after the healthy ones. If every breaker is open,
+        all models are returned, soonest to recover first, rather than failing outright.
+        """
+        now = time.monotonic()
+        available = [model for model in self.models if self._available(self._get(model), now)]
+        if not available:
+            return sorted(self.models, key=lambda model: self._get(model).open_until)
+
+        def degraded(model):
+            stats = self._get(model)
+            return len(stats.outcomes) >= self.min_samples and stats.error_rate() > self.max_error_rate
+        return sorted(available, key=degraded) # stable, so preference order is kept otherwise
+
+    def try_claim(self, model: str) -> bool:
+        """
+        Called just before a request is sent to `model`. Claims the single probe of a half-open
+        breaker, returning False if another request already holds it. Models that are closed, or
+        open but handed out because every breaker was open, may always be used.
+        """
+        stats = self._get(model)
+        if self._available(stats, time.monotonic(), claim_probe=True):
+            return True
+        return stats.state == OPEN
+
+    def record_success(self, model: str, latency: float = None):
+        """Records a successful call; `latency` may be omitted for calls not comparable to the rest (streams)."""
+        stats = self._get(model)
+        stats.requests += 1
+        stats.outcomes.append(True)
+        stats.consecutive_failures = 0
+        if latency is not None:
+            stats.latencies.append(latency)
+        if stats.state != CLOSED:
+            print(f"Circuit for {model} closed.")
+            stats.state = CLOSED
+            stats.probe_started = None
+
+    def record_failure(self, model: str, rate_limited: bool = False, retry_after: float = None):
+        """Records a failed call and opens the model's breaker if it keeps failing."""
+        stats = self._get(model)
+        stats.requests += 1
+        stats.failures += 1
+        stats.outcomes.append(False)
+        stats.consecutive_failures += 1
+        if rate_limited:
+            stats.rate_limited += 1
+        if stats.state == HALF_OPEN or stats.consecutive_failures >= self.failure_threshold:
+            cooldown = retry_after if retry_after else self.cooldown
+            stats.state = OPEN
+            stats.probe_started = None
+            stats.open_until = time.monotonic() + cooldown
+            print(f"Circuit for {model} opened for {cooldown:.0f}s after {stats.consecutive_failures} consecutive failures.")
+
+    def hedge_delay(self, model: str):
+        """Returns the model's p95 latency once enough samples exist, otherwise None (no hedging)."""
+        stats = self._get(model)
+        if len(stats.latencies) < self.min_samples:
+            return None
+        return _percentile(sorted(stats.latencies), 0.95)
+
+    def stats(self) -> dict:
+        """Returns per-model latency percentiles, error rates and breaker states."""
+        now = time.monotonic()
+        report = {}
+        for model, stats in self._stats.items():
+            self._available(stats, now)
+            latencies = sorted(stats.latencies)
+            p50 = _percentile(latencies, 0.5)
+            p95 = _percentile(latencies, 0.95)
+            report[model] = {
+                "state": stats.state,
+                "open_for": max(0.0, stats.open_until - now) if stats.state == OPEN else 0.0,
+                "probing": stats.state == HALF_OPEN and stats.probe_started is not None,
+                "requests": stats.requests,
+                "failures": stats.failures,
+                "rate_limited": stats.rate_limited,
+                "error_rate": stats.error_rate(),
+                "p50_ms": p50 * 1000 if p50 is not None else None,
+                "p95_ms": p95 * 1000 if p95 is not None else None,
+            }
+        return report
@@ -0,0 +1,121 @@
+import os
+from typing import NamedTuple
+
+# Filesystem tools and whether they modify the path they are given
+FILESYSTEM_WRITES = {"CREATE_FILE", "CREATE_FOLDER", "ADD_CONTENT", "DELETE_FILE", "DELETE_FOLDER"}
+FILESYSTEM_READS = {"LIST_DIRECTORY_CONTENTS", "READ_FILE_CONTENT"}
+
+# Browser tools that change the shared page state, and those that only need it to be settled
+BROWSER_WRITES = {"NAVIGATE_TO_URL", "INTERACT_WITH_ELEMENT", "TAKE_SCREENSHOT"}
+BROWSER_READS = {"EXTRACT_CONTENT", "WEB_SEARCH"}
+
+WORKSPACE_ROOT = "."
+
+
+class Access(NamedTuple):
+    """
+    The resources a plan step touches. Resources are tuples such as ("fs", "src/app.py"),
+    ("browser",) or ("knowledge", "key"). A barrier step (a shell command, FINISH, anything
+    unknown) is ordered after every earlier step and before every later one.
+    """
+    reads: frozenset
+    writes: frozenset
+    barrier: bool = False
+
+
+def _workspace_path(path: str) -> str:
+    """Normalizes a workspace-relative path; anything that escapes the workspace maps to its root."""
+    path = os.path.normpath(path.strip() or WORKSPACE_ROOT)
+    if os.path.isabs(path) or path == ".." or path.startswith(".." + os.sep):
+        return WORKSPACE_ROOT
+    return path
+
+
+def command_access(command: dict) -> Access:
+    """Classifies a parsed plan command by the resources it reads and writes."""
+    tool = command["tool"]
+    args = command.get("args", "")
+
+    if tool == "ADD_CONTENT":
+        return Access(frozenset(), frozenset({("fs", _workspace_path(command["path"]))}))
+    if tool in FILESYSTEM_WRITES:
+        return Access(frozenset(), frozenset({("fs", _workspace_path(args))}))
+    if tool in FILESYSTEM_READS:
+        return Access(frozenset({("fs", _workspace_path(args))}), frozenset())
+    if tool == "SEARCH_FILES":
+        # Reads the whole workspace, whatever its glob filter
+        return Access(frozenset({("fs", WORKSPACE_ROOT)}), frozenset())
+
+    if tool == "TAKE_SCREENSHOT":
+        # Also writes the image into the workspace: "url [path]", as agent_core parses it
+        parts = args.split(maxsplit=1)
+        path = parts[1] if len(parts) > 1 else "screenshot.png"
+        return Access(frozenset(), frozenset({("browser",), ("fs", _workspace_path(path))}))
+    if tool in BROWSER_WRITES:
+        return Access(frozenset(), frozenset({("browser",)}))
+    if tool in BROWSER_READS:
+        return Access(frozenset({("browser",)}), frozenset())
+
+    if tool == "SAVE_KNOWLEDGE":
+        key = args.split(maxsplit=1)[0] if args.strip() else ""
+        return Access(frozenset(), frozenset({("knowledge", key)}))
+    if tool == "RETRIEVE_KNOWLEDGE":
+        key = args.split(maxsplit=1)[0] if args.strip() else ""
+        return Access(frozenset({("knowledge", key)}), frozenset())
+    if tool == "UPDATE_PERSONA":
+        return Access(frozenset(), frozenset({("persona",)}))
+
+    # EXECUTE_COMMAND can touch anything, and FINISH must come last
+    return Access(frozenset(), frozenset(), barrier=True)
+
+
+def _overlaps(a: tuple, b: tuple) -> bool:
+    """Two resources overlap if they are equal or, for paths, one contains the other."""
+    if a[0] != b[0]:
+        return False
+    if a[0] != "fs":
+        return a == b
+    path_a, path_b = a[1], b[1]
+    if path_a == path_b or WORKSPACE_ROOT in (path_a, path_b):
+        return True
+    return path_b.startswith(path_a + os.sep) or path_a.startswith(path_b + os.sep)
+
+
+def conflicts(later: Access, earlier: Access) -> bool:
+    """Returns True if the later step must wait for the earlier one."""
+    if later.barrier or earlier.barrier:
+        return True
+    for written in later.writes:
+        if any(_overlaps(written, other) for other in earlier.reads | earlier.writes):
+            return True
+    for read in later.reads:
+        if any(_overlaps(read, other) for other in earlier.writes):
+            return True
+    return False
+
+
+class DependencyGraph:
+    """
+    Builds the dependency DAG of a plan one step at a time, as steps are parsed.
+    Only steps since the most recent barrier are compared, the barrier itself standing in
+    for everything before it.
+    """
+    def __init__(self):
+        self._since_barrier = [] # (node, access) for steps added after the last barrier
+        self._barrier = None
+
+    def add(self, node, access: Access) -> list:
+        """Registers a step and returns the earlier nodes it depends on."""
+        if access.barrier:
+            dependencies = [previous for previous, _ in self._since_barrier]
+            if self._barrier is not None:
+                dependencies.append(self._barrier)
+            self._barrier = node
+            self._since_barrier = []
+            return dependencies
+
+        dependencies = [previous for previous, previous_access in self._since_barrier if conflicts(access, previous_access)]
+        if self._barrier is not None:
+            dependencies.append(self._barrier)
+        self._since_barrier.append((node, access))
+        return dependencies
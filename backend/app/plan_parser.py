@@ -0,0 +1,147 @@
+import re
+import time
+
+# Matches a plan step such as "- [ ] CREATE_FILE: src/main.py", capturing the tool and its arguments
+STEP_PATTERN = re.compile(r"- \[ \] (\w+):?\s*(.*)")
+
+# Parser states
+_SEEKING = 0 # looking for the next "- [ ]" step
+_AWAIT_FENCE = 1 # after an ADD_CONTENT header, expecting its opening code fence
+_IN_FENCE = 2 # collecting ADD_CONTENT lines until the closing fence
+
+
+class PlanParser:
+    """
+    Resumable state-machine parser for the markdown plans produced by the LLM.
+
+    Plan text is fed in arbitrary chunks -- lines and code fences may be split anywhere -- and
+    each command is returned as soon as it is complete: a regular step once its line ends, an
+    ADD_CONTENT step once its closing code fence has arrived. Every character is scanned once,
+    so parsing is linear in the size of the plan regardless of how it is chunked.
+    """
+    def __init__(self):
+        self._partial = [] # fragments of the current line, not yet terminated by a newline
+        self._state = _SEEKING
+        self._command = None # ADD_CONTENT command being assembled
+        self._content = []
+        self._ready = []
+
+    def feed(self, chunk: str) -> list:
+        """Consumes a chunk of plan text and returns the commands it completed."""
+        start = 0
+        find = chunk.find
+        while True:
+            end = find("\n", start)
+            if end < 0:
+                break
+            if self._partial:
+                self._partial.append(chunk[start:end])
+                line = "".join(self._partial)
+                self._partial = []
+            else:
+                line = chunk[start:end]
+            self._process_line(line)
+            start = end + 1
+        if start < len(chunk):
+            self._partial.append(chunk[start:])
+        return self._take_ready()
+
+    def close(self) -> list:
+        """Signals the end of the plan and returns any commands still being assembled."""
+        if self._partial:
+            line = "".join(self._partial)
+            self._partial = []
+            self._process_line(line)
+        if self._state != _SEEKING:
+            self._finish_command()
+        return self._take_ready()
+
+    def _take_ready(self) -> list:
+        ready = self._ready
+        self._ready = []
+        return ready
+
+    def _finish_command(self):
+        self._command["content"] = "\n".join(self._content)
+        self._ready.append(self._command)
+        self._command = None
+        self._content = []
+        self._state = _SEEKING
+
+    def _process_line(self, line: str):
+        if self._state == _IN_FENCE:
+            if line.strip() == "```":
+                self._finish_command()
+            else:
+                self._content.append(line)
+            return
+
+        stripped = line.strip()
+        if self._state == _AWAIT_FENCE:
+            # Proactively handles code fences with or without language specifiers
+            if stripped.startswith("```"):
+                self._state = _IN_FENCE
+                return
+            # The ADD_CONTENT step has no code block; emit it empty and handle this line normally
+            self._finish_command()
+
+        if not stripped.startswith("- [ ]"):
+            return
+        match = STEP_PATTERN.match(stripped)
+        if not match:
+            return
+
+        tool, args = match.groups()
+        if tool == "ADD_CONTENT":
+            self._command = {"tool": tool, "path": args.strip()}
+            self._state = _AWAIT_FENCE
+        else:
+            self._ready.append({"tool": tool, "args": args.strip()})
+
+
+def iter_commands(chunks):
+    """Parses an iterable of text chunks, yielding each command as soon as it is complete."""
+    parser = PlanParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def parse_plan(plan_text: str) -> list:
+    """Parses a complete plan into a structured list of commands."""
+    parser = PlanParser()
+    return parser.feed(plan_text.strip()) + parser.close()
+
+
+# Micro-benchmark (for testing purposes)
+def _build_benchmark_plan(target_bytes: int, body_lines: int = 2000) -> str:
+    body = "\n".join(f"    line_{n} = compute({n}, 'payload')  # filler" for n in range(body_lines))
+    steps = []
+    size = 0
+    n = 0
+    while size < target_bytes:
+        step = (
+            f"- [ ] CREATE_FILE: src/module_{n}.py\n"
+            f"- [ ] ADD_CONTENT: src/module_{n}.py\n"
+            f"```python\ndef main_{n}():\n{body}\n```\n"
+            f"- [ ] EXECUTE_COMMAND: python src/module_{n}.py\n"
+        )
+        steps.append(step)
+        size += len(step)
+        n += 1
+    steps.append("- [ ] FINISH: Done.\n")
+    return "".join(steps)
+
+def main():
+    for megabytes in (1, 4, 16):
+        plan = _build_benchmark_plan(megabytes * 1024 * 1024)
+        for chunk_size in (None, 65536, 64):
+            chunks = [plan] if chunk_size is None else [plan[i:i + chunk_size] for i in range(0, len(plan), chunk_size)]
+            started = time.perf_counter()
+            commands = list(iter_commands(chunks))
+            elapsed = time.perf_counter() - started
+            label = "whole" if chunk_size is None else f"{chunk_size} B"
+            print(f"{megabytes:>3} MB plan, chunks: {label:>8} -> {len(commands):>5} commands in {elapsed * 1000:8.1f} ms ({len(plan) / elapsed / 1e6:6.1f} MB/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import json
+import hashlib
+import threading
+from typing import NamedTuple
+
+
+class RenderedPrompt(NamedTuple):
+    """
+    A prompt made of a large static prefix shared between requests and a small per-request part.
+    The prefix is kept as a reference to the template's cached copy, already JSON-encoded,
+    so it is neither re-read nor re-escaped when the request body is built.
+    """
+    prefix: str
+    prefix_json: bytes
+    text: str
+    version: str
+
+    def request_body(self) -> bytes:
+        """Builds the Gemini request body, sending the prefix and the per-request text as two parts."""
+        return b"".join([
+            b'{"contents": [{"parts": [{"text": ',
+            self.prefix_json,
+            b'}, {"text": ',
+            json.dumps(self.text).encode('utf-8'),
+            b'}]}]}',
+        ])
+
+    def __str__(self):
+        return self.prefix + self.text
+
+
+class PromptTemplate:
+    """
+    A static prompt prefix (such as the agent's constitution) loaded from disk once and
+    reloaded only when the file's modification time or size changes. Its `version` is a
+    hash of the content, suitable as a key for caches of responses to this prompt.
+    """
+    def __init__(self, path: str, separator: str = "\n\n"):
+        self.path = path
+        self.separator = separator
+        self._lock = threading.Lock()
+        self._signature = None
+        self._state = None # (content, JSON-encoded content, version), swapped atomically on reload
+
+    def _refresh(self) -> tuple:
+        """Reloads the template if the file changed since it was last read, and returns its state."""
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return self._state
+        with self._lock:
+            if signature != self._signature:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                version = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+                self._state = (content, json.dumps(content).encode('utf-8'), version)
+                self._signature = signature
+                print(f"Loaded prompt template {self.path} (version {version}).")
+            return self._state
+
+    @property
+    def content(self) -> str:
+        return self._refresh()[0]
+
+    @property
+    def version(self) -> str:
+        return self._refresh()[2]
+
+    def render(self, text: str) -> RenderedPrompt:
+        """Appends the per-request text to the template."""
+        content, content_json, version = self._refresh()
+        return RenderedPrompt(content, content_json, self.separator + text, version)
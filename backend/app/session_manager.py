@@ -1,28 +1,96 @@
 import os
 import json
+import asyncio
 import uuid
+import base64
+import sqlite3
+import struct
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from app.io_pool import workspace_pool
 
 # Base directory for all sessions
 SESSIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'sessions'))
+# Legacy flat metadata file, imported into the catalog once
 METADATA_FILE = os.path.join(SESSIONS_DIR, 'metadata.json')
+CATALOG_DB = os.path.join(SESSIONS_DIR, 'catalog.db')
+# I/O pool key of the catalog's database work, which is held to the pool's per-key limit
+CATALOG_IO_KEY = "session-catalog"
 
-def _read_metadata():
-    """Reads the metadata file, creating it if it doesn't exist."""
-    if not os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'w') as f:
-            json.dump({}, f)
-        return {}
-    with open(METADATA_FILE, 'r') as f:
-        return json.load(f)
+_catalog_ready = False
+_catalog_lock = threading.Lock()
 
-def _write_metadata(data):
-    """Writes data to the metadata file."""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+def _connect():
+    conn = sqlite3.connect(CATALOG_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _ensure_catalog():
+    """Creates the session catalog and imports the legacy metadata.json into it the first time."""
+    global _catalog_ready
+    if _catalog_ready:
+        return
+    with _catalog_lock:
+        if _catalog_ready:
+            return
+        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        conn = _connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            # Serves newest-first listing and keyset pagination without sorting
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions (created_at DESC, id DESC)")
+            conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.commit()
+            _migrate_metadata(conn)
+        finally:
+            conn.close()
+        _catalog_ready = True
+
+def _migrate_metadata(conn):
+    """One-time import of sessions from metadata.json; the file itself is left untouched."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM catalog_meta WHERE key = 'metadata_json_migrated'").fetchone():
+            conn.rollback()
+            return
+        metadata = {}
+        if os.path.exists(METADATA_FILE):
+            with open(METADATA_FILE, 'r') as f:
+                metadata = json.load(f)
+        conn.executemany(
+            "INSERT OR IGNORE INTO sessions (id, name, created_at) VALUES (?, ?, ?)",
+            [(s['id'], s.get('name', 'New Chat'), s['created_at']) for s in metadata.values()]
+        )
+        conn.execute("INSERT INTO catalog_meta (key, value) VALUES ('metadata_json_migrated', ?)", (datetime.utcnow().isoformat(),))
+        conn.commit()
+        if metadata:
+            print(f"Migrated {len(metadata)} session(s) from metadata.json into the session catalog.")
+    except Exception:
+        conn.rollback()
+        raise
+
+def _encode_cursor(session: dict) -> str:
+    raw = json.dumps([session['created_at'], session['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return created_at, session_id
+    except Exception:
+        raise ValueError(f"Invalid session cursor: {cursor}")
 
 def create_new_session():
     """Creates a new session and returns its details."""
+    _ensure_catalog()
     session_id = str(uuid.uuid4())
     session_path = os.path.join(SESSIONS_DIR, session_id)
     workspace_path = os.path.join(session_path, 'workspace')
@@ -32,41 +100,279 @@ def create_new_session():
     # Create an empty history file
     open(os.path.join(session_path, 'history.jsonl'), 'w').close()
 
-    metadata = _read_metadata()
-    metadata[session_id] = {
+    session = {
         "id": session_id,
         "name": "New Chat", # A default name
         "created_at": datetime.utcnow().isoformat()
     }
-    _write_metadata(metadata)
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO sessions (id, name, created_at) VALUES (?, ?, ?)",
+            (session["id"], session["name"], session["created_at"])
+        )
     
     print(f"Created new session: {session_id}")
-    return metadata[session_id]
+    return session
+
+def list_sessions(limit: int = None, cursor: str = None) -> tuple:
+    """
+    Returns a page of sessions, newest first, and the cursor of the next page (None on the
+    last page). Pages are read straight from the catalog index.
+    """
+    _ensure_catalog()
+    query = "SELECT id, name, created_at FROM sessions"
+    params = []
+    if cursor:
+        created_at, session_id = _decode_cursor(cursor)
+        query += " WHERE created_at < ? OR (created_at = ? AND id < ?)"
+        params += [created_at, created_at, session_id]
+    query += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        # Fetch one extra row to know whether another page follows
+        query += " LIMIT ?"
+        params.append(limit + 1)
+
+    conn = _connect()
+    try:
+        sessions = [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if limit is not None and len(sessions) > limit:
+        sessions = sessions[:limit]
+        next_cursor = _encode_cursor(sessions[-1])
+    return sessions, next_cursor
 
 def get_all_sessions():
     """Returns a list of all sessions, sorted by creation date."""
-    metadata = _read_metadata()
-    sessions = list(metadata.values())
-    # Sort sessions newest first
-    sessions.sort(key=lambda s: s['created_at'], reverse=True)
+    sessions, _ = list_sessions()
     return sessions
 
-def get_session_history(session_id: str):
-    """Retrieves the chat history for a given session."""
-    history_file = os.path.join(SESSIONS_DIR, session_id, 'history.jsonl')
-    if not os.path.exists(history_file):
-        return []
-    
-    history = []
-    with open(history_file, 'r') as f:
+# --- HISTORY ---
+# history.jsonl is append-only; history.idx is a sidecar array of little-endian uint64 byte
+# offsets, one per message, so any slice of the history can be read with a single seek.
+INDEX_ENTRY = struct.Struct("<Q")
+
+_index_locks = {}
+_index_locks_guard = threading.Lock()
+
+# Offsets of recently read histories, kept with the index file size they match, so a sync only
+# reads the index entries appended since
+MAX_INDEXED_SESSIONS = 64
+_index_cache = OrderedDict() # session id -> (index file size, offsets), least recently used first
+
+def _history_paths(session_id: str) -> tuple:
+    session_path = os.path.join(SESSIONS_DIR, session_id)
+    return os.path.join(session_path, 'history.jsonl'), os.path.join(session_path, 'history.idx')
+
+def _index_lock(session_id: str) -> threading.Lock:
+    with _index_locks_guard:
+        return _index_locks.setdefault(session_id, threading.Lock())
+
+def _sync_index(session_id: str, history_file: str, index_file: str) -> list:
+    """
+    Brings the offset index up to date with the history file and returns the offsets.
+    Only the index entries and the part of the history written since the last sync are read;
+    a missing or inconsistent index is rebuilt from scratch. Call with the session's index lock held.
+    """
+    index_size = os.path.getsize(index_file) if os.path.exists(index_file) else 0
+    with _index_locks_guard:
+        cached_size, offsets = _index_cache.pop(session_id, (0, []))
+    if cached_size > index_size:
+        # The index was removed or replaced since it was cached
+        cached_size, offsets = 0, []
+
+    intact = index_size % INDEX_ENTRY.size == 0
+    if index_size > cached_size:
+        with open(index_file, 'rb') as f:
+            f.seek(cached_size)
+            data = f.read(index_size - cached_size)
+        offsets.extend(entry[0] for entry in INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]))
+    if offsets and offsets[-1] >= os.path.getsize(history_file):
+        # The history was truncated or replaced; rebuild the index
+        offsets = []
+        intact = False
+
+    # Rescan from the last indexed message (to find where it ends) up to the end of the file
+    new_offsets = []
+    with open(history_file, 'rb') as f:
+        position = offsets[-1] if offsets else 0
+        f.seek(position)
         for line in f:
-            history.append(json.loads(line))
+            if not line.endswith(b'\n'):
+                break # A message still being written; it is indexed on a later sync
+            if position != (offsets[-1] if offsets else -1):
+                new_offsets.append(position)
+            position += len(line)
+
+    offsets.extend(new_offsets)
+    if not intact:
+        with open(index_file, 'wb') as f:
+            f.write(b"".join(INDEX_ENTRY.pack(offset) for offset in offsets))
+        index_size = len(offsets) * INDEX_ENTRY.size
+    elif new_offsets:
+        with open(index_file, 'ab') as f:
+            f.write(b"".join(INDEX_ENTRY.pack(offset) for offset in new_offsets))
+        index_size += len(new_offsets) * INDEX_ENTRY.size
+
+    with _index_locks_guard:
+        _index_cache[session_id] = (index_size, offsets)
+        while len(_index_cache) > MAX_INDEXED_SESSIONS:
+            _index_cache.popitem(last=False)
+    return offsets
+
+def get_history_page(session_id: str, limit: int = None, before: int = None) -> tuple:
+    """
+    Returns up to `limit` messages (all if None) immediately preceding message number `before`
+    (the end of the history if None), oldest first, together with the `before` cursor for the
+    preceding page (None once the start of the history is reached). Only the requested byte
+    range of the history file is read and parsed.
+    """
+    history_file, index_file = _history_paths(session_id)
+    if not os.path.exists(history_file):
+        return [], None
+
+    with _index_lock(session_id):
+        offsets = _sync_index(session_id, history_file, index_file)
+
+    end = len(offsets) if before is None else max(0, min(before, len(offsets)))
+    start = 0 if limit is None else max(0, end - limit)
+    if start >= end:
+        return [], None
+
+    with open(history_file, 'rb') as f:
+        f.seek(offsets[start])
+        if end < len(offsets):
+            data = f.read(offsets[end] - offsets[start])
+        else:
+            # Read up to the last complete message only
+            data = f.read()
+            data = data[:data.rfind(b'\n') + 1]
+
+    history = [json.loads(line) for line in data.splitlines() if line.strip()]
+    return history, (start if start > 0 else None)
+
+def get_session_history(session_id: str, limit: int = None, before: int = None):
+    """Retrieves the chat history for a given session (optionally only a slice of it)."""
+    history, _ = get_history_page(session_id, limit=limit, before=before)
     return history
 
+# --- BATCHED HISTORY WRITER ---
+# How long appended messages may wait so they can be written together (0 writes right away)
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.05"))
+# "flush": hand each batch to the OS; "fsync": also force it to disk before the next batch
+HISTORY_DURABILITY = os.getenv("HISTORY_DURABILITY", "flush")
+HISTORY_MAX_BATCH = int(os.getenv("HISTORY_MAX_BATCH", "256"))
+# Writers with nothing to do for this long close their file and exit
+HISTORY_IDLE_TIMEOUT = float(os.getenv("HISTORY_IDLE_TIMEOUT", "30"))
+
+_history_writers = {}
+
+class HistoryWriter:
+    """
+    Background writer for one session's history. Appends are queued in memory and written by
+    a task in batches, through a file handle kept open while the writer is alive, on the
+    workspace I/O pool. The writer exits after being idle, or when closed.
+    """
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.history_file = _history_paths(session_id)[0]
+        self._pending = []
+        self._file = None
+        self._closing = False
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def append(self, line: str):
+        self._pending.append(line)
+        self._wakeup.set()
+
+    async def _run(self):
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=HISTORY_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not self._pending:
+                        break
+                # Give further messages a moment to join this batch
+                if not self._closing and HISTORY_FLUSH_INTERVAL > 0 and len(self._pending) < HISTORY_MAX_BATCH:
+                    await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+                self._wakeup.clear()
+                await self.flush()
+                if self._closing:
+                    break
+            # Messages appended while the last batch was being written (e.g. when closed mid-flush)
+            while self._pending:
+                await self.flush()
+        finally:
+            if _history_writers.get(self.session_id) is self:
+                del _history_writers[self.session_id]
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    async def flush(self):
+        """Writes every queued message now."""
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await workspace_pool.submit(self.session_id, self._write, batch)
+            except Exception as e:
+                print(f"[{self.session_id}] Failed to write {len(batch)} history message(s): {e}")
+
+    def _write(self, batch: list):
+        if self._file is None:
+            self._file = open(self.history_file, 'a', encoding='utf-8')
+        self._file.write("".join(batch))
+        self._file.flush()
+        if HISTORY_DURABILITY == "fsync":
+            os.fsync(self._file.fileno())
+
+    async def close(self):
+        """Writes whatever is queued, closes the file and stops the background task."""
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+
 def append_to_history(session_id: str, message_object: dict):
-    """Appends a new message object to a session's history file."""
-    history_file = os.path.join(SESSIONS_DIR, session_id, 'history.jsonl')
+    """
+    Appends a new message object to a session's history file. Inside the event loop the
+    message is queued on the session's background writer; elsewhere it is written directly.
+    """
     # Ensure the message has a timestamp
     message_object['timestamp'] = datetime.utcnow().isoformat()
-    with open(history_file, 'a') as f:
-        f.write(json.dumps(message_object) + '\n')
+    line = json.dumps(message_object) + '\n'
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        with open(_history_paths(session_id)[0], 'a') as f:
+            f.write(line)
+        return
+
+    writer = _history_writers.get(session_id)
+    if writer is None or writer._closing:
+        writer = _history_writers[session_id] = HistoryWriter(session_id)
+    writer.append(line)
+
+async def flush_history(session_id: str):
+    """Writes out any queued messages of a session, e.g. before its history is read."""
+    writer = _history_writers.get(session_id)
+    if writer is not None:
+        await writer.flush()
+
+async def close_history(session_id: str):
+    """Flushes and closes a session's history writer (when its agent task ends)."""
+    writer = _history_writers.pop(session_id, None)
+    if writer is not None:
+        await writer.close()
+
+async def close_all_history():
+    """Flushes and closes every history writer (on shutdown)."""
+    writers = list(_history_writers.values())
+    _history_writers.clear()
+    await asyncio.gather(*(writer.close() for writer in writers))
@@ -1,42 +1,408 @@
 
+import os
+import time
+import uuid
+import codecs
+import signal
 import asyncio
 import logging
+from collections import OrderedDict
+from datetime import datetime
+from app.io_pool import workspace_pool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class TerminalTools:
-    def __init__(self):
-        pass
+SESSIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'sessions'))
 
-    async def execute_command(self, command: str, timeout: int = 300) -> str:
-        """Executes a shell command and returns its stdout and stderr."""
-        logger.info(f"Executing command: {command}")
+COMMAND_TIMEOUT = int(os.getenv("COMMAND_TIMEOUT", "300"))
+# Bytes of each output stream kept in memory, from its start and from its end
+OUTPUT_HEAD_BYTES = int(os.getenv("COMMAND_OUTPUT_HEAD_BYTES", "8192"))
+OUTPUT_TAIL_BYTES = int(os.getenv("COMMAND_OUTPUT_TAIL_BYTES", "8192"))
+READ_CHUNK_BYTES = 64 * 1024
+# Output is appended to the command's log file in batches of about this size
+LOG_FLUSH_BYTES = 256 * 1024
+# Folder of the command logs inside the session's workspace, where READ_FILE_CONTENT can open them
+LOG_DIR = ".logs"
+
+# Commands of a session run in one long-lived shell, keeping cd, exports and virtualenvs
+SHELL_POOL_ENABLED = os.getenv("SHELL_POOL_ENABLED", "true").lower() == "true"
+SHELL_PROGRAM = os.getenv("SHELL_PROGRAM", "/bin/bash")
+# Most shells alive at once on this server
+MAX_SHELLS = int(os.getenv("MAX_SHELLS", "16"))
+# Shells unused for this long are closed
+SHELL_IDLE_TIMEOUT = float(os.getenv("SHELL_IDLE_TIMEOUT", "600"))
+
+
+class BoundedOutput:
+    """Keeps the first `head_size` and the last `tail_size` bytes of a stream, counting the rest."""
+    def __init__(self, head_size: int = OUTPUT_HEAD_BYTES, tail_size: int = OUTPUT_TAIL_BYTES):
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def append(self, data: bytes):
+        self.total += len(data)
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_size:
+                del self.tail[:len(self.tail) - self.tail_size]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + len(self.tail)
+
+    def text(self) -> str:
+        if not self.truncated:
+            return (self.head + self.tail).decode('utf-8', errors='replace')
+        omitted = self.total - len(self.head) - len(self.tail)
+        head = self.head.decode('utf-8', errors='replace')
+        tail = self.tail.decode('utf-8', errors='replace')
+        return f"{head}\n... [{omitted} bytes omitted] ...\n{tail}"
+
+
+class CommandLog:
+    """The full output of one command, spilled to a file in the LOG_DIR folder of the session's workspace."""
+    def __init__(self, session_id: str, command: str):
+        self.session_id = session_id
+        name = f"command-{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}.log"
+        self.relative_path = os.path.join(LOG_DIR, name) # relative to the workspace
+        self.path = os.path.join(SESSIONS_DIR, session_id, 'workspace', self.relative_path)
+        self._pending = bytearray(f"$ {command}\n".encode('utf-8'))
+        self._lock = asyncio.Lock()
+
+    def add(self, data: bytes):
+        """Buffers output without writing it out yet."""
+        self._pending += data
+
+    async def write(self, data: bytes):
+        self.add(data)
+        if len(self._pending) >= LOG_FLUSH_BYTES:
+            await self.flush()
+
+    async def flush(self):
+        # The batch is taken under the lock so appends from both streams stay in order
+        async with self._lock:
+            if not self._pending:
+                return
+            data = bytes(self._pending)
+            self._pending.clear()
+            await workspace_pool.submit(self.session_id, self._append, data)
+
+    def _append(self, data: bytes):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+
+async def _pump(stream, name: str, output: BoundedOutput, log: CommandLog, on_output):
+    """Reads a process stream as it produces data, keeping a bounded copy and forwarding it."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        data = await stream.read(READ_CHUNK_BYTES)
+        if not data:
+            break
+        output.append(data)
+        if log is not None:
+            await log.write(data)
+        if on_output is not None:
+            text = decoder.decode(data)
+            if text:
+                await on_output(name, text)
+
+
+def _summarize(stdout: BoundedOutput, stderr: BoundedOutput, returncode, log: CommandLog) -> str:
+    output = f"STDOUT:\n{stdout.text().strip()}\n"
+    if stderr.total:
+        output += f"STDERR:\n{stderr.text().strip()}\n"
+    if returncode:
+        output += f"Command exited with code: {returncode}\n"
+    if log is not None and (stdout.truncated or stderr.truncated):
+        output += f"Output truncated; full log ({stdout.total + stderr.total} bytes) in the workspace: {log.relative_path}\n"
+    return output
+
+
+async def _execute_oneshot(command: str, session_id: str, timeout: int, on_output) -> str:
+    """Runs a command in a shell of its own."""
+    cwd = os.path.join(SESSIONS_DIR, session_id, 'workspace') if session_id else None
+    log = CommandLog(session_id, command) if session_id else None
+    stdout, stderr = BoundedOutput(), BoundedOutput()
+    process = None
+    try:
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd
+        )
+        pumps = asyncio.gather(
+            _pump(process.stdout, "stdout", stdout, log, on_output),
+            _pump(process.stderr, "stderr", stderr, log, on_output),
+        )
         try:
-            process = await asyncio.create_subprocess_shell(
-                command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-
-            output = f"STDOUT:\n{stdout.decode().strip()}\n"
-            if stderr:
-                output += f"STDERR:\n{stderr.decode().strip()}\n"
-            if process.returncode != 0:
-                output += f"Command exited with code: {process.returncode}\n"
-
-            logger.info(f"Command executed successfully. Return code: {process.returncode}")
-            return output
+            await asyncio.wait_for(asyncio.gather(pumps, process.wait()), timeout=timeout)
         except asyncio.TimeoutError:
             process.kill()
             await process.wait()
+            pumps.cancel()
             logger.error(f"Command timed out after {timeout} seconds: {command}")
-            return f"Error: Command timed out after {timeout} seconds."
-        except Exception as e:
-            logger.error(f"Error executing command \'{command}\': {e}")
+            return f"Error: Command timed out after {timeout} seconds.\n" + _summarize(stdout, stderr, None, log)
+
+        logger.info(f"Command executed successfully. Return code: {process.returncode}")
+        return _summarize(stdout, stderr, process.returncode, log)
+    except Exception as e:
+        if process is not None and process.returncode is None:
+            process.kill()
+        logger.error(f"Error executing command \'{command}\': {e}")
+        return f"Error executing command \'{command}\': {e}"
+    finally:
+        if log is not None:
+            await log.flush()
+
+
+# --- PERSISTENT SHELLS ---
+
+async def _read_framed(stream, name: str, end: bytes, output: BoundedOutput, log: CommandLog, on_output):
+    """
+    Reads one command's output from a shell stream, up to the line starting with the `end`
+    marker, and returns the rest of that line. Returns None if the shell exited first.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    needle = b"\n" + end # the marker is printed on a line of its own, after a newline of ours
+
+    async def emit(data: bytes):
+        if not data:
+            return
+        output.append(data)
+        await log.write(data)
+        if on_output is not None:
+            text = decoder.decode(data)
+            if text:
+                await on_output(name, text)
+
+    pending = b""
+    try:
+        while True:
+            data = await stream.read(READ_CHUNK_BYTES)
+            if not data:
+                await emit(pending)
+                return None
+            pending += data
+            index = pending.find(needle)
+            if index >= 0:
+                line_end = pending.find(b"\n", index + len(needle))
+                if line_end < 0:
+                    continue # The rest of the marker line is still to come
+                await emit(pending[:index])
+                return pending[index + len(needle):line_end].decode('utf-8', errors='replace').strip()
+            # Hold back what could be the start of the marker
+            keep = len(needle) - 1
+            if len(pending) > keep:
+                await emit(pending[:-keep])
+                pending = pending[-keep:]
+    except asyncio.CancelledError:
+        # Timed out: keep what was held back, for the summary and the log
+        output.append(pending)
+        log.add(pending)
+        raise
+
+
+class ShellSession:
+    """
+    A long-lived shell rooted in a session's workspace. Each command is sent as an `eval` of
+    the quoted command text (so a syntax error cannot derail the shell), with stdin from
+    /dev/null, followed by an end marker carrying the exit code on stdout and another on
+    stderr. Output is read up to the markers, so command boundaries are exact.
+    """
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.cwd = os.path.join(SESSIONS_DIR, session_id, 'workspace')
+        self.process = None
+        self.lock = asyncio.Lock() # one command at a time
+        self.last_used = time.monotonic()
+        self.commands = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            SHELL_PROGRAM, "--noprofile", "--norc",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            start_new_session=True, # its own process group, so background jobs die with it
+        )
+        logger.info(f"[{self.session_id}] Started shell (pid {self.process.pid}).")
+
+    async def run(self, command: str, stdout: BoundedOutput, stderr: BoundedOutput, log: CommandLog, on_output, timeout: int):
+        """Runs a command and returns its exit code, or the shell's if the command made it exit."""
+        end = f"__AGENT_COMMAND_END_{uuid.uuid4().hex}__"
+        quoted = command.replace("'", "'\\''")
+        script = (
+            f"eval '{quoted}' < /dev/null\n"
+            f"__agent_status=$?\n"
+            f"printf '\\n%s %d\\n' '{end}' \"$__agent_status\"\n"
+            f"printf '\\n%s\\n' '{end}' >&2\n"
+        )
+        self.commands += 1
+        self.last_used = time.monotonic()
+        try:
+            self.process.stdin.write(script.encode('utf-8'))
+            await self.process.stdin.drain()
+            status, _ = await asyncio.wait_for(asyncio.gather(
+                _read_framed(self.process.stdout, "stdout", end.encode(), stdout, log, on_output),
+                _read_framed(self.process.stderr, "stderr", end.encode(), stderr, log, on_output),
+            ), timeout=timeout)
+        finally:
+            self.last_used = time.monotonic()
+        if status is None:
+            # The command ended the shell itself (e.g. `exit`)
+            return await self.process.wait()
+        return int(status)
+
+    def close(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        logger.info(f"[{self.session_id}] Closed shell (pid {self.process.pid}) after {self.commands} command(s).")
+
+
+class ShellPool:
+    """
+    One persistent shell per session, at most `max_shells` in total. When the cap is reached
+    the least recently used idle shell is closed to make room; if every shell is busy, the
+    caller falls back to a one-off shell. Shells idle for `idle_timeout` seconds are reaped.
+    """
+    def __init__(self, max_shells: int = MAX_SHELLS, idle_timeout: float = SHELL_IDLE_TIMEOUT):
+        self.max_shells = max_shells
+        self.idle_timeout = idle_timeout
+        self._shells = OrderedDict() # session id -> ShellSession, least recently used first
+        self._lock = None
+        self._reaper = None
+        self.started = 0
+        self.reaped = 0
+
+    async def acquire(self, session_id: str):
+        """Returns the session's shell, starting one if needed, or None if no shell can be had."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+        async with self._lock:
+            shell = self._shells.get(session_id)
+            if shell is not None and shell.alive:
+                self._shells.move_to_end(session_id)
+                return shell
+            self._shells.pop(session_id, None)
+
+            if len(self._shells) >= self.max_shells:
+                idle = next((other for other in self._shells.values() if not other.lock.locked()), None)
+                if idle is None:
+                    return None
+                self.discard(idle)
+
+            shell = ShellSession(session_id)
+            await shell.start()
+            self._shells[session_id] = shell
+            self.started += 1
+            return shell
+
+    def discard(self, shell: ShellSession):
+        """Closes a shell and forgets it (after a timeout, or to make room)."""
+        if self._shells.get(shell.session_id) is shell:
+            del self._shells[shell.session_id]
+        shell.close()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(max(1.0, min(60.0, self.idle_timeout / 2)))
+            now = time.monotonic()
+            for shell in list(self._shells.values()):
+                if not shell.lock.locked() and (now - shell.last_used > self.idle_timeout or not shell.alive):
+                    self.discard(shell)
+                    self.reaped += 1
+
+    async def close_all(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for shell in list(self._shells.values()):
+            self.discard(shell)
+
+    def stats(self) -> dict:
+        return {
+            "live": len(self._shells),
+            "busy": sum(1 for shell in self._shells.values() if shell.lock.locked()),
+            "max_shells": self.max_shells,
+            "started": self.started,
+            "reaped": self.reaped,
+        }
+
+
+shell_pool = ShellPool()
+
+async def _execute_in_shell(shell: ShellSession, command: str, timeout: int, on_output) -> str:
+    log = CommandLog(shell.session_id, command)
+    stdout, stderr = BoundedOutput(), BoundedOutput()
+    try:
+        async with shell.lock:
+            returncode = await shell.run(command, stdout, stderr, log, on_output, timeout)
+        logger.info(f"Command executed successfully. Return code: {returncode}")
+        summary = _summarize(stdout, stderr, returncode, log)
+        if not shell.alive:
+            summary += "The shell exited; the next command starts in a new shell.\n"
+        return summary
+    except asyncio.TimeoutError:
+        # The command cannot be interrupted on its own, so the whole shell goes
+        shell_pool.discard(shell)
+        logger.error(f"Command timed out after {timeout} seconds: {command}")
+        return (f"Error: Command timed out after {timeout} seconds. The shell was restarted, "
+                f"so its working directory and environment were reset.\n") + _summarize(stdout, stderr, None, log)
+    except Exception as e:
+        shell_pool.discard(shell)
+        logger.error(f"Error executing command \'{command}\': {e}")
+        return f"Error executing command \'{command}\': {e}"
+    finally:
+        await log.flush()
+
+
+async def execute_command(command: str, session_id: str = None, timeout: int = COMMAND_TIMEOUT, on_output=None) -> str:
+    """
+    Executes a shell command and returns a summary of its stdout and stderr. Commands of a
+    session run in its persistent shell, in the session's workspace. Output is read as it is
+    produced: `on_output(stream, text)` is awaited for every chunk, only the head and tail of
+    each stream are kept in memory, and the full output is written to a log file in the
+    workspace's LOG_DIR folder.
+    """
+    logger.info(f"Executing command: {command}")
+    if session_id and SHELL_POOL_ENABLED:
+        try:
+            shell = await shell_pool.acquire(session_id)
+        except OSError as e:
             return f"Error executing command \'{command}\': {e}"
+        if shell is not None:
+            return await _execute_in_shell(shell, command, timeout, on_output)
+    return await _execute_oneshot(command, session_id, timeout, on_output)
+
+
+class TerminalTools:
+    def __init__(self):
+        pass
+
+    async def execute_command(self, command: str, timeout: int = 300) -> str:
+        """Executes a shell command and returns its stdout and stderr."""
+        return await execute_command(command, timeout=timeout)
 
 # Example usage (for testing purposes)
 async def main():
@@ -48,4 +414,3 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-
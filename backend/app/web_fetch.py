@@ -0,0 +1,319 @@
+import os
+import time
+import re
+import httpx
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+from app.html_markdown import html_to_markdown, html_to_text
+
+
+def _domains(value: str) -> set:
+    return {domain.strip().lower().lstrip(".") for domain in value.split(",") if domain.strip()}
+
+# Total size of the page extractions kept in memory; the least recently used go first
+EXTRACT_CACHE_MAX_BYTES = int(os.getenv("EXTRACT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# How long an extraction is served without asking the server, unless its Cache-Control says otherwise
+EXTRACT_CACHE_FRESH_SECONDS = float(os.getenv("EXTRACT_CACHE_FRESH_SECONDS", "60"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "15"))
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "32"))
+# Serve static pages over plain HTTP, falling back to the browser only when JavaScript seems needed
+FETCH_FAST_PATH = os.getenv("FETCH_FAST_PATH", "true").lower() == "true"
+# Largest page body read over HTTP
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(5 * 1024 * 1024)))
+# A page with less main text than this is assumed to be rendered by JavaScript
+FETCH_MIN_TEXT_CHARS = int(os.getenv("FETCH_MIN_TEXT_CHARS", "200"))
+# Comma-separated domains (subdomains included) always rendered in the browser, or never
+FETCH_BROWSER_DOMAINS = _domains(os.getenv("FETCH_BROWSER_DOMAINS", ""))
+FETCH_HTTP_DOMAINS = _domains(os.getenv("FETCH_HTTP_DOMAINS", ""))
+# How long a domain whose page needed JavaScript goes straight to the browser
+FETCH_DOMAIN_MEMORY = float(os.getenv("FETCH_DOMAIN_MEMORY", "3600"))
+USER_AGENT = os.getenv("FETCH_USER_AGENT", "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+
+_client = None
+
+def _get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared, connection-pooled HTTP client, creating it on first use. It keeps no
+    cookies, so what it fetches is the same for every session and can be cached for all.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers={'User-Agent': USER_AGENT},
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+            follow_redirects=True,
+            timeout=httpx.Timeout(FETCH_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=FETCH_MAX_CONNECTIONS,
+                max_keepalive_connections=FETCH_MAX_CONNECTIONS // 2,
+                keepalive_expiry=60,
+            ),
+        )
+    return _client
+
+async def close_client():
+    """Closes the shared HTTP client and its pooled connections (called on shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# --- EXTRACTION CACHE ---
+
+class CachedExtraction:
+    """The content extracted from a URL in one format, with the validators of the response it came from."""
+    def __init__(self, url: str, format: str, content: str, etag: str, last_modified: str, fresh_for: float, session_id: str = None):
+        self.url = url
+        self.format = format
+        self.session_id = session_id # the session whose browser rendered it, None if fetched without cookies
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh_until = time.monotonic() + fresh_for
+        self.size = len(content)
+
+    @property
+    def revalidatable(self) -> bool:
+        # A conditional GET carries no cookies, so it cannot vouch for a page rendered with a session's
+        return self.session_id is None and bool(self.etag or self.last_modified)
+
+
+def _freshness(headers) -> float:
+    """Seconds a response may be reused without revalidation, or None if it must not be stored."""
+    cache_control = (headers.get("cache-control") or "").lower()
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0
+    max_age = re.search(r"max-age=(\d+)", cache_control)
+    if max_age:
+        return min(float(max_age.group(1)), EXTRACT_CACHE_FRESH_SECONDS * 60)
+    return EXTRACT_CACHE_FRESH_SECONDS
+
+
+class ExtractionCache:
+    """
+    Page extractions keyed by URL, format and session, bounded by total size with LRU eviction.
+
+    What the cookie-less HTTP client fetched is shared by all sessions. What a session's
+    browser rendered (with that context's cookies and logins) is only served back to the same
+    session, and is dropped with discard_session() when its context goes away.
+
+    A fresh entry is served as is. A stale shared one is revalidated with a conditional GET
+    (If-None-Match / If-Modified-Since) and reused on 304 Not Modified; otherwise it is
+    dropped and the page extracted again.
+    """
+    def __init__(self, max_bytes: int = EXTRACT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # (url, format, session id or None) -> CachedExtraction, least recently used first
+        self._bytes = 0
+        self._stats = {"hits": 0, "revalidated": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def put(self, url: str, format: str, content: str, headers, session_id: str = None):
+        """
+        Stores an extraction, unless the response forbids it or it does not fit. Pass the
+        `session_id` of a page rendered in that session's browser context.
+        """
+        fresh_for = _freshness(headers)
+        if fresh_for is None or len(content) > self.max_bytes:
+            return
+        self._remove((url, format, session_id))
+        entry = CachedExtraction(url, format, content, headers.get("etag"), headers.get("last-modified"), fresh_for, session_id)
+        self._entries[(url, format, session_id)] = entry
+        self._bytes += entry.size
+        self._stats["stores"] += 1
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def discard(self, url: str, format: str = None):
+        """Forgets the extractions of a URL (in one format, or all of them), for every session."""
+        for key in [key for key in self._entries if key[0] == url and (format is None or key[1] == format)]:
+            self._remove(key)
+
+    def discard_session(self, session_id: str):
+        """Forgets the pages rendered in a session's browser context."""
+        for key in [key for key in self._entries if key[2] == session_id]:
+            self._remove(key)
+
+    async def get(self, url: str, format: str, session_id: str = None, shared: bool = True):
+        """
+        Returns the cached content of a URL, revalidating it first if it is stale, or None.
+        The session's own rendering is preferred; `shared=False` skips the cookie-less copy.
+        """
+        keys = ([(url, format, session_id)] if session_id is not None else []) + ([(url, format, None)] if shared else [])
+        key = next((key for key in keys if key in self._entries), None)
+        if key is None:
+            self._stats["misses"] += 1
+            return None
+        entry = self._entries[key]
+        self._entries.move_to_end(key)
+        if time.monotonic() < entry.fresh_until:
+            self._stats["hits"] += 1
+            return entry.content
+        headers = await revalidate(entry) if entry.revalidatable else None
+        if headers is None:
+            self._remove(key)
+            self._stats["misses"] += 1
+            return None
+        entry.fresh_until = time.monotonic() + (_freshness(headers) or 0)
+        self._stats["revalidated"] += 1
+        return entry.content
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "session_entries": sum(1 for key in self._entries if key[2] is not None),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+async def revalidate(entry: CachedExtraction):
+    """Asks the server whether a cached page changed. Returns the 304 response headers if it did not, else None."""
+    headers = {}
+    if entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+    try:
+        # Streamed, so that the body of a changed page is not downloaded just to be discarded
+        async with _get_client().stream("GET", entry.url, headers=headers) as response:
+            return response.headers if response.status_code == 304 else None
+    except httpx.HTTPError as e:
+        print(f"Revalidation of {entry.url} failed: {e}")
+        return None
+
+
+extraction_cache = ExtractionCache()
+
+
+# --- HTTP FAST PATH ---
+
+FORMATS = ("text", "markdown", "html")
+# Responses served as they are, whatever format was asked for
+TEXT_CONTENT_TYPES = ("text/plain", "text/markdown", "text/csv", "text/xml", "application/json", "application/xml")
+NOSCRIPT_HINT = re.compile(r"<noscript[^>]*>(?:(?!</noscript>).){0,1000}?\b(?:enable|requires?|needs?|turn on|activate|support)\b(?:(?!</noscript>).){0,100}?javascript", re.IGNORECASE | re.DOTALL)
+
+_js_domains = {} # domain -> when its page last needed JavaScript
+_path_counts = {"cache": 0, "http": 0, "browser": 0}
+_fallback_reasons = {}
+_recent = deque(maxlen=100)
+
+
+def _host(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+def _matches(host: str, domains) -> bool:
+    return any(host == domain or host.endswith("." + domain) for domain in domains)
+
+def browser_reason(url: str):
+    """Why `url` must be rendered in the browser without trying HTTP first, or None."""
+    if not FETCH_FAST_PATH:
+        return "fast path disabled"
+    if not url.startswith(("http://", "https://")):
+        return "not an http(s) URL"
+    host = _host(url)
+    if _matches(host, FETCH_BROWSER_DOMAINS):
+        return "domain setting"
+    if _matches(host, FETCH_HTTP_DOMAINS):
+        return None
+    needed_js = _js_domains.get(host)
+    if needed_js is not None and time.monotonic() - needed_js < FETCH_DOMAIN_MEMORY:
+        return "domain needed JavaScript recently"
+    return None
+
+
+def _needs_javascript(content_type: str, body: str, markdown: str):
+    """Why a page fetched over HTTP may not show what the browser would, or None."""
+    if "html" not in content_type:
+        return f"content type {content_type or 'unknown'}"
+    if NOSCRIPT_HINT.search(body):
+        return "noscript hint"
+    if len(markdown) < FETCH_MIN_TEXT_CHARS:
+        return "empty body"
+    return None
+
+
+async def _read_body(response: httpx.Response) -> str:
+    chunks = []
+    size = 0
+    async for chunk in response.aiter_text():
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= FETCH_MAX_BYTES:
+            break
+    return "".join(chunks)[:FETCH_MAX_BYTES]
+
+
+async def fetch_extractions(url: str, formats=FORMATS):
+    """
+    Fetches a page over HTTP and extracts it in each of `formats`, caching the results.
+    Returns ({format: content}, None), or (None, reason) if the page needs the browser.
+    Error responses (4xx/5xx, bot walls and rate limiters included) are neither returned nor
+    cached: the browser renders them, as a visit would, and does not cache them either.
+    """
+    try:
+        async with _get_client().stream("GET", url) as response:
+            if not response.is_success:
+                return None, f"status {response.status_code}"
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type.startswith(TEXT_CONTENT_TYPES):
+                body = await _read_body(response)
+                contents = {format: body for format in formats}
+            else:
+                if "html" not in content_type:
+                    return None, _needs_javascript(content_type, "", "")
+                body = await _read_body(response)
+                markdown = html_to_markdown(body, base_url=str(response.url))
+                reason = _needs_javascript(content_type, body, markdown)
+                if reason is not None:
+                    return None, reason
+                renderers = {"markdown": lambda: markdown, "html": lambda: body, "text": lambda: html_to_text(body)}
+                contents = {format: renderers[format]() for format in formats}
+            headers = response.headers
+    except httpx.HTTPError as e:
+        return None, f"HTTP error: {e.__class__.__name__}"
+    for format, content in contents.items():
+        extraction_cache.put(url, format, content, headers)
+    return contents, None
+
+
+def confirm_javascript(url: str, reason: str, rendered: str):
+    """
+    Called with what the browser rendered after the HTTP fetch said `reason`: if JavaScript
+    did bring the text, the domain goes straight to the browser for a while.
+    """
+    if reason in ("noscript hint", "empty body") and len(rendered) >= FETCH_MIN_TEXT_CHARS:
+        _js_domains[_host(url)] = time.monotonic()
+
+
+def record(operation: str, url: str, path: str, reason: str = None, started: float = None):
+    """Records which path (cache, http or browser) served a request, and why the browser was needed."""
+    _path_counts[path] += 1
+    if reason is not None:
+        _fallback_reasons[reason] = _fallback_reasons.get(reason, 0) + 1
+    _recent.append({
+        "operation": operation, "url": url, "path": path, "reason": reason,
+        "ms": round((time.monotonic() - started) * 1000, 1) if started is not None else None,
+    })
+
+
+def fetch_stats() -> dict:
+    """Returns how many requests each path served, the reasons for browser fallbacks, and the latest requests."""
+    return {
+        "paths": dict(_path_counts),
+        "fallback_reasons": dict(_fallback_reasons),
+        "js_domains": len(_js_domains),
+        "recent": list(_recent),
+    }
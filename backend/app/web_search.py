@@ -0,0 +1,156 @@
+import os
+import re
+import hashlib
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qs, parse_qsl, urlencode, quote_plus
+
+# Results page of the search engine; "{query}" is replaced by the URL-encoded query
+WEB_SEARCH_URL = os.getenv("WEB_SEARCH_URL", "https://html.duckduckgo.com/html/?q={query}")
+# Results fetched and summarized in the digest
+WEB_SEARCH_RESULTS = int(os.getenv("WEB_SEARCH_RESULTS", "5"))
+# Seconds allowed to fetch each result page
+WEB_SEARCH_PAGE_TIMEOUT = float(os.getenv("WEB_SEARCH_PAGE_TIMEOUT", "10"))
+# Largest digest returned, in characters
+WEB_SEARCH_DIGEST_CHARS = int(os.getenv("WEB_SEARCH_DIGEST_CHARS", "12000"))
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|msclkid|ref|ref_src)$", re.IGNORECASE)
+
+
+def search_url(query: str) -> str:
+    return WEB_SEARCH_URL.replace("{query}", quote_plus(query))
+
+
+def normalize_url(url: str) -> str:
+    """A key under which the same page reached through different URLs is deduplicated."""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(key)])
+    return urlunsplit(("", host, parts.path.rstrip("/"), query, ""))
+
+
+def _unwrap(href: str) -> str:
+    """Returns the target of a search engine's redirect link (DuckDuckGo's uddg=, Google's /url?q=)."""
+    parts = urlsplit(href)
+    params = parse_qs(parts.query)
+    for key in ("uddg", "q", "url", "u"):
+        if key in params and params[key][0].startswith(("http://", "https://")) and parts.path.rstrip("/").endswith(("/l", "/url", "/link")):
+            return params[key][0]
+    return href
+
+
+class ResultLinkParser(HTMLParser):
+    """Collects the links of a results page, with their text and whether they are marked as results."""
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = [] # [url, title, marked as a result]
+        self._open = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        attrs = dict(attrs)
+        href = attrs.get("href")
+        if href:
+            marked = "result" in (attrs.get("class") or "")
+            self._open = [_unwrap(urljoin(self.base_url, href)), [], marked]
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._open is not None:
+            url, title, marked = self._open
+            self.links.append([url, " ".join("".join(title).split()), marked])
+            self._open = None
+
+    def handle_data(self, data):
+        if self._open is not None:
+            self._open[1].append(data)
+
+
+def parse_result_links(html: str, base_url: str, limit: int = None) -> list:
+    """
+    Returns the results of a search results page as [{"url", "title"}], in rank order and
+    deduplicated. Links to the engine itself are skipped; if some links are marked as results
+    (by their class), only those are kept.
+    """
+    parser = ResultLinkParser(base_url)
+    parser.feed(html)
+    parser.close()
+    engine = (urlsplit(base_url).hostname or "").lower()
+    engine_domain = ".".join(engine.split(".")[-2:])
+    links = [
+        link for link in parser.links
+        if link[0].startswith(("http://", "https://")) and link[1]
+        and not (urlsplit(link[0]).hostname or "").lower().endswith(engine_domain)
+    ]
+    if any(marked for _, _, marked in links):
+        links = [link for link in links if link[2]]
+    results = []
+    seen = set()
+    for url, title, _ in links:
+        key = normalize_url(url)
+        if key in seen:
+            continue
+        seen.add(key)
+        results.append({"url": url, "title": title})
+        if limit is not None and len(results) >= limit:
+            break
+    return results
+
+
+def _fingerprint(content: str) -> str:
+    return hashlib.sha1(" ".join(content.split())[:2000].lower().encode('utf-8')).hexdigest()
+
+
+def _excerpt(content: str, budget: int) -> str:
+    """The start of `content`, cut at a paragraph (or else line, or word) boundary to fit `budget`."""
+    if len(content) <= budget:
+        return content
+    cut = content.rfind("\n\n", 0, budget)
+    if cut < budget // 2:
+        cut = content.rfind("\n", 0, budget)
+    if cut < budget // 2:
+        cut = content.rfind(" ", 0, budget)
+    if cut < budget // 2:
+        cut = budget
+    return content[:cut].rstrip() + "\n[...]"
+
+
+def build_digest(query: str, results: list, max_chars: int = WEB_SEARCH_DIGEST_CHARS) -> str:
+    """
+    Merges fetched results [{"url", "title", "content" or None, "error"}] into one digest:
+    the ranked list of results, then an excerpt of each page, mirrors of an earlier page
+    skipped, the pages sharing the size budget equally.
+    """
+    fetched = []
+    seen = set()
+    for rank, result in enumerate(results, 1):
+        content = (result.get("content") or "").strip()
+        if not content:
+            continue
+        fingerprint = _fingerprint(content)
+        if fingerprint in seen:
+            result["error"] = "duplicate of an earlier result"
+            continue
+        seen.add(fingerprint)
+        fetched.append((rank, result, content))
+    lines = [f"Search results for '{query}':", ""]
+    for rank, result in enumerate(results, 1):
+        note = f" (not read: {result['error']})" if result.get("error") else ""
+        lines.append(f"{rank}. [{result['title']}]({result['url']}){note}")
+    header = "\n".join(lines)
+    if not fetched:
+        return header[:max_chars]
+    sections = []
+    remaining = max_chars - len(header)
+    for index, (rank, result, content) in enumerate(fetched):
+        section_header = f"\n\n## {rank}. {result['title']}\nSource: {result['url']}\n\n"
+        budget = remaining // (len(fetched) - index) - len(section_header)
+        if budget < 200:
+            break
+        section = section_header + _excerpt(content, budget)
+        sections.append(section)
+        remaining -= len(section)
+    return header + "".join(sections)
@@ -1,28 +1,231 @@
 from fastapi import WebSocket
+import os
 import json
+import time
+import asyncio
+from collections import deque
+from app.event_bus import EventBus
+from app import ws_protocol
+
+# Largest number of messages waiting to be sent to one client
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "1000"))
+# Messages that are always delivered, even to a client that has fallen far behind
+ESSENTIAL_TYPES = {"finish", "error", "plan"}
+# Progress messages that may be dropped first when a client's queue is full
+DROPPABLE_TYPES = {"status", "plan_chunk", "task_start", "command_output"}
+# Queued plan chunks and command output are merged into messages of at most this many characters
+COALESCE_MAX_CHARS = 64 * 1024
+
+
+def _percentile(sorted_values: list, fraction: float):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+class ClientChannel:
+    """
+    Outbound queue of one WebSocket client, drained by its own writer task, so that whoever
+    sends a message never waits on the network.
+
+    While messages wait, back-to-back progress updates of a session (consecutive seq numbers)
+    are coalesced: plan_chunk and command_output texts are joined, up to COALESCE_MAX_CHARS,
+    and a newer status replaces an older one. If the queue is
+    still full, the oldest progress message is dropped, then the oldest ordinary one; finish,
+    error and plan messages are never dropped. Messages go out as JSON text, or as MessagePack
+    binary frames if the client negotiated that encoding.
+    """
+    def __init__(self, websocket: WebSocket, client_id: str, max_size: int = WS_SEND_QUEUE_SIZE, window: int = 500, encoding: str = ws_protocol.JSON):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.encoding = encoding
+        self.max_size = max_size
+        self._queue = deque() # [message, enqueued at]
+        self._wakeup = asyncio.Event()
+        self._send_times = deque(maxlen=window)
+        self._queue_times = deque(maxlen=window)
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.closed = False
+        self.on_error = None # called with the client id if the socket fails
+        self._writer = asyncio.create_task(self._run())
+
+    def put(self, message: dict):
+        """Queues a message for the client; never blocks."""
+        if self.closed:
+            return
+        if self._queue:
+            merged = self._coalesce(self._queue[-1][0], message)
+            if merged is not None:
+                self._queue[-1][0] = merged
+                self.coalesced += 1
+                return
+        if len(self._queue) >= self.max_size and not self._make_room(message):
+            self.dropped += 1
+            return
+        self._queue.append([message, time.monotonic()])
+        self._wakeup.set()
+
+    def _coalesce(self, last: dict, message: dict):
+        """Returns a single message replacing the queued `last` and the new `message`, or None."""
+        kind = message.get("type")
+        if kind != last.get("type") or message.get("session_id") != last.get("session_id"):
+            return None
+        # Only back-to-back events of a session: anything in between must still be delivered between them
+        if last.get("seq") is None or message.get("seq") != last["seq"] + 1:
+            return None
+        if kind in ("plan_chunk", "command_output") and message.get("stream") == last.get("stream") and len(last["data"]) + len(message["data"]) <= COALESCE_MAX_CHARS:
+            return {**message, "data": last["data"] + message["data"]}
+        if kind == "status":
+            return message
+        return None
+
+    def _make_room(self, message: dict) -> bool:
+        """Drops a queued message to make room for `message`; returns False if `message` should be dropped instead."""
+        for droppable in (DROPPABLE_TYPES, None):
+            for entry in self._queue:
+                kind = entry[0].get("type")
+                if kind not in ESSENTIAL_TYPES and (droppable is None or kind in droppable):
+                    self._queue.remove(entry)
+                    self.dropped += 1
+                    return True
+        # Only essential messages are queued: those may exceed the limit, anything else is dropped
+        return message.get("type") in ESSENTIAL_TYPES
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._queue:
+                    message, enqueued = self._queue.popleft()
+                    started = time.monotonic()
+                    if self.encoding == ws_protocol.MSGPACK:
+                        for frame in ws_protocol.encode_msgpack(message):
+                            await self.websocket.send_bytes(frame)
+                    else:
+                        await self.websocket.send_json(message)
+                    finished = time.monotonic()
+                    self._queue_times.append(started - enqueued)
+                    self._send_times.append(finished - started)
+                    self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Send to {self.client_id} failed, dropping {len(self._queue)} queued message(s): {e}")
+            self.closed = True
+            self._queue.clear()
+            if self.on_error is not None:
+                self.on_error(self.client_id)
+
+    def close(self):
+        """Stops the writer; messages not yet sent are discarded."""
+        self.closed = True
+        self._queue.clear()
+        self._writer.cancel()
+
+    def stats(self) -> dict:
+        sends = sorted(self._send_times)
+        waits = sorted(self._queue_times)
+        as_ms = lambda value: value * 1000 if value is not None else None
+        return {
+            "encoding": self.encoding,
+            "queued": len(self._queue),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "send_p50_ms": as_ms(_percentile(sends, 0.5)),
+            "send_p95_ms": as_ms(_percentile(sends, 0.95)),
+            "queue_p50_ms": as_ms(_percentile(waits, 0.5)),
+            "queue_p95_ms": as_ms(_percentile(waits, 0.95)),
+        }
+
 
 class ConnectionManager:
     """
-    Manages active WebSocket connections.
+    Manages active WebSocket connections, and which sessions each of them is watching.
     """
     def __init__(self):
         # A dictionary to store active connections, mapping a client_id to a WebSocket object.
         self.active_connections: dict[str, WebSocket] = {}
+        # Outbound queue and writer task of each connection
+        self.channels: dict[str, ClientChannel] = {}
+        # Session events, with replay for reconnecting clients, and each client's subscriptions
+        self.bus = EventBus()
+        self.subscriptions: dict[str, set] = {}
 
     async def connect(self, websocket: WebSocket, client_id: str):
-        """Accepts and stores a new WebSocket connection."""
-        await websocket.accept()
+        """Accepts and stores a new WebSocket connection, in the encoding the client asked for."""
+        encoding, subprotocol = ws_protocol.negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        if client_id in self.channels:
+            self.channels.pop(client_id).close()
         self.active_connections[client_id] = websocket
-        print(f"New connection: {client_id} connected.")
+        channel = self.channels[client_id] = ClientChannel(websocket, client_id, encoding=encoding)
+        channel.on_error = self._on_send_error
+        print(f"New connection: {client_id} connected ({encoding}).")
 
-    def disconnect(self, client_id: str):
-        """Removes a WebSocket connection."""
+    def disconnect(self, client_id: str, websocket: WebSocket = None):
+        """Removes a WebSocket connection (only if it is still `websocket`, when one is given)."""
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return # The client has reconnected since
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+            self.channels.pop(client_id).close()
+            for session_id in self.subscriptions.pop(client_id, ()):
+                self.bus.unsubscribe(session_id, client_id)
             print(f"Connection closed: {client_id} disconnected.")
 
+    def _on_send_error(self, client_id: str):
+        # Only forget the socket that failed, not a newer connection of the same client
+        channel = self.channels.get(client_id)
+        if channel is not None and channel.closed:
+            self.disconnect(client_id)
+
     async def send_personal_message(self, message: dict, client_id: str):
-        """Sends a JSON message to a specific client."""
-        if client_id in self.active_connections:
-            websocket = self.active_connections[client_id]
-            await websocket.send_json(message)
+        """Queues a JSON message for a specific client. Returns without waiting for the network."""
+        if client_id in self.channels:
+            self.channels[client_id].put(message)
+
+    def subscribe(self, client_id: str, session_id: str, last_seq: int = None, epoch: str = None):
+        """
+        Subscribes a connected client to a session's events. A client resuming after a
+        reconnect passes the last `seq` and `epoch` it saw and is sent the events it missed.
+        """
+        if client_id not in self.channels:
+            return
+        replay, resync = self.bus.subscribe(session_id, client_id, last_seq, epoch)
+        self.subscriptions.setdefault(client_id, set()).add(session_id)
+        channel = self.channels[client_id]
+        channel.put({
+            "type": "subscribed", "session_id": session_id, "epoch": self.bus.epoch,
+            "seq": self.bus.last_seq(session_id), "replayed": len(replay), "resync": resync,
+        })
+        for event in replay:
+            channel.put(event)
+
+    def unsubscribe(self, client_id: str, session_id: str):
+        self.bus.unsubscribe(session_id, client_id)
+        self.subscriptions.get(client_id, set()).discard(session_id)
+
+    async def send_session_message(self, message: dict, session_id: str, client_id: str = None):
+        """
+        Publishes an event of a session to every client subscribed to it, and to `client_id`
+        (the client that started the task) even if it has not subscribed.
+        Returns without waiting for the network.
+        """
+        event = self.bus.publish(session_id, message)
+        subscribers = self.bus.subscribers(session_id)
+        for subscriber in subscribers:
+            if subscriber in self.channels:
+                self.channels[subscriber].put(event)
+        if client_id is not None and client_id not in subscribers and client_id in self.channels:
+            self.channels[client_id].put(event)
+
+    def stats(self) -> dict:
+        """Returns queue depth, drop counts and send latencies per client, and event bus totals."""
+        return {
+            "clients": {client_id: channel.stats() for client_id, channel in self.channels.items()},
+            "bus": self.bus.stats(),
+        }
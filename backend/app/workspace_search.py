@@ -0,0 +1,253 @@
+import os
+import re
+import time
+import fnmatch
+import threading
+from re import _parser, _constants # the stdlib regex parser, to find literals a pattern requires
+from array import array
+from collections import OrderedDict, defaultdict
+from app.io_pool import workspace_pool
+from app import workspace_tree
+
+SESSIONS_DIR = workspace_tree.SESSIONS_DIR
+
+# Number of session indexes kept in memory
+SEARCH_INDEX_SESSIONS = int(os.getenv("SEARCH_INDEX_SESSIONS", "8"))
+# Files larger than this are not indexed
+SEARCH_MAX_FILE_BYTES = int(os.getenv("SEARCH_MAX_FILE_BYTES", str(1024 * 1024)))
+SEARCH_MAX_RESULTS = 100
+# Matched lines are cut to this many characters in results
+SEARCH_LINE_PREVIEW = 300
+# Directories that are never indexed (".logs" holds the command logs of terminal_tools)
+SKIPPED_DIRS = {".git", "node_modules", "__pycache__", ".venv", "venv", ".mypy_cache", ".pytest_cache", ".logs"}
+
+
+def _trigrams(text: str) -> set:
+    return set(map("".join, zip(text, text[1:], text[2:])))
+
+
+def _required_runs(items, runs: list):
+    current = []
+    for op, value in items:
+        if op == _constants.LITERAL:
+            current.append(chr(value))
+            continue
+        runs.append("".join(current))
+        current = []
+        if op == _constants.SUBPATTERN:
+            _required_runs(value[-1], runs)
+        elif op in (_constants.MAX_REPEAT, _constants.MIN_REPEAT) and value[0] >= 1:
+            _required_runs(value[2], runs)
+        # Anything else (alternation, classes, lookarounds, optional parts) requires nothing
+    runs.append("".join(current))
+
+def _literal_runs(pattern: str) -> list:
+    """Returns literal strings that every match of the regex `pattern` must contain."""
+    runs = []
+    _required_runs(_parser.parse(pattern), runs)
+    return [run for run in runs if len(run) >= 3]
+
+
+class SearchIndex:
+    """
+    Trigram index over the text files of one session workspace.
+
+    Each indexed file gets a document id, and each lowercased trigram maps to the ids of the
+    files containing it. A query intersects the posting lists of the trigrams it requires, and
+    only the remaining candidates are read and matched. Posting lists are append-only arrays:
+    when a file changes it is indexed again under a new id and the old id is left dead until
+    too many dead ids pile up and the index is rebuilt.
+
+    The index is kept up to date by rescans: whenever the workspace is reported as changed, the
+    next query walks it, comparing mtimes and sizes, and re-indexes only what differs.
+    """
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.root = os.path.join(SESSIONS_DIR, session_id, 'workspace')
+        self._lock = threading.Lock()
+        self._stale = True
+        self._reset()
+
+    def _reset(self):
+        self._files = {} # relative path -> (doc id, mtime_ns, size)
+        self._paths = [] # doc id -> relative path, or None once superseded
+        self._postings = defaultdict(lambda: array('I'))
+        self._dead = 0
+
+    def mark_stale(self):
+        self._stale = True
+
+    # --- INDEXING ---
+
+    def _index_file(self, relative: str, full_path: str, mtime_ns: int, size: int):
+        self._remove(relative)
+        if size > SEARCH_MAX_FILE_BYTES:
+            return
+        try:
+            with open(full_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return
+        if b"\0" in data[:8192]:
+            return # Binary
+        doc = len(self._paths)
+        self._paths.append(relative)
+        self._files[relative] = (doc, mtime_ns, size)
+        for trigram in _trigrams(data.decode('utf-8', errors='replace').lower()):
+            self._postings[trigram].append(doc)
+
+    def _remove(self, relative: str):
+        entry = self._files.pop(relative, None)
+        if entry is not None:
+            self._paths[entry[0]] = None
+            self._dead += 1
+
+    def _walk(self):
+        stack = [(self.root, "")]
+        while stack:
+            directory, relative = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        path = os.path.join(relative, entry.name) if relative else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in SKIPPED_DIRS:
+                                    stack.append((entry.path, path))
+                            elif entry.is_file(follow_symlinks=False):
+                                stat = entry.stat(follow_symlinks=False)
+                                yield path, entry.path, stat.st_mtime_ns, stat.st_size
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def refresh(self) -> int:
+        """Re-indexes files that changed since the last refresh. Returns the number re-indexed."""
+        self._stale = False
+        if self._dead > max(1000, len(self._files)):
+            self._reset()
+        changed = 0
+        seen = set()
+        for relative, full_path, mtime_ns, size in self._walk():
+            seen.add(relative)
+            entry = self._files.get(relative)
+            if entry is None or entry[1] != mtime_ns or entry[2] != size:
+                self._index_file(relative, full_path, mtime_ns, size)
+                changed += 1
+        for relative in [relative for relative in self._files if relative not in seen]:
+            self._remove(relative)
+            changed += 1
+        return changed
+
+    # --- QUERIES ---
+
+    def _candidates(self, required: set) -> list:
+        if not required:
+            return [doc for doc, path in enumerate(self._paths) if path is not None]
+        postings = []
+        for trigram in required:
+            docs = self._postings.get(trigram)
+            if not docs:
+                return []
+            postings.append(docs)
+        postings.sort(key=len)
+        docs = set(postings[0])
+        for other in postings[1:]:
+            docs.intersection_update(other)
+            if not docs:
+                return []
+        return sorted(doc for doc in docs if self._paths[doc] is not None)
+
+    def search(self, query: str, regex: bool = False, case_sensitive: bool = False, glob: str = None, max_results: int = SEARCH_MAX_RESULTS) -> dict:
+        started = time.perf_counter()
+        pattern = re.compile(query if regex else re.escape(query), 0 if case_sensitive else re.IGNORECASE)
+        literals = _literal_runs(query) if regex else [query]
+        required = set()
+        for literal in literals:
+            required |= _trigrams(literal.lower())
+
+        with self._lock:
+            if self._stale:
+                self.refresh()
+            candidates = [self._paths[doc] for doc in self._candidates(required)]
+            indexed = len(self._files)
+
+        if glob:
+            candidates = [path for path in candidates if fnmatch.fnmatch(path, glob) or fnmatch.fnmatch(os.path.basename(path), glob)]
+
+        results = []
+        truncated = False
+        for relative in candidates:
+            try:
+                with open(os.path.join(self.root, relative), 'r', encoding='utf-8', errors='replace') as f:
+                    text = f.read()
+            except OSError:
+                continue
+            for number, line in enumerate(text.splitlines(), start=1):
+                match = pattern.search(line)
+                if match:
+                    if len(results) >= max_results:
+                        truncated = True
+                        break
+                    results.append({"path": relative, "line": number, "column": match.start() + 1, "text": line[:SEARCH_LINE_PREVIEW]})
+            if truncated:
+                break
+
+        return {
+            "status": "success",
+            "results": results,
+            "truncated": truncated,
+            "files_indexed": indexed,
+            "candidates": len(candidates),
+            "elapsed_ms": (time.perf_counter() - started) * 1000,
+        }
+
+
+_indexes = OrderedDict() # session id -> SearchIndex, least recently used first
+_indexes_lock = threading.Lock()
+
+def _get_index(session_id: str) -> SearchIndex:
+    with _indexes_lock:
+        index = _indexes.get(session_id)
+        if index is None:
+            index = _indexes[session_id] = SearchIndex(session_id)
+            while len(_indexes) > SEARCH_INDEX_SESSIONS:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(session_id)
+        return index
+
+def _mark_stale(session_id: str):
+    index = _indexes.get(session_id)
+    if index is not None:
+        index.mark_stale()
+
+# Writes by the filesystem tools, commands and the workspace watcher all mark the index stale
+workspace_tree.tree_cache.add_listener(_mark_stale)
+
+
+def _search(session_id: str, query: str, regex: bool, case_sensitive: bool, glob: str, max_results: int) -> dict:
+    if not os.path.isdir(os.path.join(SESSIONS_DIR, session_id, 'workspace')):
+        return {"status": "error", "message": f"Workspace for session '{session_id}' not found."}
+    try:
+        return _get_index(session_id).search(query, regex=regex, case_sensitive=case_sensitive, glob=glob, max_results=max_results)
+    except re.error as e:
+        return {"status": "error", "message": f"Invalid regular expression: {e}"}
+
+async def search_files(query: str, session_id: str, regex: bool = False, case_sensitive: bool = False, glob: str = None, max_results: int = SEARCH_MAX_RESULTS) -> dict:
+    """
+    Searches the text files of a session's workspace for `query` (a literal string, or a regular
+    expression with `regex`), optionally only in paths matching `glob`. Returns matching lines.
+    """
+    workspace_tree.tree_cache.start_watcher()
+    return await workspace_pool.submit(session_id, _search, session_id, query, regex, case_sensitive, glob, max_results)
+
+def get_search_stats() -> dict:
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    return {
+        "sessions": len(indexes),
+        "files_indexed": sum(len(index._files) for index in indexes),
+        "trigrams": sum(len(index._postings) for index in indexes),
+    }
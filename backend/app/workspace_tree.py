@@ -0,0 +1,191 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from watchfiles import awatch
+from app.io_pool import workspace_pool
+
+SESSIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'sessions'))
+
+# Number of sessions whose trees are kept in memory
+TREE_CACHE_SESSIONS = int(os.getenv("WORKSPACE_TREE_CACHE_SESSIONS", "32"))
+# Largest number of entries returned in one tree; deeper folders are marked as truncated
+TREE_MAX_ENTRIES = int(os.getenv("WORKSPACE_TREE_MAX_ENTRIES", "20000"))
+# How long a cached tree is trusted while the change watcher is not running
+TREE_UNWATCHED_TTL = float(os.getenv("WORKSPACE_TREE_UNWATCHED_TTL", "2"))
+# Time the watcher waits for a burst of changes to settle, in milliseconds
+TREE_WATCH_DEBOUNCE_MS = int(os.getenv("WORKSPACE_TREE_WATCH_DEBOUNCE_MS", "200"))
+
+
+def _scan(directory: str, relative: str, depth, budget: list) -> list:
+    """
+    Lists `directory` with os.scandir, recursing into folders until `depth` levels have been
+    returned (None for no limit). `budget` holds the number of entries still allowed.
+    """
+    nodes = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if budget[0] <= 0:
+                break
+            budget[0] -= 1
+            try:
+                stat = entry.stat(follow_symlinks=False)
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue # Removed while we were scanning
+            path = os.path.join(relative, entry.name) if relative else entry.name
+            node = {
+                "name": entry.name,
+                "type": "folder" if is_dir else "file",
+                "path": path,
+                "size": 0 if is_dir else stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+            if is_dir:
+                if (depth is None or depth > 1) and budget[0] > 0:
+                    try:
+                        node["children"] = _scan(entry.path, path, None if depth is None else depth - 1, budget)
+                    except OSError:
+                        node["children"] = []
+                else:
+                    node["truncated"] = True
+            nodes.append(node)
+    # Folders first, then files, each alphabetically
+    nodes.sort(key=lambda node: (node["type"] != "folder", node["name"].lower()))
+    return nodes
+
+
+def _build_tree(session_id: str, path: str, depth) -> dict:
+    # Imported here, as filesystem_tools imports this module
+    from app.filesystem_tools import _get_safe_path
+    try:
+        workspace = _get_safe_path(".", session_id)
+        full_path = _get_safe_path(path, session_id)
+    except (FileNotFoundError, PermissionError) as e:
+        return {"status": "error", "message": str(e)}
+    if not os.path.isdir(full_path):
+        return {"status": "error", "message": f"Path is not a directory: {path}"}
+
+    relative = os.path.relpath(full_path, workspace)
+    budget = [TREE_MAX_ENTRIES]
+    tree = _scan(full_path, "" if relative == "." else relative, depth, budget)
+    return {"status": "success", "path": path, "depth": depth, "truncated": budget[0] <= 0, "tree": tree}
+
+
+class TreeCache:
+    """
+    Per-session cache of workspace trees, keyed by (path, depth), with LRU eviction of sessions.
+
+    A session's trees are dropped whenever its workspace changes: the filesystem tools call
+    invalidate() after writing, and a watcher on the sessions directory catches everything else,
+    such as files written by shell commands. Each session carries a generation counter so a scan
+    that raced with a change is not cached. Other workspace caches can subscribe to the same
+    change notifications with add_listener().
+    """
+    def __init__(self, max_sessions: int = 32):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict() # session id -> {"generation": int, "trees": {(path, depth): (tree, built at)}}
+        self._lock = threading.Lock() # invalidate() is called from I/O pool threads
+        self._watcher = None
+        self._stop_watching = None
+        self._listeners = [] # called with the session id whenever a workspace changes
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _entry(self, session_id: str) -> dict:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = {"generation": 0, "trees": {}}
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        return entry
+
+    def _watching(self) -> bool:
+        return self._watcher is not None and not self._watcher.done()
+
+    async def get(self, session_id: str, path: str = ".", depth: int = None) -> dict:
+        """Returns the tree under `path`, from the cache if the workspace has not changed since."""
+        self.start_watcher()
+        key = (os.path.normpath(path), depth)
+        with self._lock:
+            entry = self._entry(session_id)
+            generation = entry["generation"]
+            cached = entry["trees"].get(key)
+        if cached is not None and (self._watching() or time.monotonic() - cached[1] < TREE_UNWATCHED_TTL):
+            self.hits += 1
+            return cached[0]
+
+        self.misses += 1
+        tree = await workspace_pool.submit(session_id, _build_tree, session_id, path, depth)
+        if tree["status"] == "success":
+            with self._lock:
+                entry = self._sessions.get(session_id)
+                if entry is not None and entry["generation"] == generation:
+                    entry["trees"][key] = (tree, time.monotonic())
+        return tree
+
+    def invalidate(self, session_id: str):
+        """Drops the cached trees of a session."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry["generation"] += 1
+                entry["trees"] = {}
+                self.invalidations += 1
+        for listener in self._listeners:
+            listener(session_id)
+
+    def add_listener(self, callback):
+        """Registers `callback(session_id)` to be told about workspace changes (from any thread)."""
+        self._listeners.append(callback)
+
+    # --- CHANGE WATCHER ---
+
+    def start_watcher(self):
+        """Starts the change watcher, if it is not running yet. Must be called on the event loop."""
+        if self._watcher is None:
+            os.makedirs(SESSIONS_DIR, exist_ok=True)
+            self._stop_watching = asyncio.Event()
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        # One recursive watcher for all sessions, rather than a thread per watched workspace
+        only_workspaces = lambda change, path: os.path.relpath(path, SESSIONS_DIR).split(os.sep)[1:2] == ['workspace']
+        try:
+            async for changes in awatch(SESSIONS_DIR, watch_filter=only_workspaces, debounce=TREE_WATCH_DEBOUNCE_MS, stop_event=self._stop_watching):
+                for session_id in {os.path.relpath(path, SESSIONS_DIR).split(os.sep)[0] for _, path in changes}:
+                    self.invalidate(session_id)
+        except Exception as e:
+            # Cached trees now expire after TREE_UNWATCHED_TTL instead
+            print(f"Workspace watcher stopped: {e}")
+
+    async def close(self):
+        """Stops the change watcher."""
+        if self._watcher is not None:
+            self._stop_watching.set()
+            await self._watcher
+
+    def stats(self) -> dict:
+        with self._lock:
+            cached = sum(len(entry["trees"]) for entry in self._sessions.values())
+        return {
+            "sessions": len(self._sessions),
+            "cached_trees": cached,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "watching": self._watching(),
+        }
+
+
+tree_cache = TreeCache(max_sessions=TREE_CACHE_SESSIONS)
+
+async def get_tree(session_id: str, path: str = ".", depth: int = None) -> dict:
+    return await tree_cache.get(session_id, path, depth)
+
+def invalidate(session_id: str):
+    tree_cache.invalidate(session_id)
@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import zlib
+import itertools
+import msgpack
+
+# Encodings a client can negotiate through the WebSocket subprotocol; JSON text is the default
+JSON = "json"
+MSGPACK = "msgpack"
+MSGPACK_SUBPROTOCOL = "agent.msgpack.v1"
+
+# MessagePack payloads larger than this are split into chunk frames
+WS_CHUNK_SIZE = int(os.getenv("WS_CHUNK_SIZE", str(64 * 1024)))
+
+_chunk_ids = itertools.count(1)
+
+
+def negotiate(requested_subprotocols: list) -> tuple:
+    """
+    Picks the encoding for a new connection from the subprotocols the client offered.
+    Returns (encoding, subprotocol to accept with, or None).
+    """
+    if MSGPACK_SUBPROTOCOL in requested_subprotocols:
+        return MSGPACK, MSGPACK_SUBPROTOCOL
+    return JSON, None
+
+
+def encode_msgpack(message: dict) -> list:
+    """
+    Encodes a message as MessagePack binary frames. A large message is sent as consecutive
+    frames {"type": "chunk", "id", "index", "count", "data"}, whose `data` joined together is
+    the MessagePack encoding of the message.
+    """
+    payload = msgpack.packb(message, default=str)
+    if len(payload) <= WS_CHUNK_SIZE:
+        return [payload]
+    chunk_id = next(_chunk_ids)
+    count = (len(payload) + WS_CHUNK_SIZE - 1) // WS_CHUNK_SIZE
+    return [
+        msgpack.packb({"type": "chunk", "id": chunk_id, "index": index, "count": count, "data": payload[index * WS_CHUNK_SIZE:(index + 1) * WS_CHUNK_SIZE]})
+        for index in range(count)
+    ]
+
+
+def decode_msgpack(frames: list) -> dict:
+    """Decodes the frames of one message (the inverse of encode_msgpack, as a client would)."""
+    first = msgpack.unpackb(frames[0])
+    if first.get("type") != "chunk":
+        return first
+    return msgpack.unpackb(b"".join(msgpack.unpackb(frame)["data"] for frame in frames))
+
+
+# Benchmark (for testing purposes)
+def _deflated_size(frames: list) -> int:
+    # permessage-deflate compresses each frame with raw DEFLATE and drops the 4-byte sync tail
+    total = 0
+    for frame in frames:
+        compressor = zlib.compressobj(wbits=-15)
+        data = frame if isinstance(frame, bytes) else frame.encode('utf-8')
+        total += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total
+
+def _benchmark_messages() -> dict:
+    page = "\n".join(f"Paragraph {n}: The quick brown fox jumps over the lazy dog, \"quoted\" text and unicode – café." for n in range(3000))
+    plan = "\n".join(f"- [ ] CREATE_FILE: src/module_{n}.py" for n in range(500))
+    return {
+        "task_start": {"type": "task_start", "data": "Executing: CREATE_FILE src/app.py", "session_id": "3f2c1a", "seq": 12},
+        "plan": {"type": "plan", "data": plan, "session_id": "3f2c1a", "seq": 13},
+        "task_complete (extract_content)": {"type": "task_complete", "data": "Executing: EXTRACT_CONTENT https://example.com", "result": {"status": "success", "content": page}, "session_id": "3f2c1a", "seq": 14},
+    }
+
+def main(rounds: int = 200):
+    for name, message in _benchmark_messages().items():
+        print(name)
+        encoders = {
+            "json": lambda: [json.dumps(message)],
+            "msgpack": lambda: encode_msgpack(message),
+        }
+        for label, encode in encoders.items():
+            started = time.perf_counter()
+            for _ in range(rounds):
+                frames = encode()
+            elapsed = (time.perf_counter() - started) / rounds
+            raw = sum(len(frame if isinstance(frame, bytes) else frame.encode('utf-8')) for frame in frames)
+            print(f"  {label:>8}: {len(frames):>3} frame(s), {raw:>8} B raw, {_deflated_size(frames):>8} B deflated, encode {elapsed * 1e6:8.1f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the backend as the `app` package, as uvicorn does
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
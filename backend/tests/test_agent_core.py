@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from app import agent_core
+
+
+class RecordingManager:
+    def __init__(self):
+        self.messages = []
+
+    async def send_session_message(self, message, session_id, client_id):
+        self.messages.append(message)
+
+
+def _run(commands, max_parallel=4):
+    manager = RecordingManager()
+    asyncio.run(agent_core.execute_plan(commands, "s1", "c1", manager, max_parallel=max_parallel))
+    return manager.messages
+
+
+def _knowledge_tools(delays: dict, log: list):
+    """RETRIEVE_KNOWLEDGE steps that take `delays[key]` seconds, logging when they start and end."""
+    async def retrieve_knowledge(key, default=None):
+        log.append(("start", key))
+        await asyncio.sleep(delays[key])
+        log.append(("end", key))
+        return f"value of {key}"
+    return {"RETRIEVE_KNOWLEDGE": retrieve_knowledge}
+
+
+def test_independent_steps_run_concurrently_and_report_in_plan_order(monkeypatch):
+    delays = {"k0": 0.15, "k1": 0.1, "k2": 0.05, "k3": 0.0}
+    log = []
+    monkeypatch.setattr(agent_core, "_build_tool_map", lambda *args, **kwargs: _knowledge_tools(delays, log))
+    monkeypatch.setattr(agent_core.session_manager, "append_to_history", lambda session_id, message: None)
+    commands = [{"tool": "RETRIEVE_KNOWLEDGE", "args": key} for key in delays] + [{"tool": "FINISH", "args": "Done."}]
+
+    messages = _run(commands)
+
+    # All four started before the slowest finished, and the fastest finished first
+    assert [event for event, _ in log[:4]] == ["start"] * 4
+    assert log[4] == ("end", "k3")
+    completed = [message for message in messages if message["type"] == "task_complete"]
+    assert [message["result"] for message in completed] == [f"value of {key}" for key in delays]
+    assert messages[-1] == {"type": "finish", "data": "Done."}
+
+
+def test_dependent_steps_wait_for_each_other(monkeypatch):
+    delays = {"k0": 0.05, "k1": 0.0}
+    log = []
+    tools = _knowledge_tools(delays, log)
+    async def save_knowledge(key, value):
+        log.append(("save", key))
+    tools["SAVE_KNOWLEDGE"] = save_knowledge
+    monkeypatch.setattr(agent_core, "_build_tool_map", lambda *args, **kwargs: tools)
+    commands = [
+        {"tool": "RETRIEVE_KNOWLEDGE", "args": "k0"},
+        {"tool": "SAVE_KNOWLEDGE", "args": "k0 new"}, # must wait for the read of k0
+        {"tool": "RETRIEVE_KNOWLEDGE", "args": "k1"},
+    ]
+
+    _run(commands)
+
+    assert log.index(("save", "k0")) > log.index(("end", "k0"))
+    assert log.index(("end", "k1")) < log.index(("end", "k0"))
+
+
+def test_screenshot_waits_for_and_blocks_steps_on_its_file(monkeypatch):
+    log = []
+    async def take_screenshot(url, path):
+        log.append(("start", path))
+        await asyncio.sleep(0.05)
+        log.append(("end", path))
+    async def read_file_content(path):
+        log.append(("read", path))
+    tools = {"TAKE_SCREENSHOT": take_screenshot, "READ_FILE_CONTENT": read_file_content}
+    monkeypatch.setattr(agent_core, "_build_tool_map", lambda *args, **kwargs: tools)
+    commands = [
+        {"tool": "TAKE_SCREENSHOT", "args": "https://example.com shots/home.png"},
+        {"tool": "READ_FILE_CONTENT", "args": "shots/home.png"}, # must wait for the screenshot
+        {"tool": "READ_FILE_CONTENT", "args": "notes.txt"},
+    ]
+
+    _run(commands)
+
+    assert log.index(("read", "shots/home.png")) > log.index(("end", "shots/home.png"))
+    assert log.index(("read", "notes.txt")) < log.index(("end", "shots/home.png"))
+
+
+def test_results_stay_in_order_with_a_single_slot(monkeypatch):
+    delays = {"k0": 0.02, "k1": 0.0, "k2": 0.01}
+    log = []
+    monkeypatch.setattr(agent_core, "_build_tool_map", lambda *args, **kwargs: _knowledge_tools(delays, log))
+    commands = [{"tool": "RETRIEVE_KNOWLEDGE", "args": key} for key in delays]
+
+    messages = _run(commands, max_parallel=1)
+
+    assert log == [(event, key) for key in delays for event in ("start", "end")]
+    assert [message["result"] for message in messages if message["type"] == "task_complete"] == [f"value of {key}" for key in delays]
+
+
+def test_failing_step_stops_the_plan_and_the_error_comes_last(monkeypatch):
+    async def retrieve_knowledge(key, default=None):
+        if key == "bad":
+            raise ValueError("no such key")
+        await asyncio.sleep(0.02)
+        return key
+    monkeypatch.setattr(agent_core, "_build_tool_map", lambda *args, **kwargs: {"RETRIEVE_KNOWLEDGE": retrieve_knowledge})
+    commands = [{"tool": "RETRIEVE_KNOWLEDGE", "args": key} for key in ("k0", "bad", "k1")] + [{"tool": "EXECUTE_COMMAND", "args": "echo never"}]
+
+    messages = _run(commands)
+
+    assert [message["type"] for message in messages if message["type"] != "task_start"][-1] == "error"
+    assert "no such key" in messages[-1]["data"]
+    assert not any(message["type"] == "task_start" and "EXECUTE_COMMAND" in message["data"] for message in messages)
+
+
+def _stream_plan(monkeypatch, chunks, error=None):
+    """Serves `chunks` as the streamed plan, raising `error` after them, and fakes the shell."""
+    log = []
+    async def stream_gemini(prompt, **kwargs):
+        for chunk in chunks:
+            await asyncio.sleep(0.01)
+            log.append(("chunk", chunk))
+            yield chunk
+        if error is not None:
+            raise error
+    async def execute_command(command, session_id=None, **kwargs):
+        log.append(("step", command))
+        return command
+    monkeypatch.setattr(agent_core.gemini_handler, "stream_gemini", stream_gemini)
+    monkeypatch.setattr(agent_core.terminal_tools, "execute_command", execute_command)
+    monkeypatch.setattr(agent_core.session_manager, "append_to_history", lambda session_id, message: None)
+    return log
+
+
+def test_streamed_steps_run_before_the_plan_ends_and_finish_comes_last(monkeypatch):
+    chunks = ["- [ ] EXECUTE_COMMAND: echo 0\n", "- [ ] FINISH: Done.\n", "- [ ] EXECUTE_COMMAND: echo 1\n", "Trailing remarks."]
+    log = _stream_plan(monkeypatch, chunks)
+    manager = RecordingManager()
+
+    asyncio.run(agent_core.run_streaming_plan("prompt", "s1", "c1", manager))
+
+    # The first step ran while the plan was still streaming
+    assert log.index(("step", "echo 0")) < log.index(("chunk", chunks[-1]))
+    types = [message["type"] for message in manager.messages]
+    assert types.index("plan") < types.index("finish") == len(types) - 1
+    assert manager.messages[-1]["data"] == "Done."
+    assert [message["result"] for message in manager.messages if message["type"] == "task_complete"] == ["echo 0", "echo 1"]
+
+
+def test_stream_error_mid_plan_is_raised_without_finishing(monkeypatch):
+    chunks = ["- [ ] EXECUTE_COMMAND: echo 0\n", "- [ ] FINISH: Done.\n- [ ] EXECUTE_"]
+    log = _stream_plan(monkeypatch, chunks, error=RuntimeError("connection reset"))
+    manager = RecordingManager()
+
+    with pytest.raises(Exception, match="Failed to generate plan: connection reset"):
+        asyncio.run(agent_core.run_streaming_plan("prompt", "s1", "c1", manager))
+
+    # The step that arrived before the error ran; the held-back FINISH and the cut-off step did not
+    assert log.count(("step", "echo 0")) == 1
+    types = [message["type"] for message in manager.messages]
+    assert "finish" not in types and "plan" not in types
+    assert [message["result"] for message in manager.messages if message["type"] == "task_complete"] == ["echo 0"]
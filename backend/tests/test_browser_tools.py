@@ -0,0 +1,174 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import browser_tools, web_fetch
+
+PAGE = "<html><body><main><p>" + "Public page text. " * 20 + "</p></main></body></html>"
+
+
+class FakeResponse:
+    ok = True
+
+    async def all_headers(self):
+        return {}
+
+
+class FakePage:
+    """Renders every URL as text naming the visitor, which a click on "#login" signs in."""
+    def __init__(self, context):
+        self.context = context
+        self.url = "about:blank"
+        self.visits = []
+
+    def on(self, event, handler):
+        pass
+
+    def is_closed(self):
+        return False
+
+    async def goto(self, url, **kwargs):
+        self.url = url
+        self.visits.append(url)
+        return FakeResponse()
+
+    async def evaluate(self, script):
+        return f"{self.context.visitor} view of {self.url}"
+
+    async def click(self, selector):
+        if selector == "#login":
+            self.context.visitor = "signed-in"
+
+
+class FakeContext:
+    def __init__(self):
+        self.visitor = "anonymous"
+        self.pages = []
+
+    async def new_page(self):
+        page = FakePage(self)
+        self.pages.append(page)
+        return page
+
+    def set_default_timeout(self, timeout):
+        pass
+
+    async def close(self):
+        pass
+
+
+class FakeBrowser:
+    def on(self, event, handler):
+        pass
+
+    def is_connected(self):
+        return True
+
+    async def new_context(self):
+        return FakeContext()
+
+
+class FakePlaywright:
+    class chromium:
+        @staticmethod
+        async def launch(**kwargs):
+            return FakeBrowser()
+
+    async def start(self):
+        return self
+
+
+@pytest.fixture
+def browser(monkeypatch):
+    """A browser pool on a fake browser; static pages are served over HTTP as PAGE."""
+    monkeypatch.setattr(browser_tools, "async_playwright", FakePlaywright)
+    monkeypatch.setattr(browser_tools, "browser_pool", browser_tools.BrowserPool(warm_contexts=0))
+    handler = lambda request: httpx.Response(200, headers={"content-type": "text/html"}, text=PAGE)
+    monkeypatch.setattr(web_fetch, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(web_fetch, "extraction_cache", web_fetch.ExtractionCache())
+    return browser_tools.browser_pool
+
+
+def _run(main):
+    async def run():
+        await browser_tools.browser_pool.start()
+        return await main()
+    return asyncio.run(run())
+
+
+def test_browser_renderings_are_only_served_to_their_session(browser, monkeypatch):
+    monkeypatch.setattr(web_fetch, "FETCH_FAST_PATH", False)
+    url = "https://example.com/a"
+
+    async def main():
+        first = await browser_tools.extract_content(url, session_id="s1")
+        await browser_tools.navigate_to_url("https://example.com/b", session_id="s1")
+        again = await browser_tools.extract_content(url, session_id="s1")
+        other = await browser_tools.extract_content(url, session_id="s2")
+        return first, again, other
+
+    first, again, other = _run(main)
+    assert first == again == other == f"anonymous view of {url}"
+    assert browser._leased["s1"].page.visits == [url, "https://example.com/b"] # the second read came from the cache
+    assert browser._leased["s2"].page.visits == [url]
+    assert web_fetch.extraction_cache.stats()["session_entries"] == 2
+
+
+def test_renderings_go_with_the_session_context(browser, monkeypatch):
+    monkeypatch.setattr(web_fetch, "FETCH_FAST_PATH", False)
+
+    async def main():
+        await browser_tools.extract_content("https://example.com/a", session_id="s1")
+        await browser.release("s1")
+
+    _run(main)
+    assert web_fetch.extraction_cache.stats()["entries"] == 0
+
+
+def test_http_results_are_shared_until_the_session_logs_in(browser):
+    account = "https://example.com/account"
+
+    async def main():
+        shared = await browser_tools.extract_content(account, session_id="s1")
+        await browser_tools.interact_with_element("https://example.com/login", "#login", "click", session_id="s1")
+        signed_in = await browser_tools.extract_content(account, session_id="s1")
+        other = await browser_tools.extract_content(account, session_id="s2")
+        return shared, signed_in, other
+
+    shared, signed_in, other = _run(main)
+    assert "Public page text." in shared
+    assert signed_in == f"signed-in view of {account}"
+    assert other == shared
+    assert "s2" not in browser._leased # served from the shared cache, without a browser
+
+
+
+def test_page_steps_go_to_a_page_navigated_to_over_http(browser):
+    url = "https://example.com/article"
+    tools = browser_tools.BrowserTools("s1")
+
+    async def main():
+        await tools.navigate_to_url(url)
+        assert "s1" not in browser._leased # fetched without the browser
+        text = await tools.extract_text()
+        await tools.click_element("#login")
+        return text
+
+    assert _run(main) == f"anonymous view of {url}"
+    page = browser._leased["s1"].page
+    assert page.visits == [url]
+    assert page.context.visitor == "signed-in"
+
+
+def test_a_step_with_its_own_url_replaces_the_pending_page(browser, monkeypatch):
+    tools = browser_tools.BrowserTools("s1")
+
+    async def main():
+        await tools.navigate_to_url("https://example.com/first")
+        monkeypatch.setattr(web_fetch, "FETCH_FAST_PATH", False)
+        await browser_tools.extract_content("https://example.com/second", session_id="s1")
+        return await tools.extract_text()
+
+    assert _run(main) == "anonymous view of https://example.com/second"
+    assert browser._leased["s1"].page.visits == ["https://example.com/second"]
@@ -0,0 +1,105 @@
+import os
+import asyncio
+
+import pytest
+
+from app import filesystem_tools, workspace_tree
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(filesystem_tools, "SESSIONS_DIR", str(tmp_path))
+    monkeypatch.setattr(workspace_tree, "SESSIONS_DIR", str(tmp_path))
+    workspace = tmp_path / "s1" / "workspace"
+    workspace.mkdir(parents=True)
+    (workspace / "notes.txt").write_text("one\ntwo\nthree\n")
+    (tmp_path / "secret.txt").write_text("do not read\n")
+    # A sibling whose name starts with the workspace's
+    (tmp_path / "s1" / "workspace2").mkdir()
+    (tmp_path / "s1" / "workspace2" / "other.txt").write_text("other session\n")
+    return workspace
+
+
+def test_read_file_lines_reads_inside_the_workspace(workspace):
+    page = filesystem_tools._read_file_lines("notes.txt", "s1", start_line=2, end_line=3)
+    assert page["status"] == "success"
+    assert page["content"] == "two\nthree\n"
+
+
+@pytest.mark.parametrize("path", ["../../secret.txt", "../workspace2/other.txt", "/etc/passwd"])
+def test_read_file_lines_rejects_paths_outside_the_workspace(workspace, path):
+    with pytest.raises(PermissionError):
+        filesystem_tools._read_file_lines(path, "s1")
+
+
+@pytest.mark.parametrize("path", ["../../secret.txt", "../workspace2/other.txt", "/etc/passwd"])
+def test_read_file_content_rejects_paths_outside_the_workspace(workspace, path):
+    with pytest.raises(PermissionError):
+        filesystem_tools._read_file_content(path, "s1")
+
+
+@pytest.mark.parametrize("path", ["..", "../workspace2", "../../s1", "/etc"])
+def test_tree_rejects_paths_outside_the_workspace(workspace, path):
+    tree = workspace_tree._build_tree("s1", path, None)
+    assert tree["status"] == "error"
+    assert "tree" not in tree
+
+
+def test_tree_lists_the_workspace(workspace):
+    (workspace / "src").mkdir()
+    (workspace / "src" / "app.py").write_text("a = 1\n")
+    tree = workspace_tree._build_tree("s1", "src", None)
+    assert tree["status"] == "success"
+    assert [node["path"] for node in tree["tree"]] == [f"src{os.sep}app.py"]
+
+
+def test_file_content_endpoint_answers_403_on_traversal(workspace, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    # main.py serves the built frontend from ./static
+    (tmp_path / "static" / "assets").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    from app.main import app
+
+    client = TestClient(app)
+    assert client.get("/sessions/s1/file_content", params={"path": "../../secret.txt"}).status_code == 403
+    assert client.get("/sessions/s1/file_content", params={"path": "../../secret.txt", "start_line": 1}).status_code == 403
+    response = client.get("/sessions/s1/file_content", params={"path": "notes.txt", "start_line": 1, "end_line": 1})
+    assert response.status_code == 200
+    assert response.json()["content"] == "one\n"
+
+
+def test_write_buffer_writes_nothing_until_flushed(workspace):
+    async def run():
+        buffer = filesystem_tools.WriteBuffer("s1")
+        await buffer.create_folder("src/pkg")
+        await buffer.create_file("src/pkg/app.py", "a = 1\n")
+        await buffer.add_content("src/pkg/app.py", "b = 2\n")
+        await buffer.add_content("notes.txt", "four\n")
+        assert not (workspace / "src").exists()
+        assert (workspace / "notes.txt").read_text() == "one\ntwo\nthree\n"
+        await buffer.flush()
+        assert not buffer
+    asyncio.run(run())
+    assert (workspace / "src" / "pkg" / "app.py").read_text() == "a = 1\nb = 2\n"
+    assert (workspace / "notes.txt").read_text() == "one\ntwo\nthree\nfour\n"
+
+
+def test_write_buffer_create_supersedes_earlier_content(workspace):
+    async def run():
+        buffer = filesystem_tools.WriteBuffer("s1")
+        await buffer.add_content("notes.txt", "lost\n")
+        await buffer.create_file("notes.txt", "fresh\n")
+        await buffer.flush()
+    asyncio.run(run())
+    assert (workspace / "notes.txt").read_text() == "fresh\n"
+
+
+def test_write_buffer_rejects_bad_paths_when_buffering(workspace):
+    async def run():
+        buffer = filesystem_tools.WriteBuffer("s1")
+        with pytest.raises(FileNotFoundError):
+            await buffer.add_content("missing.txt", "x")
+        with pytest.raises(PermissionError):
+            await buffer.create_file("../../escape.txt", "x")
+        assert not buffer
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import threading
+
+import httpx
+import pytest
+
+from app import gemini_handler, llm_cache, model_router
+
+PRIMARY, FALLBACK = gemini_handler.GEMINI_MODELS[:2]
+ANSWER = {"candidates": [{"content": {"parts": [{"text": "fallback answer"}]}}]}
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """Answers the primary model with `primary_body` and the fallback model with a valid response."""
+    def serve(primary_body: str):
+        def handler(request):
+            if PRIMARY in request.url.path:
+                return httpx.Response(200, text=primary_body)
+            return httpx.Response(200, json=ANSWER)
+        monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+        monkeypatch.setattr(gemini_handler, "CACHE_ENABLED", False)
+        monkeypatch.setattr(gemini_handler, "router", model_router.ModelRouter(gemini_handler.GEMINI_MODELS))
+        monkeypatch.setattr(gemini_handler, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(gemini_handler, "_semaphore", None)
+    return serve
+
+
+@pytest.mark.parametrize("primary_body", [
+    "<html>Service Unavailable</html>", # not JSON
+    json.dumps({"candidates": [{"content": {"parts": []}}, "oops"]})[:-1], # truncated
+    json.dumps({"candidates": ["not an object"]}),
+])
+def test_malformed_response_falls_through_to_the_fallback_model(serve, primary_body):
+    serve(primary_body)
+    assert asyncio.run(gemini_handler.call_gemini("hello")) == "fallback answer"
+    stats = gemini_handler.router.stats()
+    assert stats[PRIMARY]["failures"] == 1
+    assert stats[FALLBACK]["failures"] == 0
+
+
+def test_cache_database_is_used_off_the_event_loop(serve, monkeypatch, tmp_path):
+    serve("not json")
+    monkeypatch.setattr(gemini_handler, "CACHE_ENABLED", True)
+    monkeypatch.setattr(gemini_handler, "_cache", llm_cache.ResponseCache(str(tmp_path / "responses.db")))
+    threads = []
+    connect = llm_cache.ResponseCache._connect
+    def recording_connect(cache):
+        threads.append(threading.current_thread())
+        return connect(cache)
+    monkeypatch.setattr(llm_cache.ResponseCache, "_connect", recording_connect)
+
+    async def run():
+        first = await gemini_handler.call_gemini("hello")
+        gemini_handler._cache._memory.clear() # the second answer comes from disk
+        second = await gemini_handler.call_gemini("hello")
+        return first, second, await gemini_handler.get_cache_stats()
+
+    first, second, stats = asyncio.run(run())
+    assert first == second == "fallback answer"
+    assert stats["disk_hits"] == 1
+    assert threads and threading.main_thread() not in threads
+
+
+def _sse(*chunks: str) -> str:
+    return "".join(f"data: {chunk}\n\n" for chunk in chunks)
+
+
+def test_stream_counts_as_a_success_only_once_it_completes(serve):
+    serve(_sse(json.dumps(ANSWER), '{"candidates": [')) # a valid chunk, then a broken one
+
+    async def consume():
+        return [chunk async for chunk in gemini_handler.stream_gemini("hello")]
+
+    with pytest.raises(Exception, match="malformed chunk"):
+        asyncio.run(consume())
+    stats = gemini_handler.router.stats()
+    assert stats[PRIMARY]["requests"] == stats[PRIMARY]["failures"] == 1
+
+
+def test_completed_stream_is_recorded_as_a_success(serve):
+    serve(_sse(json.dumps(ANSWER)))
+
+    async def consume():
+        return [chunk async for chunk in gemini_handler.stream_gemini("hello")]
+
+    assert asyncio.run(consume()) == ["fallback answer"]
+    stats = gemini_handler.router.stats()
+    assert stats[PRIMARY]["requests"] == 1
+    assert stats[PRIMARY]["failures"] == 0
+
+
+def test_half_open_model_is_only_claimed_when_a_request_is_sent_to_it(serve, monkeypatch):
+    serve(json.dumps(ANSWER))
+    router = model_router.ModelRouter(gemini_handler.GEMINI_MODELS, failure_threshold=1, cooldown=0)
+    router.record_failure(FALLBACK) # opens, and is half open again at once
+    monkeypatch.setattr(gemini_handler, "router", router)
+
+    asyncio.run(gemini_handler.call_gemini("hello")) # answered by the primary
+    assert not router.stats()[FALLBACK]["probing"]
+    assert router.try_claim(FALLBACK)
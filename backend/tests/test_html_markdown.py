@@ -0,0 +1,44 @@
+from app.html_markdown import MarkdownConverter, html_to_markdown
+
+ARTICLE = "<h1>Title</h1>" + "<p>" + "The article text. " * 20 + "</p>"
+
+
+def test_sidebar_layout_wrapper_keeps_its_main_content():
+    html = f'<body><div class="layout has-sidebar"><main>{ARTICLE}</main><div class="sidebar">Links</div></div></body>'
+    markdown = html_to_markdown(html)
+    assert markdown.startswith("# Title")
+    assert "The article text." in markdown
+    assert "Links" not in markdown
+
+
+def test_boilerplate_element_wrapping_main_is_kept():
+    html = f'<body><div class="sidebar-wrapper"><nav>Menu</nav><article>{ARTICLE}</article></div></body>'
+    markdown = html_to_markdown(html)
+    assert "The article text." in markdown
+    assert "Menu" not in markdown
+
+
+def test_boilerplate_class_tokens_are_dropped():
+    html = f'<body><div id="site-nav">Home</div><div class="cookie-banner">Accept</div><div class="post-body">{ARTICLE}</div></body>'
+    markdown = html_to_markdown(html)
+    assert "The article text." in markdown
+    assert "Home" not in markdown
+    assert "Accept" not in markdown
+
+
+def test_page_made_only_of_boilerplate_is_converted_unfiltered():
+    html = '<body><div class="sidebar"><p>Only text on the page</p><script>var x = 1;</script></div></body>'
+    assert html_to_markdown(html) == "Only text on the page"
+
+
+def test_chunked_feed_matches_whole_feed():
+    html = f'<body><div class="layout has-sidebar"><div class="menu"><a href="/a">A</a></div><main>{ARTICLE}</main></div></body>'
+    converter = MarkdownConverter()
+    for index in range(0, len(html), 7):
+        converter.feed(html[index:index + 7])
+    assert converter.close() == html_to_markdown(html)
+
+
+def test_invisible_element_wrapping_an_article_stays_dropped():
+    html = f'<body><template><article>Template text</article></template><main>{ARTICLE}</main></body>'
+    assert "Template text" not in html_to_markdown(html)
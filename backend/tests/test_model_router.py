@@ -0,0 +1,69 @@
+from app import model_router
+from app.model_router import ModelRouter
+
+
+def _tripped_router(monkeypatch):
+    """A router whose primary model's breaker has opened and cooled down."""
+    clock = [1000.0]
+    monkeypatch.setattr(model_router.time, "monotonic", lambda: clock[0])
+    router = ModelRouter(["primary", "fallback"], failure_threshold=1, cooldown=30, probe_timeout=120)
+    router.record_failure("primary")
+    assert router.candidates() == ["fallback"]
+    clock[0] += 31
+    return router, clock
+
+
+def test_half_open_breaker_lets_a_single_probe_through(monkeypatch):
+    router, _ = _tripped_router(monkeypatch)
+    assert router.candidates() == ["primary", "fallback"]
+    assert router.try_claim("primary") # the probe
+    assert not router.try_claim("primary")
+    assert router.candidates() == ["fallback"]
+    assert router.stats()["primary"]["probing"]
+
+
+def test_listing_candidates_does_not_claim_the_probe(monkeypatch):
+    router, _ = _tripped_router(monkeypatch)
+    assert router.candidates() == ["primary", "fallback"]
+    assert router.candidates() == ["primary", "fallback"] # never dispatched, so still free
+    assert not router.stats()["primary"]["probing"]
+    assert router.try_claim("primary")
+
+
+def test_closed_and_all_open_models_can_always_be_claimed(monkeypatch):
+    router, clock = _tripped_router(monkeypatch)
+    assert router.try_claim("fallback")
+    assert router.try_claim("fallback")
+    router.try_claim("primary")
+    router.record_failure("primary")
+    clock[0] += 1
+    router.record_failure("fallback")
+    assert router.candidates() == ["primary", "fallback"] # every breaker open, soonest first
+    assert router.try_claim("fallback") and router.try_claim("primary")
+
+
+def test_successful_probe_closes_the_breaker(monkeypatch):
+    router, _ = _tripped_router(monkeypatch)
+    router.try_claim("primary")
+    router.record_success("primary", 0.1)
+    assert router.candidates() == ["primary", "fallback"]
+    assert router.try_claim("primary") and router.try_claim("primary")
+
+
+def test_failed_probe_reopens_the_breaker(monkeypatch):
+    router, clock = _tripped_router(monkeypatch)
+    router.try_claim("primary")
+    router.record_failure("primary")
+    assert router.stats()["primary"]["state"] == model_router.OPEN
+    clock[0] += 31
+    assert router.candidates() == ["primary", "fallback"]
+    assert router.try_claim("primary")
+
+
+def test_abandoned_probe_is_handed_out_again_after_the_probe_timeout(monkeypatch):
+    router, clock = _tripped_router(monkeypatch)
+    router.try_claim("primary")
+    clock[0] += 121
+    assert router.candidates() == ["primary", "fallback"]
+    assert router.try_claim("primary")
+    assert not router.try_claim("primary")
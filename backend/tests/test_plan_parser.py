@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from app.plan_parser import PlanParser, iter_commands, parse_plan
+
+PLAN = """Here is the plan.
+
+- [ ] CREATE_FILE: src/app.py
+- [ ] ADD_CONTENT: src/app.py
+```python
+def main():
+    print("- [ ] not a step")
+
+```
+- [ ] ADD_CONTENT: empty.txt
+- [ ] EXECUTE_COMMAND: python src/app.py
+- [ ] FINISH: Done."""
+
+EXPECTED = [
+    {"tool": "CREATE_FILE", "args": "src/app.py"},
+    {"tool": "ADD_CONTENT", "path": "src/app.py", "content": 'def main():\n    print("- [ ] not a step")\n'},
+    {"tool": "ADD_CONTENT", "path": "empty.txt", "content": ""},
+    {"tool": "EXECUTE_COMMAND", "args": "python src/app.py"},
+    {"tool": "FINISH", "args": "Done."},
+]
+
+
+def _split(text: str, cuts: list) -> list:
+    bounds = [0] + sorted(cuts) + [len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def test_whole_plan():
+    assert parse_plan(PLAN) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_fixed_size_chunks(size):
+    assert list(iter_commands(PLAN[i:i + size] for i in range(0, len(PLAN), size))) == EXPECTED
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_chunk_splits(seed):
+    rng = random.Random(seed)
+    cuts = rng.sample(range(1, len(PLAN)), rng.randint(1, 40))
+    assert list(iter_commands(_split(PLAN, cuts))) == EXPECTED
+
+
+def test_every_single_split_point():
+    for cut in range(len(PLAN) + 1):
+        assert list(iter_commands([PLAN[:cut], PLAN[cut:]])) == EXPECTED, cut
+
+
+def test_commands_are_returned_as_soon_as_complete():
+    parser = PlanParser()
+    assert parser.feed("- [ ] CREATE_FILE: a.py\n- [ ] ADD_") == [{"tool": "CREATE_FILE", "args": "a.py"}]
+    assert parser.feed("CONTENT: a.py\n```\nx = 1\n") == []
+    assert parser.feed("```\n") == [{"tool": "ADD_CONTENT", "path": "a.py", "content": "x = 1"}]
+    assert parser.close() == []
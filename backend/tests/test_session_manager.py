@@ -0,0 +1,125 @@
+import json
+import time
+import asyncio
+from app import session_manager
+
+
+def _session(tmp_path, monkeypatch, session_id="s1"):
+    monkeypatch.setattr(session_manager, "SESSIONS_DIR", str(tmp_path))
+    monkeypatch.setattr(session_manager, "_index_cache", session_manager.OrderedDict())
+    (tmp_path / session_id).mkdir()
+    return session_id
+
+
+def _messages(tmp_path, session_id):
+    with open(tmp_path / session_id / "history.jsonl", encoding="utf-8") as f:
+        return [json.loads(line)["data"] for line in f]
+
+
+def test_close_during_flush_writes_messages_appended_meanwhile(tmp_path, monkeypatch):
+    session_id = _session(tmp_path, monkeypatch)
+    write = session_manager.HistoryWriter._write
+    def slow_write(self, batch):
+        time.sleep(0.2)
+        write(self, batch)
+    monkeypatch.setattr(session_manager.HistoryWriter, "_write", slow_write)
+
+    async def run():
+        session_manager.append_to_history(session_id, {"data": "one"})
+        # The writer's own batch flush is now writing "one"
+        await asyncio.sleep(session_manager.HISTORY_FLUSH_INTERVAL + 0.1)
+        session_manager.append_to_history(session_id, {"data": "two"})
+        await session_manager.close_history(session_id)
+
+    asyncio.run(run())
+    assert _messages(tmp_path, session_id) == ["one", "two"]
+
+
+def test_messages_are_written_in_order(tmp_path, monkeypatch):
+    session_id = _session(tmp_path, monkeypatch)
+
+    async def run():
+        for n in range(50):
+            session_manager.append_to_history(session_id, {"data": n})
+            if n % 10 == 0:
+                await asyncio.sleep(0)
+        await session_manager.close_history(session_id)
+
+    asyncio.run(run())
+    assert _messages(tmp_path, session_id) == list(range(50))
+
+
+def _write_history(tmp_path, session_id, messages, mode="a"):
+    with open(tmp_path / session_id / "history.jsonl", mode, encoding="utf-8") as f:
+        for message in messages:
+            f.write(json.dumps({"data": message}) + "\n")
+
+
+def _page(session_id, limit=None, before=None):
+    history, cursor = session_manager.get_history_page(session_id, limit=limit, before=before)
+    return [message["data"] for message in history], cursor
+
+
+def test_history_pages_walk_back_to_the_start(tmp_path, monkeypatch):
+    session_id = _session(tmp_path, monkeypatch)
+    _write_history(tmp_path, session_id, range(5))
+
+    assert _page(session_id) == ([0, 1, 2, 3, 4], None)
+    assert _page(session_id, limit=2) == ([3, 4], 3)
+    assert _page(session_id, limit=2, before=3) == ([1, 2], 1)
+    assert _page(session_id, limit=2, before=1) == ([0], None)
+    assert _page(session_id, limit=2, before=0) == ([], None)
+    assert _page(session_id, before=99) == ([0, 1, 2, 3, 4], None)
+
+
+def test_index_picks_up_appended_messages_but_not_a_partial_line(tmp_path, monkeypatch):
+    session_id = _session(tmp_path, monkeypatch)
+    _write_history(tmp_path, session_id, range(3))
+    assert _page(session_id, limit=1) == ([2], 2)
+
+    _write_history(tmp_path, session_id, [3, 4])
+    with open(tmp_path / session_id / "history.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"data": 5')
+    assert _page(session_id, limit=2) == ([3, 4], 3)
+    assert _page(session_id, limit=2, before=3) == ([1, 2], 1)
+
+
+def test_index_is_rebuilt_when_the_history_is_truncated(tmp_path, monkeypatch):
+    session_id = _session(tmp_path, monkeypatch)
+    _write_history(tmp_path, session_id, range(10))
+    assert _page(session_id, limit=3) == ([7, 8, 9], 7)
+
+    _write_history(tmp_path, session_id, ["a", "b"], mode="w")
+    assert _page(session_id) == (["a", "b"], None)
+    assert _page(session_id, limit=1) == (["b"], 1)
+
+
+def test_index_is_rebuilt_when_missing_or_damaged(tmp_path, monkeypatch):
+    session_id = _session(tmp_path, monkeypatch)
+    _write_history(tmp_path, session_id, range(4))
+    assert _page(session_id, limit=2) == ([2, 3], 2)
+    index_file = tmp_path / session_id / "history.idx"
+
+    index_file.unlink()
+    assert _page(session_id, limit=2) == ([2, 3], 2)
+    assert index_file.stat().st_size == 4 * session_manager.INDEX_ENTRY.size
+
+    with open(index_file, "ab") as f:
+        f.write(b"\x01\x02\x03") # a torn entry
+    _write_history(tmp_path, session_id, [4])
+    assert _page(session_id, limit=2, before=4) == ([2, 3], 2)
+    assert _page(session_id) == ([0, 1, 2, 3, 4], None)
+    assert index_file.stat().st_size == 5 * session_manager.INDEX_ENTRY.size
+
+
+def test_index_entries_already_read_are_kept_in_memory(tmp_path, monkeypatch):
+    session_id = _session(tmp_path, monkeypatch)
+    _write_history(tmp_path, session_id, range(3))
+    assert _page(session_id) == ([0, 1, 2], None)
+
+    # Clobber the entries read so far; only what is appended past them is read from disk
+    index_file = tmp_path / session_id / "history.idx"
+    index_file.write_bytes(b"\0" * index_file.stat().st_size)
+    _write_history(tmp_path, session_id, [3, 4])
+    assert _page(session_id) == ([0, 1, 2, 3, 4], None)
+    assert _page(session_id, limit=2, before=2) == ([0, 1], None)
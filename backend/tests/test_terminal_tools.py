@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from app import terminal_tools
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    """Runs commands one after another in the persistent shell of session s1."""
+    monkeypatch.setattr(terminal_tools, "SESSIONS_DIR", str(tmp_path))
+    (tmp_path / "s1" / "workspace" / "sub").mkdir(parents=True)
+    shells = []
+    start = terminal_tools.ShellSession.start
+    async def recording_start(self):
+        shells.append(self)
+        await start(self)
+    monkeypatch.setattr(terminal_tools.ShellSession, "start", recording_start)
+
+    def run(*commands, timeout=10):
+        async def main():
+            pool = terminal_tools.ShellPool()
+            monkeypatch.setattr(terminal_tools, "shell_pool", pool)
+            try:
+                return [await terminal_tools.execute_command(command, session_id="s1", timeout=timeout) for command in commands]
+            finally:
+                await pool.close_all()
+                # Reap the killed shells before the loop goes away
+                for shell in shells:
+                    await shell.process.wait()
+        return asyncio.run(main())
+    return run
+
+
+def test_shell_keeps_its_state_between_commands(run, tmp_path):
+    results = run("cd sub && export GREETING=hi", "pwd; echo $GREETING")
+    assert results[1] == f"STDOUT:\n{tmp_path / 's1' / 'workspace' / 'sub'}\nhi\n"
+
+
+def test_output_without_a_trailing_newline(run):
+    results = run("printf foo", "printf 'bar' >&2", "echo next")
+    assert results[0] == "STDOUT:\nfoo\n"
+    assert results[1] == "STDOUT:\n\nSTDERR:\nbar\n"
+    assert results[2] == "STDOUT:\nnext\n"
+
+
+def test_syntax_error_does_not_derail_the_shell(run, tmp_path):
+    results = run("cd sub", "if then", "echo 'it'\"'\"'s fine'; pwd")
+    assert "syntax error" in results[1]
+    assert "Command exited with code: 2" in results[1]
+    assert results[2] == f"STDOUT:\nit's fine\n{tmp_path / 's1' / 'workspace' / 'sub'}\n"
+
+
+def test_exit_reports_its_code_and_the_next_command_gets_a_new_shell(run, tmp_path):
+    results = run("cd sub", "echo leaving; exit 3", "pwd")
+    assert results[1] == "STDOUT:\nleaving\nCommand exited with code: 3\nThe shell exited; the next command starts in a new shell.\n"
+    assert results[2] == f"STDOUT:\n{tmp_path / 's1' / 'workspace'}\n"
+
+
+def test_timeout_keeps_partial_output_and_restarts_the_shell(run, tmp_path):
+    results = run("cd sub", "echo started; sleep 5", "pwd", timeout=1)
+    assert results[1].startswith("Error: Command timed out after 1 seconds.")
+    assert "STDOUT:\nstarted\n" in results[1]
+    assert results[2] == f"STDOUT:\n{tmp_path / 's1' / 'workspace'}\n"
+
+
+def test_truncated_output_points_to_a_log_the_filesystem_tools_can_read(run, tmp_path, monkeypatch):
+    from app import filesystem_tools
+    monkeypatch.setattr(filesystem_tools, "SESSIONS_DIR", str(tmp_path))
+    result = run("seq 1 20000")[0]
+    assert "... [" in result and "bytes omitted] ..." in result
+    log_path = result.rsplit("in the workspace: ", 1)[1].strip()
+    assert log_path.startswith(".logs")
+    content = filesystem_tools._read_file_content(log_path, "s1")["content"]
+    assert content.startswith("$ seq 1 20000\n1\n2\n")
+    assert content.endswith("\n19999\n20000\n")
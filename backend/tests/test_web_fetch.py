@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import web_fetch
+
+PAGE = "<html><body><main><p>" + "Static page text. " * 20 + "</p></main></body></html>"
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """Answers every request with the given status, content type and body."""
+    def serve(status: int, content_type: str = "text/html", body: str = PAGE):
+        handler = lambda request: httpx.Response(status, headers={"content-type": content_type}, text=body)
+        monkeypatch.setattr(web_fetch, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(web_fetch, "extraction_cache", web_fetch.ExtractionCache())
+    return serve
+
+
+def test_static_page_is_returned_and_cached(serve):
+    serve(200)
+    contents, reason = asyncio.run(web_fetch.fetch_extractions("https://example.com/page", ("markdown",)))
+    assert reason is None
+    assert "Static page text." in contents["markdown"]
+    assert web_fetch.extraction_cache.stats()["entries"] == 1
+
+
+@pytest.mark.parametrize("status", [404, 410, 500])
+def test_error_pages_are_left_to_the_browser_and_not_cached(serve, status):
+    serve(status)
+    contents, reason = asyncio.run(web_fetch.fetch_extractions("https://example.com/gone"))
+    assert contents is None
+    assert reason == f"status {status}"
+    assert web_fetch.extraction_cache.stats()["entries"] == 0
+
+
+def test_plain_text_error_is_not_cached(serve):
+    serve(404, "text/plain", "Not Found")
+    contents, reason = asyncio.run(web_fetch.fetch_extractions("https://example.com/missing.txt"))
+    assert contents is None
+    assert web_fetch.extraction_cache.stats()["entries"] == 0
+
+
+def test_shared_client_keeps_no_cookies(monkeypatch):
+    monkeypatch.setattr(web_fetch, "_client", None)
+    client = web_fetch._get_client()
+    request = httpx.Request("GET", "https://example.com/")
+    client.cookies.extract_cookies(httpx.Response(200, headers={"set-cookie": "sid=secret; Path=/"}, request=request))
+    assert not client.cookies
+    asyncio.run(client.aclose())
+
+
+def test_session_renderings_are_kept_apart_from_shared_results():
+    cache = web_fetch.ExtractionCache()
+    cache.put("https://example.com/", "text", "shared", {})
+    cache.put("https://example.com/", "text", "s1 copy", {}, session_id="s1")
+
+    assert asyncio.run(cache.get("https://example.com/", "text", "s1")) == "s1 copy"
+    assert asyncio.run(cache.get("https://example.com/", "text", "s2")) == "shared"
+    assert asyncio.run(cache.get("https://example.com/", "text", "s2", shared=False)) is None
+    cache.discard_session("s1")
+    assert asyncio.run(cache.get("https://example.com/", "text", "s1")) == "shared"
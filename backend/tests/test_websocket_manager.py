@@ -0,0 +1,56 @@
+import asyncio
+
+from app.websocket_manager import ClientChannel, COALESCE_MAX_CHARS
+
+
+class SlowSocket:
+    """A socket that holds every send until released, so that messages pile up in the queue."""
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+
+    async def send_json(self, message):
+        await self.release.wait()
+        self.sent.append(message)
+
+
+def _deliver(messages: list) -> list:
+    async def run():
+        socket = SlowSocket()
+        channel = ClientChannel(socket, "c1")
+        channel.put({"type": "status", "data": "blocker", "session_id": "s0", "seq": 1})
+        await asyncio.sleep(0) # the writer takes the blocker and waits on the socket
+        for message in messages:
+            channel.put(message)
+        socket.release.set()
+        while channel._queue:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        channel.close()
+        return socket.sent[1:]
+    return asyncio.run(run())
+
+
+def _chunk(data: str, seq: int, session_id: str = "s1") -> dict:
+    return {"type": "plan_chunk", "data": data, "session_id": session_id, "seq": seq}
+
+
+def test_consecutive_chunks_of_a_session_are_merged():
+    sent = _deliver([_chunk("a", 1), _chunk("b", 2), _chunk("c", 3)])
+    assert sent == [_chunk("abc", 3)]
+
+
+def test_chunks_of_different_sessions_are_not_merged():
+    sent = _deliver([_chunk("a", 1, "s1"), _chunk("b", 2, "s2")])
+    assert [message["data"] for message in sent] == ["a", "b"]
+
+
+def test_chunks_with_a_seq_gap_are_not_merged():
+    sent = _deliver([_chunk("a", 1), _chunk("b", 3)])
+    assert [message["data"] for message in sent] == ["a", "b"]
+
+
+def test_merged_plan_chunks_are_capped():
+    half = "x" * (COALESCE_MAX_CHARS // 2 + 1)
+    sent = _deliver([_chunk(half, 1), _chunk(half, 2), _chunk("y", 3)])
+    assert [len(message["data"]) for message in sent] == [len(half), len(half) + 1]
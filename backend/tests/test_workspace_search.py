@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from app import workspace_search
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace_search, "SESSIONS_DIR", str(tmp_path))
+    monkeypatch.setattr(workspace_search, "_indexes", workspace_search.OrderedDict())
+    workspace = tmp_path / "s1" / "workspace"
+    (workspace / "src").mkdir(parents=True)
+    (workspace / "src" / "app.py").write_text("import os\n\ndef Handler():\n    return handle_request(42)\n")
+    (workspace / "README.md").write_text("Call handle_request to serve.\n")
+    (workspace / "node_modules" / "lib").mkdir(parents=True)
+    (workspace / "node_modules" / "lib" / "index.js").write_text("handle_request()\n")
+    (workspace / "logo.png").write_bytes(b"\x89PNG\0handle_request")
+    return workspace
+
+
+def _search(query, **options):
+    options = {"regex": False, "case_sensitive": False, "glob": None, "max_results": 100, **options}
+    return workspace_search._search("s1", query, **options)
+
+
+def _hits(result):
+    return [(hit["path"], hit["line"]) for hit in result["results"]]
+
+
+def test_literal_search_skips_binary_files_and_skipped_dirs(workspace):
+    result = _search("HANDLE_REQUEST")
+    assert result["status"] == "success"
+    assert sorted(_hits(result)) == [("README.md", 1), (os.path.join("src", "app.py"), 4)]
+
+
+def test_case_sensitive_and_glob(workspace):
+    assert _hits(_search("handler", case_sensitive=True)) == []
+    assert _hits(_search("handle_request", glob="*.md")) == [("README.md", 1)]
+
+
+def test_regex_search(workspace):
+    result = _search(r"handle_\w+\(\d+\)", regex=True)
+    assert _hits(result) == [(os.path.join("src", "app.py"), 4)]
+    assert result["results"][0]["column"] == 12
+
+
+def test_literal_runs_of_a_regex():
+    assert workspace_search._literal_runs(r"handle_\w+\(\d+\)") == ["handle_"]
+    assert workspace_search._literal_runs(r"foo(bar|baz)qux") == ["foo", "qux"]
+
+
+def test_index_follows_changes_once_marked_stale(workspace):
+    assert _hits(_search("serve")) == [("README.md", 1)]
+    (workspace / "README.md").unlink()
+    (workspace / "src" / "server.py").write_text("# serve forever\n")
+    workspace_search._mark_stale("s1")
+    assert _hits(_search("serve")) == [(os.path.join("src", "server.py"), 1)]
+
+
+def test_invalid_regex_and_missing_workspace(workspace):
+    assert _search("(", regex=True)["status"] == "error"
+    assert workspace_search._search("nope", "x", False, False, None, 10)["status"] == "error"
+
+
+def test_max_results_truncates(workspace):
+    (workspace / "many.txt").write_text("needle\n" * 10)
+    result = _search("needle", max_results=3)
+    assert len(result["results"]) == 3
+    assert result["truncated"]